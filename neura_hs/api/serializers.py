@@ -1,21 +1,18 @@
 from rest_framework import serializers
 
 from gallery.models import RealCard
-from decks.models import Deck, Inclusion
+from decks.models import Deck, Inclusion, Format
+from core.services.deck_utils import get_similar_decks
+from core.services.trends import TREND_PERIODS
+from core.services.typeahead import MAX_SUGGESTIONS
+from .services.query_plan import QueryPlanMixin
 
 
-class FilterCardListSerializer(serializers.ListSerializer):
-
-    def to_representation(self, data):
-        data = data.filter(collectible=True)
-        return super().to_representation(data)
-
-    def update(self, instance, validated_data):
-        pass
-
-
-class RealCardSerializer(serializers.ModelSerializer):
+class RealCardSerializer(QueryPlanMixin, serializers.ModelSerializer):
     """ Base Card serializer """
+    select_related_fields = ('card_set',)
+    prefetch_related_fields = ('card_class', 'tribe')
+
     card_type = serializers.CharField(source='get_card_type_display')
     card_set = serializers.SlugRelatedField(slug_field='name', read_only=True)
     card_class = serializers.SlugRelatedField(slug_field='name', read_only=True, many=True)
@@ -27,7 +24,6 @@ class RealCardSerializer(serializers.ModelSerializer):
 class RealCardListSerializer(RealCardSerializer):
 
     class Meta:
-        list_serializer_class = FilterCardListSerializer
         model = RealCard
         fields = ('dbf_id', 'card_id', 'name', 'collectible', 'card_type', 'cost', 'attack', 'health', 'durability',
                   'armor', 'card_class', 'card_set', 'text', 'rarity')
@@ -52,7 +48,7 @@ class RealCardInDeckSerializer(RealCardSerializer):
         ref_name = 'CardInDeck'
 
 
-class InclusionSerializer(serializers.ModelSerializer):
+class InclusionSerializer(QueryPlanMixin, serializers.ModelSerializer):
     """ Сериализация списка карт в колоде """
 
     card = RealCardInDeckSerializer()
@@ -63,7 +59,8 @@ class InclusionSerializer(serializers.ModelSerializer):
         ref_name = 'CardInclusion'
 
 
-class DeckSerializer(serializers.ModelSerializer):
+class DeckSerializer(QueryPlanMixin, serializers.ModelSerializer):
+    select_related_fields = ('deck_class', 'deck_format')
 
     deck_class = serializers.SlugRelatedField(slug_field='name', read_only=True)
     deck_format = serializers.SlugRelatedField(slug_field='name', read_only=True)
@@ -73,3 +70,66 @@ class DeckSerializer(serializers.ModelSerializer):
     class Meta:
         model = Deck
         fields = ('id', 'deck_format', 'deck_class', 'string', 'created', 'cards')
+
+
+class DecodedDeckSerializer(DeckSerializer):
+    """ Колода, расшифрованная по каталогу в памяти (id - только у колод, уже сохраненных в БД) """
+
+    cards = InclusionSerializer(source='decoded_inclusions', many=True)
+
+
+class DeckDetailSerializer(DeckSerializer):
+
+    similar = serializers.SerializerMethodField()
+
+    class Meta(DeckSerializer.Meta):
+        fields = DeckSerializer.Meta.fields + ('similar',)
+
+    def get_similar(self, obj) -> list[dict]:
+        return [{'id': deck.pk, 'num_matches': deck.num_matches} for deck in get_similar_decks(obj)]
+
+
+class TrendsQuerySerializer(serializers.Serializer):
+
+    days = serializers.ChoiceField(choices=TREND_PERIODS, default=TREND_PERIODS[0], help_text='Period (days)')
+    dformat = serializers.SlugRelatedField(slug_field='name', queryset=Format.objects.all(), required=False,
+                                           help_text='Format name')
+
+
+class ClassTrendSerializer(serializers.Serializer):
+
+    deck_class = serializers.CharField(source='class.name')
+    num_decks = serializers.IntegerField()
+    previous = serializers.IntegerField(help_text='Number of decks in the previous period')
+    share = serializers.FloatField(help_text='Share of decks in the period')
+
+
+class CardTrendSerializer(serializers.Serializer):
+
+    dbf_id = serializers.IntegerField(source='card.dbf_id')
+    name = serializers.CharField(source='card.name')
+    num_decks = serializers.IntegerField()
+    previous = serializers.IntegerField(help_text='Number of decks in the previous period')
+    share = serializers.FloatField(help_text='Share of decks in the period')
+
+
+class TrendsSerializer(serializers.Serializer):
+
+    days = serializers.IntegerField()
+    num_decks = serializers.IntegerField()
+    classes = ClassTrendSerializer(many=True)
+    cards = CardTrendSerializer(many=True)
+
+
+class SuggestQuerySerializer(serializers.Serializer):
+
+    q = serializers.CharField(max_length=100, help_text='Beginning of the card name (typos are tolerated)')
+    limit = serializers.IntegerField(min_value=1, max_value=MAX_SUGGESTIONS, default=10)
+
+
+class CardSuggestionSerializer(serializers.Serializer):
+
+    dbf_id = serializers.IntegerField()
+    name = serializers.CharField()
+    url = serializers.CharField(help_text='Card page')
+    score = serializers.FloatField(help_text='Match score (the higher, the better)')
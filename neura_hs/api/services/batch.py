@@ -0,0 +1,43 @@
+from typing import Optional
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+MAX_BATCH_SIZE = 1000
+
+
+def parse_id_list(value: Optional[str], param: str) -> list[int]:
+    """ Список целых id из параметра запроса (через запятую, порядок сохраняется) """
+    if not value:
+        raise ValidationError({param: 'Comma-separated integer ids are required'})
+    try:
+        ids = [int(item) for item in value.split(',') if item.strip()]
+    except ValueError:
+        raise ValidationError({param: 'Comma-separated integer ids are required'})
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValidationError({param: f'No more than {MAX_BATCH_SIZE} ids per request'})
+    return ids
+
+
+class BatchLookupMixin:
+    """
+    Получение множества объектов одним запросом (in_bulk) с загрузкой связей по плану сериализатора.
+    Результаты - в порядке запрошенных id; на месте ненайденных - null, их id перечислены в not_found
+    """
+    batch_query_param = 'ids'
+    batch_field_name = 'pk'
+
+    def batch(self, request, *args, **kwargs):
+        ids = parse_id_list(request.query_params.get(self.batch_query_param), self.batch_query_param)
+        queryset = self.get_queryset()
+        columns, deferred = queryset.query.deferred_loading
+        if columns and not deferred:
+            # поле поиска - среди загружаемых столбцов, иначе .only() плана (?fields=) догружает его по объекту
+            queryset = queryset.only(*columns, self.batch_field_name)
+        found = queryset.in_bulk(ids, field_name=self.batch_field_name)
+        serializer = self.get_serializer([found[i] for i in dict.fromkeys(ids) if i in found], many=True)
+        data = {getattr(obj, self.batch_field_name): item for obj, item in zip(serializer.instance, serializer.data)}
+        return Response({
+            'results': [data.get(i) for i in ids],
+            'not_found': list(dict.fromkeys(i for i in ids if i not in found)),
+        })
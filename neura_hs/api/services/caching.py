@@ -0,0 +1,62 @@
+import hashlib
+from typing import Optional
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.utils.translation import get_language
+from django.views.decorators.http import condition
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.request import Request
+
+from gallery.models import HearthstoneState
+
+# состав безымянной колоды неизменен, но список похожих колод меняется при пересчете соседей и появлении новых колод
+NAMELESS_DECK_MAX_AGE = 60 * 5
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    version, last_updated = HearthstoneState.get_catalog_version()
+    return last_updated
+
+
+class CatalogConditionalMixin:
+    """
+    Условные GET для представлений каталога: If-None-Match / If-Modified-Since обрабатываются до вызова
+    представления (304 без обращения к БД); ответы получают ETag, Last-Modified и требование ревалидации
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        conditional = condition(etag_func=self.catalog_etag, last_modified_func=catalog_last_modified)
+        response = conditional(super().dispatch)(request, *args, **kwargs)
+        patch_vary_headers(response, ('Accept', 'Accept-Language'))
+        return response
+
+    def catalog_etag(self, request, *args, **kwargs) -> Optional[str]:
+        """ ETag ответов по каталогу карт: версия каталога, язык и формат ответа (без запросов к БД) """
+        try:
+            renderer, media_type = self.get_content_negotiator().select_renderer(Request(request),
+                                                                                 self.get_renderers())
+        except NotAcceptable:
+            return None
+        version, last_updated = HearthstoneState.get_catalog_version()
+        return quote_etag(f'catalog-{version}-{get_language()}-{renderer.format}')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+def revalidated(request, response, max_age: int = NAMELESS_DECK_MAX_AGE):
+    """
+    Заголовки кэширования для редко меняющихся ответов: короткий срок хранения, затем ревалидация
+    по ETag содержимого (304 без передачи тела)
+    """
+    if response.status_code != 200:
+        return response
+    response.render()
+    response['ETag'] = quote_etag(hashlib.md5(response.content).hexdigest())
+    patch_cache_control(response, public=True, max_age=max_age)
+    patch_vary_headers(response, ('Accept', 'Accept-Language'))
+    return get_conditional_response(request, etag=response['ETag'], response=response)
@@ -0,0 +1,109 @@
+"""
+Снимок всего каталога коллекционных карт для каждого языка: cards.<lang>.json и сжатые варианты
+рядом с ним (.gz и, если установлен brotli, .br). Имена файлов совместимы с gzip_static / brotli_static
+веб-сервера, так что каталог можно раздавать напрямую из MEDIA_ROOT
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from django.conf import settings
+from django.utils import translation
+from rest_framework.utils.encoders import JSONEncoder
+
+from gallery.models import RealCard, HearthstoneState
+from ..serializers import RealCardDetailSerializer
+from .fast_serialization import values_queryset, card_values, serialize_cards
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content-Encoding -> расширение файла (в порядке предпочтения при согласовании)
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+
+def available_encodings() -> list[str]:
+    """ Кодировки, варианты в которых создаются при экспорте """
+    return [encoding for encoding in ENCODINGS if encoding != 'br' or brotli is not None]
+
+
+def snapshot_path(language: str, encoding: Optional[str] = None) -> Path:
+    """ Путь к снимку каталога на языке language (encoding=None - несжатый JSON) """
+    path = Path(settings.CATALOG_EXPORT_ROOT) / f'cards.{language}.json'
+    return path.with_name(path.name + ENCODINGS[encoding]) if encoding else path
+
+
+def build_snapshot(language: str) -> bytes:
+    """ JSON каталога на языке language: версия каталога и карты в представлении RealCardDetailSerializer """
+    fields = RealCardDetailSerializer.Meta.fields
+    version, last_updated = HearthstoneState.get_catalog_version()
+    with translation.override(language):
+        rows = values_queryset(RealCard.objects.filter(collectible=True).order_by('dbf_id'), *card_values(fields))
+        data = {'version': version, 'language': language, 'cards': serialize_cards(list(rows), fields)}
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _write(path: Path, content: bytes) -> None:
+    """ Атомарная запись: клиенты никогда не получат недописанный файл """
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_bytes(content)
+    os.replace(temp, path)
+
+
+def _compress(content: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def write_catalog_snapshots() -> list[Path]:
+    """ Запись снимков каталога для всех языков сайта (после обновления БД) """
+    Path(settings.CATALOG_EXPORT_ROOT).mkdir(parents=True, exist_ok=True)
+    written = []
+    for language, _ in settings.LANGUAGES:
+        content = build_snapshot(language)
+        # сжатые варианты пишутся первыми, чтобы несжатый файл (по нему считается ETag) не опережал их
+        for encoding in available_encodings():
+            _write(path := snapshot_path(language, encoding), _compress(content, encoding))
+            written.append(path)
+        _write(path := snapshot_path(language), content)
+        written.append(path)
+    return written
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Выбор варианта снимка по заголовку Accept-Encoding (None - несжатый JSON)
+    :param accept_encoding: значение заголовка, например 'gzip, deflate, br;q=0.9'
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, *params = [part.strip() for part in item.split(';')]
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.lower()] = weight
+
+    candidates = [encoding for encoding in available_encodings()
+                  if weights.get(encoding, weights.get('*', 0.0)) > 0]
+    if not candidates:
+        return None
+    return max(candidates, key=lambda encoding: weights.get(encoding, weights.get('*', 0.0)))
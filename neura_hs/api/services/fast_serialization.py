@@ -0,0 +1,178 @@
+"""
+Быстрая сериализация каталога только для чтения: строки из .values(), подписи вариантов выбора -
+из заранее построенных таблиц (вместо вызовов get_*_display для каждого объекта), JSON - через orjson.
+Результат совпадает с RealCardListSerializer / DeckSerializer; для колод есть и компактное представление
+"""
+
+from collections import defaultdict
+from typing import Iterable
+
+from django.db.models import QuerySet
+from django.utils.translation import get_language
+from rest_framework.renderers import BaseRenderer, BrowsableAPIRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from gallery.models import RealCard
+from decks.models import Inclusion
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+CHOICE_FIELDS = {'card_type': 'card_type', 'rarity': 'rarity', 'spell_school': 'spell_school'}
+RELATED_NAME_FIELDS = {'card_set': 'card_set__name'}
+MANY_TO_MANY_FIELDS = {'card_class': RealCard.card_class, 'tribe': RealCard.tribe}
+
+_choice_labels: dict[tuple[str, str], dict] = {}
+
+
+def choice_labels(field_name: str) -> dict:
+    """ Значение -> подпись варианта выбора поля карты на текущем языке (как get_FOO_display) """
+    key = (field_name, get_language())
+    if key not in _choice_labels:
+        field = RealCard._meta.get_field(field_name)
+        _choice_labels[key] = {value: str(label) for value, label in field.flatchoices}
+    return _choice_labels[key]
+
+
+def card_values(fields: Iterable[str], prefix: str = '') -> list[str]:
+    """ Аргументы .values() для полей сериализатора карты (M2M загружаются отдельно) """
+    values = [f'{prefix}id']
+    for name in fields:
+        if name in MANY_TO_MANY_FIELDS:
+            continue
+        values.append(prefix + RELATED_NAME_FIELDS.get(name, name))
+    return values
+
+
+def _many_to_many_names(field_name: str, card_ids: list[int]) -> dict[int, list[str]]:
+    """ pk карты -> названия связанных объектов (в порядке модели связанных объектов) """
+    descriptor = MANY_TO_MANY_FIELDS[field_name]
+    through, related = descriptor.through, descriptor.field.related_model
+    target = descriptor.field.m2m_reverse_field_name()
+    names = defaultdict(list)
+    for card_id, name in through.objects.filter(realcard_id__in=card_ids).order_by(
+        *[f'{target}__{field}' for field in related._meta.ordering],
+    ).values_list('realcard_id', f'{target}__name'):
+        names[card_id].append(name)
+    return names
+
+
+def serialize_cards(rows: list[dict], fields: Iterable[str], prefix: str = '') -> list[dict]:
+    """
+    Представления карт по строкам .values(*card_values(fields, prefix))
+    :param fields: поля сериализатора карты (Meta.fields)
+    """
+    fields = tuple(fields)
+    card_ids = [row[f'{prefix}id'] for row in rows]
+    many = {name: _many_to_many_names(name, card_ids) for name in fields if name in MANY_TO_MANY_FIELDS}
+    labels = {name: choice_labels(CHOICE_FIELDS[name]) for name in fields if name in CHOICE_FIELDS}
+
+    result = []
+    for row, card_id in zip(rows, card_ids):
+        item = {}
+        for name in fields:
+            if name in many:
+                item[name] = many[name].get(card_id, [])
+            elif name in labels:
+                value = row[prefix + name]
+                item[name] = value if value is None else labels[name].get(value, value)
+            else:
+                item[name] = row[prefix + RELATED_NAME_FIELDS.get(name, name)]
+        result.append(item)
+    return result
+
+
+DECK_VALUES = ('id', 'deck_format__name', 'deck_class__name', 'string', 'created')
+
+
+def serialize_decks(rows: list[dict], created_field, card_fields: Iterable[str]) -> list[dict]:
+    """
+    Представления колод (как DeckSerializer) по строкам .values(*DECK_VALUES)
+    :param created_field: поле сериализатора для даты создания (формат и часовой пояс)
+    :param card_fields: поля сериализатора карты в колоде
+    """
+    card_fields = tuple(card_fields)
+    inclusions = list(Inclusion.objects.filter(deck_id__in=[row['id'] for row in rows]).order_by('pk').values(
+        'deck_id', 'number', *card_values(card_fields, 'card__'),
+    ))
+    cards = serialize_cards(inclusions, card_fields, 'card__')
+    by_deck = defaultdict(list)
+    for inclusion, card in zip(inclusions, cards):
+        by_deck[inclusion['deck_id']].append({'card': card, 'number': inclusion['number']})
+
+    return [{
+        'id': row['id'],
+        'deck_format': row['deck_format__name'],
+        'deck_class': row['deck_class__name'],
+        'string': row['string'],
+        'created': created_field.to_representation(row['created']),
+        'cards': by_deck[row['id']],
+    } for row in rows]
+
+
+def serialize_decks_compact(rows: list[dict], created_field, card_fields: Iterable[str]) -> dict:
+    """
+    Компактное представление колод (?repr=compact): в колоде - пары [dbf_id, кол-во], а представления карт -
+    один раз на ответ, в словаре cards (ключ - dbf_id строкой)
+    :param created_field: поле сериализатора для даты создания (формат и часовой пояс)
+    :param card_fields: поля сериализатора карты в словаре cards
+    """
+    by_deck, card_ids = defaultdict(list), set()
+    for deck_id, dbf_id, card_id, number in Inclusion.objects.filter(
+        deck_id__in=[row['id'] for row in rows],
+    ).order_by('pk').values_list('deck_id', 'card__dbf_id', 'card_id', 'number'):
+        by_deck[deck_id].append([dbf_id, number])
+        card_ids.add(card_id)
+
+    card_fields = tuple(card_fields)
+    card_rows = list(RealCard.objects.filter(pk__in=card_ids).order_by('dbf_id').values(*card_values(card_fields)))
+    cards = serialize_cards(card_rows, card_fields)
+    return {
+        'decks': [{
+            'id': row['id'],
+            'deck_format': row['deck_format__name'],
+            'deck_class': row['deck_class__name'],
+            'string': row['string'],
+            'created': created_field.to_representation(row['created']),
+            'cards': by_deck[row['id']],
+        } for row in rows],
+        'cards': {str(card['dbf_id']): card for card in cards},
+    }
+
+
+def values_queryset(queryset: QuerySet, *values: str) -> QuerySet:
+    """ .values() без prefetch_related, добавленных менеджером или планом загрузки """
+    return queryset.prefetch_related(None).values(*values)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSONRenderer на orjson (если установлен); для запросов с отступами - стандартный рендерер """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """ MessagePack (если установлен msgpack): ?format=msgpack или Accept: application/msgpack """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, use_bin_type=True, default=JSONEncoder().default)
+
+
+# рендеры ответов списков: JSON и, при наличии msgpack, MessagePack
+LIST_RENDERERS = (FastJSONRenderer, BrowsableAPIRenderer) + ((MessagePackRenderer,) if msgpack is not None else ())
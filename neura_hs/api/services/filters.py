@@ -1,7 +1,10 @@
+from django import forms
+from django.db.models import Count, Q, QuerySet
 from django_filters import rest_framework as filters
 
 from gallery.models import RealCard, CardClass, CardSet
-from decks.models import Deck, Format
+from decks.models import Deck, Format, Inclusion
+from core.services.card_columns import get_card_columns, Selection, NUMERIC_COLUMNS
 from .utils import generate_choicefield_description as gcd
 
 
@@ -13,11 +16,71 @@ class CharInFilter(filters.BaseInFilter, filters.CharFilter):
     pass
 
 
+class CardCountsField(forms.CharField):
+    """ Список "dbf_id[:минимальное число копий]" через запятую -> {dbf_id: минимальное число копий} """
+
+    def clean(self, value):
+        value = super().clean(value)
+        if not value:
+            return None
+        cards = {}
+        for item in value.split(','):
+            dbf_id, _, number = item.strip().partition(':')
+            try:
+                dbf_id, number = int(dbf_id), int(number or 1)
+            except ValueError:
+                raise forms.ValidationError(f'Invalid card: "{item}"', code='invalid')
+            if number < 1:
+                raise forms.ValidationError(f'Invalid number of copies: "{item}"', code='invalid')
+            cards[dbf_id] = max(number, cards.get(dbf_id, 1))
+        return cards
+
+
+class CardCountsFilter(filters.Filter):
+    field_class = CardCountsField
+
+
+class CardsMatch:
+    """ Режимы поиска колод по картам """
+    ALL = 'all'
+    ANY = 'any'
+    NONE = 'none'
+    choices = ((ALL, 'Decks containing all the cards'),
+               (ANY, 'Decks containing at least one of the cards'),
+               (NONE, 'Decks containing none of the cards'))
+
+
+def filter_decks_by_cards(queryset: QuerySet, cards: dict[int, int], mode: str = CardsMatch.ALL) -> QuerySet:
+    """
+    Фильтрация колод по входящим в них картам одним подзапросом к Inclusion (GROUP BY колода HAVING COUNT)
+    вместо отдельного JOIN на каждую карту
+    :param cards: dbf_id -> минимальное число копий карты в колоде
+    :param mode: CardsMatch.ALL / ANY / NONE
+    """
+    condition = Q()
+    single = [dbf_id for dbf_id, number in cards.items() if number == 1]
+    if single:
+        condition |= Q(card__dbf_id__in=single)
+    for dbf_id, number in cards.items():
+        if number > 1:
+            condition |= Q(card__dbf_id=dbf_id, number__gte=number)
+
+    matching = Inclusion.objects.filter(condition).order_by().values('deck')
+    if mode == CardsMatch.ALL and len(cards) > 1:
+        matching = matching.annotate(matched=Count('card', distinct=True)).filter(matched=len(cards))
+    matching = matching.values('deck')
+
+    if mode == CardsMatch.NONE:
+        return queryset.exclude(pk__in=matching)
+    return queryset.filter(pk__in=matching)
+
+
 class RealCardFilter(filters.FilterSet):
 
     card_id = filters.CharFilter()
     dbf_id = filters.NumberFilter()
-    name = filters.CharFilter(field_name='name', lookup_expr='icontains')
+    name = filters.CharFilter(method='search_by_name', help_text='Words (or their beginnings) of the card name')
+    text = filters.CharFilter(method='search_by_text', help_text='Words (or their beginnings) of the card text')
     classes = CharInFilter(field_name='card_class__name', lookup_expr='in', help_text='Comma-separated class names')
     ctype = filters.ChoiceFilter(field_name='card_type', choices=RealCard.CardTypes.choices,
                                  help_text=gcd(RealCard, 'CardTypes'))
@@ -29,11 +92,52 @@ class RealCardFilter(filters.FilterSet):
     health = filters.RangeFilter()
     armor = filters.RangeFilter()
     durability = filters.RangeFilter()
+    facets = filters.BooleanFilter(method='filter_facets',
+                                   help_text='Add the number of matching cards by rarity, class and set')
 
     class Meta:
         model = RealCard
-        fields = ('card_id', 'dbf_id', 'name', 'classes', 'ctype', 'cset', 'rarity', 'cost', 'attack', 'health',
-                  'durability', 'armor')
+        fields = ('card_id', 'dbf_id', 'name', 'text', 'classes', 'ctype', 'cset', 'rarity', 'cost', 'attack',
+                  'health', 'durability', 'armor', 'facets')
+
+    def search_by_name(self, queryset, name, value):
+        """ Полнотекстовый поиск по названию на всех языках """
+        return queryset.search_by_name(value)
+
+    def search_by_text(self, queryset, name, value):
+        """ Полнотекстовый поиск по тексту и описанию на всех языках """
+        return queryset.search_by_text(value)
+
+    def filter_facets(self, queryset, name, value):
+        """ Фасеты добавляются к ответу представлением (см. catalog_selection) """
+        return queryset
+
+    def catalog_selection(self, collectible: bool = True) -> Selection:
+        """
+        Те же карты, отобранные по снимку каталога в памяти (напр., для подсчета фасетов).
+        Фильтры, которых нет в снимке (идентификаторы и полнотекстовый поиск), применяются к БД
+        """
+        data = self.form.cleaned_data
+        within = None
+        if by_database := [f for f in ('card_id', 'dbf_id', 'name', 'text') if data.get(f) not in (None, '')]:
+            queryset = RealCard.objects.filter(collectible=collectible)
+            for field in by_database:
+                queryset = self.filters[field].filter(queryset, data[field])
+            within = queryset.values_list('pk', flat=True)
+
+        card_class = None
+        if data.get('classes'):
+            card_class = list(CardClass.objects.filter(name__in=data['classes']).values_list('pk', flat=True))
+        ranges = {column: (data[column].start, data[column].stop) for column in NUMERIC_COLUMNS if data.get(column)}
+        return get_card_columns().select(
+            rarity=data.get('rarity'),
+            collectible=collectible,
+            card_type=data.get('ctype'),
+            card_class=card_class,
+            card_set=data['cset'].pk if data.get('cset') else None,
+            ranges=ranges,
+            within=within,
+        )
 
 
 class DeckFilter(filters.FilterSet):
@@ -43,17 +147,19 @@ class DeckFilter(filters.FilterSet):
     dformat = filters.ModelChoiceFilter(queryset=Format.objects.all(), field_name='deck_format', to_field_name='name',
                                         help_text='Format name')
     date = filters.DateTimeFromToRangeFilter(field_name='created', help_text='Creation date (dd.mm.yyyy)')
-    cards = filters.CharFilter(field_name='cards', method='filter_decks_by_cards',
-                               help_text='Comma-separated "dbf_id" values')
+    cards = CardCountsFilter(field_name='cards', method='filter_decks_by_cards',
+                             help_text='Comma-separated "dbf_id" values; "dbf_id:2" requires at least 2 copies')
+    cards_match = filters.ChoiceFilter(choices=CardsMatch.choices, method='filter_cards_match',
+                                       help_text='How "cards" are matched: all (default), any, none')
 
     class Meta:
         model = Deck
-        fields = ('dformat', 'dclass', 'date', 'cards')
+        fields = ('dformat', 'dclass', 'date', 'cards', 'cards_match')
 
     def filter_decks_by_cards(self, queryset, name, value):
         """ Позволяет фильтровать колоды по картам, указывая их dbf_id через запятую """
+        return filter_decks_by_cards(queryset, value, self.form.cleaned_data.get('cards_match') or CardsMatch.ALL)
 
-        for dbf_id in value.split(","):
-            queryset = queryset.filter(cards__dbf_id=dbf_id)
-
+    def filter_cards_match(self, queryset, name, value):
+        """ Режим применяется в filter_decks_by_cards """
         return queryset
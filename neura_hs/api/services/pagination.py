@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class DbfIdCursorPagination(CursorPagination):
+    """ Keyset-пагинация по dbf_id: стоимость страницы не зависит от ее номера """
+    ordering = 'dbf_id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,93 @@
+from typing import Optional
+
+from django.db.models import QuerySet, prefetch_related_objects
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class QueryPlanMixin:
+    """
+    Сериализатор с планом загрузки связей и sparse fieldsets.
+    select_related_fields / prefetch_related_fields - имена полей сериализатора, которым нужна связь
+    (путь связи - source поля); вложенные сериализаторы с этим миксином учитываются автоматически.
+    Параметр fields оставляет только перечисленные поля (неизвестные имена - ValidationError)
+    """
+    select_related_fields: tuple[str, ...] = ()
+    prefetch_related_fields: tuple[str, ...] = ()
+
+    def __init__(self, *args, fields: Optional[list[str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            if unknown := [name for name in fields if name not in self.fields]:
+                raise ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}. '
+                                                 f'Available: {", ".join(self.fields)}'})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def get_query_plan(self, prefix: str = '', many: bool = False) -> tuple[list[str], list[str]]:
+        """
+        Пути связей для select_related и prefetch_related с учетом оставшихся полей
+        :param prefix: путь от модели queryset до модели сериализатора
+        :param many: модель сериализатора достигается через связь "ко многим" (тогда - только prefetch)
+        """
+        select, prefetch = [], []
+        for name, field in self.fields.items():
+            path = prefix + field.source
+            nested = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(nested, QueryPlanMixin):
+                nested_many = many or nested is not field
+                (prefetch if nested_many else select).append(path)
+                nested_select, nested_prefetch = nested.get_query_plan(f'{path}__', nested_many)
+                select += nested_select
+                prefetch += nested_prefetch
+            elif name in self.select_related_fields:
+                (prefetch if many else select).append(path)
+            elif name in self.prefetch_related_fields:
+                prefetch.append(path)
+        return select, prefetch
+
+    def get_columns(self) -> Optional[list[str]]:
+        """ Столбцы модели, нужные оставшимся полям (None - если это невозможно определить) """
+        concrete = {field.name for field in self.Meta.model._meta.concrete_fields}
+        columns = []
+        for field in self.fields.values():
+            if isinstance(field, serializers.SerializerMethodField):
+                return None
+            attr = field.source_attrs[0] if field.source_attrs else ''
+            if attr.startswith('get_') and attr.endswith('_display'):
+                attr = attr[len('get_'):-len('_display')]
+            if attr in concrete:
+                columns.append(attr)
+        return columns
+
+
+def apply_query_plan(queryset: QuerySet, serializer: QueryPlanMixin) -> QuerySet:
+    """ Загрузка связей и столбцов, нужных сериализатору (заменяет prefetch_related менеджера модели) """
+    select, prefetch = serializer.get_query_plan()
+    queryset = queryset.prefetch_related(None).select_related(*select).prefetch_related(*prefetch)
+    if (columns := serializer.get_columns()) is not None:
+        queryset = queryset.only(*columns)
+    return queryset
+
+
+def prefetch_for(instance, serializer: QueryPlanMixin) -> None:
+    """ Загрузка связей, нужных сериализатору, для уже полученного объекта """
+    select, prefetch = serializer.get_query_plan()
+    prefetch_related_objects([instance], *select, *prefetch)
+
+
+class QueryPlanViewMixin:
+    """ Применяет к queryset план загрузки сериализатора и передает ему ?fields= (через запятую) """
+
+    def get_requested_fields(self) -> Optional[list[str]]:
+        request = getattr(self, 'request', None)
+        if request is not None and (fields := request.query_params.get('fields')):
+            return [name.strip() for name in fields.split(',') if name.strip()] or None
+        return None
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        return apply_query_plan(super().get_queryset(), self.get_serializer())
@@ -1,13 +1,26 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from core.services.concurrency import async_view
 
 app_name = 'api'
 
 
+def catalog_view(view):
+    """ Под ASGI чтение каталога и расшифровка колод выполняются параллельно в пуле потоков """
+    return async_view(view) if settings.ASYNC_VIEWS else view
+
+
 urlpatterns = [
-    path('cards/', views.RealCardViewSet.as_view({'get': 'list'})),
-    path('cards/<int:dbf_id>/', views.RealCardViewSet.as_view({'get': 'retrieve'})),
+    path('cards/', catalog_view(views.RealCardViewSet.as_view({'get': 'list'}))),
+    path('cards/all/', views.RealCardViewSet.as_view({'get': 'stream'})),
+    path('cards/export/', catalog_view(views.CatalogExportAPIView.as_view())),
+    path('cards/suggest/', catalog_view(views.CardSuggestAPIView.as_view())),
+    path('cards/batch/', catalog_view(views.RealCardViewSet.as_view({'get': 'batch'}))),
+    path('cards/<int:dbf_id>/', catalog_view(views.RealCardViewSet.as_view({'get': 'retrieve'}))),
     path('decks/', views.DeckListAPIView.as_view()),
     path('decks/<int:pk>/', views.DeckDetailAPIView.as_view()),
-    path('decode_deck/', views.ViewDeckAPIView.as_view()),
+    path('decks/batch/', views.DeckBatchAPIView.as_view()),
+    path('decode_deck/', catalog_view(views.ViewDeckAPIView.as_view())),
+    path('trends/', views.TrendsAPIView.as_view()),
 ]
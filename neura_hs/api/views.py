@@ -1,3 +1,7 @@
+from django.http import StreamingHttpResponse, FileResponse, Http404
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
+from django.utils.translation import get_language
 from rest_framework import generics, viewsets
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -5,44 +9,180 @@ from rest_framework.views import APIView
 from .serializers import (
     RealCardListSerializer,
     RealCardDetailSerializer,
+    RealCardInDeckSerializer,
     DeckSerializer,
+    DeckDetailSerializer,
+    DecodedDeckSerializer,
+    TrendsQuerySerializer,
+    TrendsSerializer,
+    SuggestQuerySerializer,
+    CardSuggestionSerializer,
 )
 from .services.filters import RealCardFilter, DeckFilter
 from .services.utils import DjangoFilterBackendPlus
+from .services.pagination import DbfIdCursorPagination
+from .services.streaming import stream_json_list
+from .services.query_plan import QueryPlanViewMixin
+from .services.batch import BatchLookupMixin
+from .services.caching import CatalogConditionalMixin, revalidated
+from .services.export import snapshot_path, negotiate_encoding
+from .services.fast_serialization import (
+    LIST_RENDERERS, values_queryset, card_values, serialize_cards, DECK_VALUES, serialize_decks,
+    serialize_decks_compact,
+)
 from core.services.deck_codes import get_clean_deckstring
+from core.services.deck_catalog import decode_deck, record_decoded
+from core.services.trends import get_trends
+from core.services.typeahead import suggest_cards
+from core.services.card_columns import label_facets
 from core.exceptions import DecodeError, UnsupportedCards
 from gallery.models import RealCard
 from decks.models import Deck
 
 
-class RealCardViewSet(viewsets.ReadOnlyModelViewSet):
+class RealCardViewSet(CatalogConditionalMixin, BatchLookupMixin, QueryPlanViewMixin, viewsets.ReadOnlyModelViewSet):
     """ Getting Hearthstone cards """
     queryset = RealCard.objects.all()
     filter_backends = (DjangoFilterBackendPlus,)
     filterset_class = RealCardFilter
+    pagination_class = DbfIdCursorPagination
+    renderer_classes = LIST_RENDERERS
     lookup_field = 'dbf_id'
+    batch_query_param = 'dbf_ids'
+    batch_field_name = 'dbf_id'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'stream'):
+            queryset = queryset.filter(collectible=True)
+        return queryset
 
     def get_serializer_class(self):
-        if self.action == 'list':
+        if self.action in ('list', 'stream'):
             return RealCardListSerializer
-        elif self.action == 'retrieve':
+        elif self.action in ('retrieve', 'batch'):
             return RealCardDetailSerializer
 
+    def list(self, request, *args, **kwargs):
+        if self.get_requested_fields():
+            return super().list(request, *args, **kwargs)
+
+        # быстрый путь: строки .values() вместо экземпляров модели и сериализатора
+        fields = RealCardListSerializer.Meta.fields
+        queryset = values_queryset(self.filter_queryset(self.get_queryset()), *card_values(fields))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(serialize_cards(page, fields))
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        filterset = DjangoFilterBackendPlus().get_filterset(self.request, self.get_queryset(), self)
+        if filterset.is_valid() and filterset.form.cleaned_data.get('facets'):
+            facets = label_facets(filterset.catalog_selection().facets())
+            response.data['facets'] = {facet: dict(counts) for facet, counts in facets.items()}
+        return response
+
+    def batch(self, request, *args, **kwargs):
+        """ Getting several cards at once: ?dbf_ids=1,2,3 (results in the same order, null for unknown ids) """
+        return super().batch(request, *args, **kwargs)
+
+    def stream(self, request):
+        """ Getting all matching collectible cards as a single JSON array (streamed in chunks) """
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(stream_json_list(queryset, self.get_serializer),
+                                     content_type='application/json')
+
 
-class DeckListAPIView(generics.ListAPIView):
+class CatalogExportAPIView(APIView):
+    """ Getting the full catalog of collectible cards (a precompressed snapshot written after every update) """
+
+    def get(self, request):
+        language = get_language()
+        identity = snapshot_path(language)
+        try:
+            stat = identity.stat()
+        except FileNotFoundError:
+            raise Http404
+
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding and not snapshot_path(language, encoding).exists():
+            encoding = None
+        # у каждого варианта кодирования - свой ETag; снимок меняется только при перезаписи несжатого файла
+        etag = quote_etag(f'{language}-{stat.st_mtime_ns:x}-{stat.st_size:x}-{encoding or "identity"}')
+
+        response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if response is None:
+            response = FileResponse(snapshot_path(language, encoding).open('rb'), content_type='application/json',
+                                    filename=identity.name)
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding', 'Accept-Language'))
+        patch_cache_control(response, public=True, no_cache=True)
+        return response
+
+
+class DeckListAPIView(QueryPlanViewMixin, generics.ListAPIView):
     """ Getting a list of decks """
 
     queryset = Deck.nameless.all()
     serializer_class = DeckSerializer
     filter_backends = (DjangoFilterBackendPlus,)
     filterset_class = DeckFilter
+    renderer_classes = LIST_RENDERERS
+
+    def list(self, request, *args, **kwargs):
+        """ ?repr=compact: cards as [dbf_id, count] pairs plus a single "cards" dictionary for the whole response """
+        compact = request.query_params.get('repr') == 'compact'
+        if self.get_requested_fields() and not compact:
+            return super().list(request, *args, **kwargs)
 
+        # быстрый путь: строки .values() вместо экземпляров модели и сериализатора
+        queryset = values_queryset(self.filter_queryset(self.get_queryset()), *DECK_VALUES)
+        page = self.paginate_queryset(queryset)
+        serialize = serialize_decks_compact if compact else serialize_decks
+        data = serialize(list(queryset if page is None else page), self.get_serializer().fields['created'],
+                         RealCardInDeckSerializer.Meta.fields)
+        return self.get_paginated_response(data) if page is not None else Response(data)
 
-class DeckDetailAPIView(generics.RetrieveAPIView):
-    """ Getting a specific deck """
+
+class DeckDetailAPIView(QueryPlanViewMixin, generics.RetrieveAPIView):
+    """ Getting a specific deck with similar decks """
+    queryset = Deck.nameless.all()
+    serializer_class = DeckDetailSerializer
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return revalidated(request, response) if request.method in ('GET', 'HEAD') else response
+
+
+class DeckBatchAPIView(BatchLookupMixin, QueryPlanViewMixin, generics.GenericAPIView):
+    """ Getting several decks at once: ?ids=1,2,3 (results in the same order, null for unknown ids) """
     queryset = Deck.nameless.all()
     serializer_class = DeckSerializer
 
+    def get(self, request, *args, **kwargs):
+        return self.batch(request, *args, **kwargs)
+
+
+class TrendsAPIView(APIView):
+    """ Popularity of classes and cards in decks created in the last 7/30 days """
+
+    def get(self, request):
+        query = TrendsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        trends = get_trends(query.validated_data['days'], query.validated_data.get('dformat'))
+        return Response(TrendsSerializer(trends).data)
+
+
+class CardSuggestAPIView(CatalogConditionalMixin, APIView):
+    """ Card name suggestions for a partial or misspelled name (collectible cards, names in all languages) """
+
+    def get(self, request):
+        query = SuggestQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        suggestions = suggest_cards(query.validated_data['q'], query.validated_data['limit'])
+        return Response(CardSuggestionSerializer(suggestions, many=True).data)
+
 
 class ViewDeckAPIView(APIView):
     """ Decoding the deck from code """
@@ -51,9 +191,9 @@ class ViewDeckAPIView(APIView):
         if deckstring := request.data.get('d'):
             try:
                 deckstring = get_clean_deckstring(deckstring)
-                deck = Deck.create_from_deckstring(deckstring)
-                serializer = DeckSerializer(deck)
-                return Response(serializer.data)
+                deck = decode_deck(deckstring)      # без записи в БД
+                record_decoded(deck)
+                return Response(DecodedDeckSerializer(deck).data)
             except DecodeError as de:
                 return Response({'error': str(de)})
             except UnsupportedCards as u:
@@ -0,0 +1,7 @@
+"""
+Замеры производительности (запуск: python manage.py benchmark [имя ...]).
+Каждый замер работает на синтетических данных, которые откатываются по его завершении
+"""
+
+from .harness import BENCHMARKS
+from . import decks, cards, api  # noqa: F401 - регистрация замеров
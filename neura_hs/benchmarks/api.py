@@ -0,0 +1,115 @@
+""" Замеры сериализации и пропускной способности API """
+
+from gallery.models import RealCard
+from decks.models import Deck
+from .harness import benchmark, measure, synthetic_data
+
+
+@benchmark('fast_serialization')
+def bench_fast_serialization(size: int) -> list[str]:
+    """ Сериализация size карт и size / 10 колод в JSON: DRF-сериализаторы vs .values() + orjson """
+    from rest_framework.renderers import JSONRenderer
+    from api.serializers import RealCardListSerializer, RealCardInDeckSerializer, DeckSerializer
+    from api.services.query_plan import apply_query_plan
+    from api.services.fast_serialization import (
+        FastJSONRenderer, values_queryset, card_values, serialize_cards, DECK_VALUES, serialize_decks,
+    )
+
+    num_decks = max(size // 10, 1)
+    with synthetic_data(num_decks, num_cards=size):
+        cards = RealCard.objects.filter(card_set__service_name='bench-set')
+        decks = Deck.nameless.all()[:num_decks]
+        card_fields = RealCardListSerializer.Meta.fields
+
+        def drf_cards():
+            queryset = apply_query_plan(cards, RealCardListSerializer())
+            return JSONRenderer().render(RealCardListSerializer(queryset, many=True).data)
+
+        def fast_cards():
+            rows = list(values_queryset(cards, *card_values(card_fields)))
+            return FastJSONRenderer().render(serialize_cards(rows, card_fields))
+
+        def drf_decks():
+            queryset = apply_query_plan(Deck.nameless.all(), DeckSerializer())[:num_decks]
+            return JSONRenderer().render(DeckSerializer(queryset, many=True).data)
+
+        def fast_decks():
+            rows = list(values_queryset(decks, *DECK_VALUES))
+            data = serialize_decks(rows, DeckSerializer().fields['created'], RealCardInDeckSerializer.Meta.fields)
+            return FastJSONRenderer().render(data)
+
+        results = [(f'{size} cards', measure(drf_cards), measure(fast_cards)),
+                   (f'{num_decks} decks', measure(drf_decks), measure(fast_decks))]
+
+    return [f'{name:>12}: serializers {drf * 1000:>8.1f} ms, values() {fast * 1000:>8.1f} ms (x{drf / fast:.1f})'
+            for name, drf, fast in results]
+
+
+@benchmark('asgi_views')
+def bench_asgi_views(size: int) -> list[str]:
+    """
+    Пропускная способность расшифровки колод (size запросов, по 32 одновременно) на уровне обработчика:
+    синхронное представление (WSGI, 1 поток на процесс), оно же под ASGI (все синхронные представления -
+    в одном потоке) и асинхронный вариант (async_view, пул потоков). Сравнение серверов целиком:
+    uvicorn neura_hs.asgi:application vs gunicorn neura_hs.wsgi под внешним генератором нагрузки
+    """
+    import asyncio
+    from asgiref.sync import sync_to_async
+    from django.test import RequestFactory, override_settings
+    from api.views import ViewDeckAPIView
+    from core.services.concurrency import async_view
+    from core.services.deck_catalog import decode_deck, reset_deck_catalog
+
+    view = ViewDeckAPIView.as_view()
+    with synthetic_data(200) as decks:
+        reset_deck_catalog()
+        deckstrings = [deck.string for deck in decks]
+        for deckstring in deckstrings:
+            decode_deck(deckstring, lookup=False)   # каталог (и классы героев) остается в памяти после отката
+    # запросы - после отката: незафиксированные данные synthetic_data блокировали бы чтение из других потоков
+    requests = [RequestFactory().post('/api/v1/decode_deck/', {'d': deckstrings[i % len(deckstrings)]})
+                for i in range(size)]
+
+    def run_sync():
+        for request in requests:
+            view(request).render()
+
+    def run_async(wrapped):
+        async def main():
+            slots = asyncio.Semaphore(32)
+
+            async def one(request):
+                async with slots:
+                    (await wrapped(request)).render()
+
+            await asyncio.gather(*[one(request) for request in requests])
+        asyncio.run(main())
+
+    with override_settings(DECODED_DECKS_SAMPLE_RATE=0):
+        results = [('WSGI (sync view)', measure(run_sync, repeat=1)),
+                   ('ASGI, sync view', measure(run_async, sync_to_async(view, thread_sensitive=True), repeat=1)),
+                   ('ASGI, async_view', measure(run_async, async_view(view), repeat=1))]
+    reset_deck_catalog()
+
+    return [f'{name:<18}: {size / elapsed:>8.1f} req/s' for name, elapsed in results]
+
+
+@benchmark('compact_decks')
+def bench_compact_decks(size: int) -> list[str]:
+    """ Список из size колод: полное представление (values() + orjson) vs ?repr=compact - время и объем ответа """
+    from api.serializers import RealCardInDeckSerializer, DeckSerializer
+    from api.services.fast_serialization import (
+        FastJSONRenderer, values_queryset, DECK_VALUES, serialize_decks, serialize_decks_compact,
+    )
+
+    with synthetic_data(size):
+        created, card_fields = DeckSerializer().fields['created'], RealCardInDeckSerializer.Meta.fields
+        decks = values_queryset(Deck.nameless.all()[:size], *DECK_VALUES)
+
+        def render(serialize):
+            return FastJSONRenderer().render(serialize(list(decks), created, card_fields))
+
+        results = [(name, measure(render, serialize), len(render(serialize)))
+                   for name, serialize in (('full', serialize_decks), ('compact', serialize_decks_compact))]
+
+    return [f'{name:>8}: {elapsed * 1000:>8.1f} ms, {length / 1024:>8.1f} KiB' for name, elapsed, length in results]
@@ -0,0 +1,167 @@
+""" Замеры поиска, фильтров, справочников и отображения карт """
+
+from django.db.models import Q
+from django.urls import reverse
+
+from gallery.models import RealCard, CardClass, CardSet
+from .harness import benchmark, measure, synthetic_data
+
+
+@benchmark('card_search')
+def bench_card_search(size: int) -> list[str]:
+    """ Поиск среди size карт по названию и тексту на всех языках: icontains по полям vs индекс FTS5 """
+    from core.services.card_search import rebuild_search_index, is_available
+
+    if not is_available():
+        return ['full-text index is not available (run rebuild_search_index)']
+    queries = ['card 12', 'benchmark card 7', 'card 299', 'nothing']
+    fields = ('name_en', 'name_ru', 'text_en', 'text_ru', 'flavor_en', 'flavor_ru')
+
+    def legacy(query):
+        condition = Q()
+        for word in query.split():
+            any_field = Q()
+            for field in fields:
+                any_field |= Q(**{f'{field}__icontains': word})
+            condition &= any_field
+        return list(RealCard.objects.filter(condition).values_list('pk', flat=True))
+
+    with synthetic_data(0, num_cards=size):
+        rebuild_search_index()
+        icontains = measure(lambda: [legacy(query) for query in queries])
+        fts = measure(lambda: [list(RealCard.objects.search(query).values_list('pk', flat=True))
+                               for query in queries])
+
+    return [
+        f'icontains: {icontains / len(queries) * 1000:>8.2f} ms/query',
+        f'fts5:      {fts / len(queries) * 1000:>8.2f} ms/query (x{icontains / fts:.1f})',
+    ]
+
+
+@benchmark('typeahead')
+def bench_typeahead(size: int) -> list[str]:
+    """ Подсказки по названиям size карт: icontains по названиям vs индекс триграмм в памяти (и его построение) """
+    from core.services.typeahead import NameIndex
+
+    queries = ['card 12', 'crad 7', 'car', 'card 2999', 'nothing']
+    with synthetic_data(0, num_cards=size):
+        build = measure(NameIndex, 0, repeat=1)
+        index = NameIndex(0)
+        icontains = measure(lambda: [list(RealCard.objects.filter(Q(name_en__icontains=query) |
+                                                                  Q(name_ru__icontains=query))[:10])
+                                     for query in queries])
+        suggest = measure(lambda: [index.suggest(query, language='en') for query in queries])
+
+    return [
+        f'index build: {build * 1000:>8.1f} ms',
+        f'icontains:   {icontains / len(queries) * 1000:>8.2f} ms/query (no typo tolerance)',
+        f'suggest:     {suggest / len(queries) * 1000:>8.2f} ms/query',
+    ]
+
+
+@benchmark('card_columns')
+def bench_card_columns(size: int) -> list[str]:
+    """ Фильтры галереи по size картам: цепочка фильтров ORM (число карт + страница) vs снимок в памяти (с фасетами) """
+    from core.services.card_columns import CardColumns
+
+    with synthetic_data(0, num_cards=size):
+        classes = list(CardClass.objects.filter(service_name__startswith='bench-class-').values_list('pk', flat=True))
+        rarities = [r for r, label in RealCard.Rarities.choices if r]
+        criteria = [{'card_class': pk, 'rarity': rarity, 'collectible': True} for pk in classes for rarity in rarities]
+
+        def legacy():
+            for c in criteria:
+                queryset = RealCard.objects.search_collectible(True).search_by_class(c['card_class']).search_by_rarity(
+                    c['rarity'])
+                queryset.count()
+                list(queryset.values_list('pk', flat=True)[:100])
+
+        build = measure(CardColumns, 0, repeat=1)
+        columns = CardColumns(0)
+        orm = measure(legacy)
+        columnar = measure(lambda: [(selection.ids[:100], selection.facets())
+                                    for selection in (columns.select(**c) for c in criteria)])
+
+    return [
+        f'snapshot build:   {build * 1000:>8.1f} ms',
+        f'ORM filters:      {orm / len(criteria) * 1000:>8.2f} ms/request (count + page ids)',
+        f'columnar+facets:  {columnar / len(criteria) * 1000:>8.2f} ms/request (x{orm / columnar:.1f})',
+    ]
+
+
+@benchmark('reference_widgets')
+def bench_reference_widgets(size: int) -> list[str]:
+    """ Отрисовка size форм поиска карт: списки выбора из БД (ModelChoiceField) vs справочник в памяти """
+    from django import forms
+    from gallery.forms import RealCardFilterForm
+    from gallery.models import Tribe, Mechanic
+    from core.services.reference import bump_reference_version
+
+    class LegacyFilterForm(forms.Form):
+        mechanic = forms.ModelChoiceField(queryset=Mechanic.objects.filter(hidden=False), required=False)
+        tribe = forms.ModelChoiceField(queryset=Tribe.objects.all(), required=False)
+        card_class = forms.ModelChoiceField(queryset=CardClass.objects.all(), required=False)
+        card_set = forms.ModelChoiceField(queryset=CardSet.objects.all(), required=False)
+
+    fields = ('mechanic', 'tribe', 'card_class', 'card_set')
+
+    def render(form_class):
+        for i in range(size):
+            form = form_class(initial={'card_class': '3'})
+            for field in fields:
+                str(form[field])
+
+    with synthetic_data(0):
+        # объем справочников - как в реальном каталоге
+        CardSet.objects.bulk_create([CardSet(name=f'Set {i}', service_name=f'bench-set-{i}') for i in range(100)])
+        Tribe.objects.bulk_create([Tribe(name=f'Tribe {i}', service_name=f'bench-tribe-{i}') for i in range(30)])
+        Mechanic.objects.bulk_create([Mechanic(name=f'Mechanic {i}', service_name=f'bench-mechanic-{i}')
+                                      for i in range(80)])
+        bump_reference_version()
+        legacy = measure(render, LegacyFilterForm)
+        cached = measure(render, RealCardFilterForm)
+    bump_reference_version()
+
+    return [
+        f'ModelChoiceField: {legacy / size * 1000:>8.2f} ms/form',
+        f'reference cache:  {cached / size * 1000:>8.2f} ms/form (x{legacy / cached:.1f})',
+    ]
+
+
+@benchmark('card_presentation')
+def bench_card_presentation(size: int) -> list[str]:
+    """ Отображение size карт (стиль класса, рендер, миниатюра, URL): вычисление в фильтрах vs сохраненные поля """
+    from django.utils.translation import to_locale, get_language
+    from gallery.templatetags.custom_filters import get_cardclass_style, get_localized_render, get_thumbnail
+
+    def legacy_cclass(card):
+        if card.card_class.count() == 0:
+            return 'neutral'
+        if card.card_class.count() == 1:
+            return ''.join(card.card_class.all()[0].service_name.lower().split())
+        return 'multiclass ' + '-'.join(''.join(cls.service_name.lower().split()) for cls in card.card_class.all())
+
+    def legacy():
+        for card in RealCard.objects.filter(card_set__service_name='bench-set')[:size]:
+            legacy_cclass(card)
+            {'en': card.image_en.url, 'ru': card.image_ru.url}.get(to_locale(get_language()))
+            card.thumbnail.url
+            reverse('gallery:real_card', kwargs={'card_slug': card.slug})
+
+    def stored():
+        for card in RealCard.objects.filter(card_set__service_name='bench-set')[:size]:
+            get_cardclass_style(card)
+            get_localized_render(card)
+            get_thumbnail(card)
+            card.get_absolute_url()
+
+    with synthetic_data(0, num_cards=max(size, 3000)):
+        backfill = measure(RealCard.objects.filter(card_set__service_name='bench-set').refresh_presentation, repeat=1)
+        computed = measure(legacy)
+        precomputed = measure(stored)
+
+    return [
+        f'backfill:         {backfill * 1000:>8.1f} ms ({max(size, 3000)} cards)',
+        f'filters:          {computed / size * 1000:>8.3f} ms/card',
+        f'stored fields:    {precomputed / size * 1000:>8.3f} ms/card (x{computed / precomputed:.1f})',
+    ]
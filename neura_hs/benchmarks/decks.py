@@ -0,0 +1,258 @@
+""" Замеры кодов колод, поиска похожих колод, расшифровки и списков колод """
+
+import base64
+import random
+from io import BytesIO
+
+from django.db import transaction
+from django.db.models import Q, Count
+
+from core.services.deck_codes import parse_deckstring, parse_many, build_deckstring
+from gallery.models import RealCard
+from decks.models import Deck, SimilarDecksState
+from .harness import benchmark, measure, random_deck, synthetic_data
+
+
+def _legacy_parse_deckstring(deckstring):
+    """ Побайтовый разбор через BytesIO (реализация до перехода на буфер) - эталон для сравнения """
+
+    def read_varint(stream):
+        shift = 0
+        result = 0
+        while True:
+            i = ord(stream.read(1))
+            result |= (i & 0x7f) << shift
+            shift += 7
+            if not (i & 0x80):
+                break
+        return result
+
+    data = BytesIO(base64.b64decode(deckstring))
+    data.read(1)
+    read_varint(data)
+    format_ = read_varint(data)
+    heroes = [read_varint(data) for i in range(read_varint(data))]
+    cards = [(read_varint(data), 1) for i in range(read_varint(data))]
+    cards += [(read_varint(data), 2) for i in range(read_varint(data))]
+    cards += [(read_varint(data), read_varint(data)) for i in range(read_varint(data))]
+    return cards, heroes, format_
+
+
+@benchmark('deck_codes')
+def bench_deck_codes(size: int) -> list[str]:
+    """ Разбор size кодов колод: побайтовый парсер vs буферный, parse_many; сборка кодов """
+    rnd = random.Random(0)
+    decks = [random_deck(rnd) for i in range(size)]
+    codes = [build_deckstring(*deck) for deck in decks]
+
+    legacy = measure(lambda: [_legacy_parse_deckstring(c) for c in codes])
+    current = measure(lambda: [parse_deckstring(c) for c in codes])
+    bulk = measure(parse_many, codes)
+    encode = measure(lambda: [build_deckstring(*deck) for deck in decks])
+
+    return [
+        f'legacy parser:    {size / legacy:>10.0f} codes/s',
+        f'parse_deckstring: {size / current:>10.0f} codes/s (x{legacy / current:.2f})',
+        f'parse_many:       {size / bulk:>10.0f} codes/s (x{legacy / bulk:.2f})',
+        f'build_deckstring: {size / encode:>10.0f} codes/s',
+    ]
+
+
+def _legacy_find_similar_decks(target_deck: Deck):
+    """ Поиск похожих колод условными Count по всем колодам класса и формата - эталон для сравнения """
+    return Deck.nameless.filter(
+        deck_format=target_deck.deck_format,
+        deck_class=target_deck.deck_class,
+    ).exclude(
+        string=target_deck.string
+    ).annotate(
+        num_matches=2 * Count(
+            'cards',
+            filter=Q(inclusions__number=2) & Q(cards__in=target_deck.cards.filter(inclusions__number=2))
+        ) + Count(
+            'cards',
+            filter=Q(inclusions__number=2) & Q(cards__in=target_deck.cards.filter(inclusions__number=1))
+        ) + Count(
+            'cards',
+            filter=Q(inclusions__number=1) & Q(cards__in=target_deck.cards.all())
+        ),
+    ).filter(
+        num_matches__gt=19
+    ).order_by('-num_matches')
+
+
+@benchmark('similar_decks')
+def bench_similar_decks(size: int) -> list[str]:
+    """ Поиск похожих колод среди size безымянных колод: запрос с Count vs инвертированный индекс """
+    from core.services.deck_utils import find_similar_decks
+
+    with synthetic_data(size) as decks:
+        targets = random.Random(1).sample(decks, 20)
+        legacy = measure(lambda: [list(_legacy_find_similar_decks(deck)) for deck in targets], repeat=1)
+        current = measure(lambda: [find_similar_decks(deck) for deck in targets])
+
+    return [
+        f'legacy query:       {legacy / len(targets) * 1000:>8.1f} ms/deck',
+        f'find_similar_decks: {current / len(targets) * 1000:>8.1f} ms/deck (x{legacy / current:.1f})',
+    ]
+
+
+@benchmark('similar_matrix')
+def bench_similar_matrix(size: int) -> list[str]:
+    """
+    Предрасчет похожих колод для size безымянных колод (целевой объем - 100000):
+    поиск по индексу для каждой колоды vs матричный расчет (полный и инкрементальный для 1% новых колод)
+    """
+    from core.services.deck_utils import find_similar_decks
+    from core.services.similarity_matrix import compute_similar_decks
+
+    with synthetic_data(size) as decks:
+        targets = random.Random(1).sample(decks, 20)
+        per_deck = measure(lambda: [find_similar_decks(deck) for deck in targets], repeat=1) / len(targets)
+        full = measure(compute_similar_decks, True, repeat=1)
+        SimilarDecksState.objects.filter(pk=1).update(last_deck_id=decks[-max(size // 100, 1) - 1].pk)
+        incremental = measure(compute_similar_decks, repeat=1)
+
+    return [
+        f'find_similar_decks x {size}: {per_deck * size:>8.1f} s (extrapolated)',
+        f'compute_similar_decks (full):      {full:>8.1f} s (x{per_deck * size / full:.1f})',
+        f'compute_similar_decks (+1% decks): {incremental:>8.1f} s',
+    ]
+
+
+@benchmark('deck_card_search')
+def bench_deck_card_search(size: int) -> list[str]:
+    """ Поиск среди size колод по 1-10 картам: JOIN на каждую карту vs один подзапрос с GROUP BY / HAVING """
+    from api.services.filters import filter_decks_by_cards
+
+    def chained(dbf_ids):
+        queryset = Deck.nameless.all()
+        for dbf_id in dbf_ids:
+            queryset = queryset.filter(cards__dbf_id=dbf_id)
+        return list(queryset.values_list('pk', flat=True))
+
+    def grouped(dbf_ids):
+        return list(filter_decks_by_cards(Deck.nameless.all(), dict.fromkeys(dbf_ids, 1)).values_list('pk', flat=True))
+
+    results = []
+    with synthetic_data(size) as decks:
+        target = random.Random(1).choice(decks)
+        dbf_ids = list(target.cards.values_list('dbf_id', flat=True))
+        for num_cards in (1, 3, 5, 10):
+            assert set(chained(dbf_ids[:num_cards])) == set(grouped(dbf_ids[:num_cards]))
+            results.append((num_cards, measure(chained, dbf_ids[:num_cards]), measure(grouped, dbf_ids[:num_cards])))
+
+    return [f'{num_cards:>2} cards: chained {old * 1000:>8.1f} ms, grouped {new * 1000:>8.1f} ms (x{old / new:.1f})'
+            for num_cards, old, new in results]
+
+
+@benchmark('deck_decode')
+def bench_deck_decode(size: int) -> list[str]:
+    """ Расшифровка size новых колод: сохранение в БД (create_from_deckstring) vs каталог в памяти """
+    from core.services.deck_catalog import decode_deck, reset_deck_catalog
+
+    with synthetic_data(size) as decks:
+        rnd = random.Random(1)
+        cards = list(RealCard.objects.filter(card_set__service_name='bench-set').values_list('dbf_id', flat=True))
+        heroes = parse_deckstring(decks[0].string)[1]
+        deckstrings = [build_deckstring([(dbf_id, 2) for dbf_id in rnd.sample(cards, 15)], heroes, 2)
+                       for _ in range(size)]
+        reset_deck_catalog()
+        catalog = measure(decode_deck, deckstrings[0], repeat=1)
+
+        def persist():
+            with transaction.atomic():
+                for deckstring in deckstrings:
+                    Deck.create_from_deckstring(deckstring)
+                transaction.set_rollback(True)
+
+        saved = measure(persist, repeat=1) / size
+        decoded = measure(lambda: [decode_deck(deckstring) for deckstring in deckstrings]) / size
+    reset_deck_catalog()
+
+    return [
+        f'catalog build:         {catalog * 1000:>8.1f} ms (once per process and catalog version)',
+        f'create_from_deckstring: {saved * 1000:>7.2f} ms/deck',
+        f'decode_deck:            {decoded * 1000:>7.2f} ms/deck (x{saved / decoded:.1f})',
+    ]
+
+
+@benchmark('deck_list_page')
+def bench_deck_list_page(size: int) -> list[str]:
+    """
+    Отрисовка size страниц списка колод (по 18) с картами колод в разметке: состав каждой колоды отдельно
+    vs загрузка для всей страницы (с переходом на загрузку карт при раскрытии - см. lazy_deck_cards)
+    """
+    from django.db import connection
+    from django.template.loader import render_to_string
+    from django.test.utils import CaptureQueriesContext
+    from core.services.deck_utils import load_included_cards
+
+    def render(load):
+        for page in range(size):
+            decks = Deck.nameless.all()[page * 18 % 900:page * 18 % 900 + 18]
+            load(decks)
+            for deck in decks:
+                render_to_string('decks/tags/deck-accordion.html', {'deck': deck})
+
+    with synthetic_data(1000):
+        results = []
+        for name, load in (('per deck', lambda decks: None), ('per page', load_included_cards)):
+            with CaptureQueriesContext(connection) as queries:
+                render(load)
+            results.append((name, measure(render, load), len(queries) / size))
+
+    return [f'{name:>8}: {elapsed / size * 1000:>8.1f} ms/page, {num_queries:>6.1f} queries/page'
+            for name, elapsed, num_queries in results]
+
+
+@benchmark('lazy_deck_cards')
+def bench_lazy_deck_cards(size: int) -> list[str]:
+    """ Страница списка колод (size страниц по 18): карты колод в разметке страницы vs загрузка при раскрытии """
+    from django.template.loader import render_to_string
+    from core.services.deck_utils import load_included_cards, load_craft_costs
+
+    def render(eager: bool) -> int:
+        length = 0
+        for page in range(size):
+            decks = Deck.nameless.all()[page * 18 % 900:page * 18 % 900 + 18]
+            (load_included_cards if eager else load_craft_costs)(decks)
+            for deck in decks:
+                length += len(render_to_string('decks/tags/deck-accordion.html', {'deck': deck}))
+                if eager:
+                    length += len(render_to_string('decks/tags/deck-cards.html', {'deck': deck}))
+        return length
+
+    with synthetic_data(1000):
+        results = [(name, measure(render, eager), render(eager)) for name, eager in (('eager', True), ('lazy', False))]
+
+    return [f'{name:>6}: {elapsed / size * 1000:>8.1f} ms/page, {length / size / 1024:>8.1f} KiB/page'
+            for name, elapsed, length in results]
+
+
+@benchmark('keyset_pagination')
+def bench_keyset_pagination(size: int) -> list[str]:
+    """ Страницы списка из size колод (по 18): Paginator (COUNT + OFFSET) vs KeysetPaginator (кэш числа + ключ) """
+    from django.core.paginator import Paginator
+    from core.services.pagination import KeysetPaginator
+
+    with synthetic_data(size):
+        queryset = Deck.nameless.all()
+        num_pages = Paginator(queryset, 18).num_pages
+        middle = (num_pages + 1) // 2
+        previous = KeysetPaginator(queryset, 18).page(middle - 1)
+        cursor = KeysetPaginator(queryset, 18).encode_cursor(previous, middle)
+
+        def legacy(number):
+            list(Paginator(queryset, 18).page(number))
+
+        def keyset(number, cursor=None):
+            list(KeysetPaginator(queryset, 18, cursor=cursor).page(number))
+
+        results = []
+        for label, number in (('first', 1), ('middle', middle), ('last', num_pages)):
+            results.append((f'{label} page ({number})', measure(legacy, number), measure(keyset, number)))
+        results.append((f'middle page, cursor', measure(legacy, middle), measure(keyset, middle, cursor)))
+
+    return [f'{label:<22}: Paginator {old * 1000:>8.2f} ms, keyset {new * 1000:>8.2f} ms'
+            for label, old, new in results]
@@ -0,0 +1,114 @@
+""" Инструменты замеров: регистрация, измерение времени и синтетические данные """
+
+import random
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from django.db import transaction
+
+from core.services.deck_codes import build_deckstring, get_deck_identity
+from gallery.models import RealCard, CardClass, CardSet
+from decks.models import Deck, Format, Inclusion, SimilarityPosting
+
+BENCHMARKS: dict[str, Callable[[int], list[str]]] = {}
+
+
+def benchmark(name: str):
+    """ Регистрирует функцию замера под именем name """
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def measure(func: Callable, *args, repeat: int = 3) -> float:
+    """ Лучшее из repeat время выполнения func(*args), с """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def random_deck(rnd: random.Random) -> tuple[list[tuple[int, int]], list[int], int]:
+    """ Случайная колода в формате parse_deckstring (30 карт) """
+    cards, total = [], 0
+    for dbf_id in rnd.sample(range(1, 90000), 30):
+        count = 2 if total < 28 and rnd.random() < 0.5 else 1
+        cards.append((dbf_id, count))
+        total += count
+        if total == 30:
+            break
+    return cards, [rnd.randint(1, 90000)], rnd.choice((1, 2, 3))
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def synthetic_data(num_decks: int, num_cards: int = 3000, seed: int = 0):
+    """
+    Наполняет БД синтетическими картами и безымянными колодами (по 10 архетипов на класс, с вариациями);
+    по выходе из блока все изменения откатываются
+    """
+    rnd = random.Random(seed)
+    try:
+        with transaction.atomic():
+            classes = [CardClass.objects.create(name=f'Class {i}', service_name=f'bench-class-{i}', collectible=True)
+                       for i in range(11)]
+            neutral, playable = classes[0], classes[1:]
+            card_set = CardSet.objects.create(name='Benchmark', service_name='bench-set')
+            formats = [Format.objects.create(name=f'Format {i}', numerical_designation=i) for i in range(1, 4)]
+
+            rarities = [r for r, label in RealCard.Rarities.choices if r]
+            types = [t for t, label in RealCard.CardTypes.choices if t]
+            RealCard.objects.bulk_create([
+                RealCard(name=f'Card {i}', slug=f'bench-card-{i}', dbf_id=10 ** 6 + i, card_id=f'BENCH_{i}',
+                         card_type=rnd.choice(types), rarity=rnd.choice(rarities), cost=rnd.randint(0, 10),
+                         attack=rnd.randint(0, 12), health=rnd.randint(0, 12), text=f'Benchmark card {i}',
+                         card_set=card_set, collectible=True)
+                for i in range(num_cards)
+            ], batch_size=1000)
+            cards = list(RealCard.objects.filter(card_set=card_set).order_by('pk'))
+            card_classes = RealCard.card_class.through
+            card_classes.objects.bulk_create([card_classes(realcard_id=card.pk, cardclass_id=classes[i % 11].pk)
+                                              for i, card in enumerate(cards)], batch_size=1000)
+            pools = {cls.pk: [card for i, card in enumerate(cards) if i % 11 in (0, n + 1)]
+                     for n, cls in enumerate(playable)}
+            archetypes = {cls.pk: [rnd.sample(pools[cls.pk], 18) for i in range(10)] for cls in playable}
+            heroes = {cls.pk: cards[n + 1] for n, cls in enumerate(playable)}
+
+            decks, compositions, identities = [], [], set()
+            while len(decks) < num_decks:
+                cls = rnd.choice(playable)
+                base = rnd.choice(archetypes[cls.pk])
+                core = rnd.sample(base, 18 - rnd.randint(0, 8))
+                extra = [card for card in rnd.sample(pools[cls.pk], 20) if card not in core]
+                deck_cards = (core + extra)[:18]
+                composition = {card.pk: (2 if n < 12 else 1) for n, card in enumerate(deck_cards)}
+                format_ = rnd.choice(formats)
+                cards_data = [(card.dbf_id, composition[card.pk]) for card in deck_cards]
+                heroes_data = [heroes[cls.pk].dbf_id]
+                identity = get_deck_identity(cards_data, heroes_data, format_.numerical_designation)
+                if identity in identities:
+                    continue    # безымянные колоды уникальны (unique_nameless_deck_identity)
+                identities.add(identity)
+                decks.append(Deck(string=build_deckstring(cards_data, heroes_data, format_.numerical_designation),
+                                  identity=identity, deck_class=cls, deck_format=format_))
+                compositions.append(composition)
+            Deck.objects.bulk_create(decks, batch_size=1000)
+            decks = list(Deck.objects.order_by('pk'))[-num_decks:]
+            Inclusion.objects.bulk_create([Inclusion(deck=deck, card_id=card_id, number=number)
+                                           for deck, composition in zip(decks, compositions)
+                                           for card_id, number in composition.items()], batch_size=5000)
+            SimilarityPosting.objects.rebuild()
+
+            yield decks
+            raise Rollback
+    except Rollback:
+        pass
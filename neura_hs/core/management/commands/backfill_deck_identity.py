@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.services.deck_utils import backfill_deck_identity
+
+
+class Command(BaseCommand):
+    help = 'Fills in deck identities and merges duplicate nameless decks (update_db -r also does this before rebuilding decks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-a', '--all', action='store_true', help='Recalculate identities of all decks')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            report = backfill_deck_identity(recalculate=options['all'])
+        self.stdout.write(f'Identities set: {report["updated"]}')
+        self.stdout.write(f'Duplicates merged: {report["merged"]}')
+        if report['invalid']:
+            self.stdout.write(f'(!) Invalid deck codes (ids): {" ".join(map(str, report["invalid"]))}')
+
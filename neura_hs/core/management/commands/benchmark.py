@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Runs performance benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run (default: all). '
+                                                     f'Available: {", ".join(BENCHMARKS)}')
+        parser.add_argument('-s', '--size', type=int, default=10000, help='Size of the generated data set')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        if unknown := [name for name in names if name not in BENCHMARKS]:
+            raise CommandError(f'Unknown benchmarks: {", ".join(unknown)}')
+
+        for name in names:
+            self.stdout.write(f'--- {name} (size={options["size"]}) ---')
+            for line in BENCHMARKS[name](options['size']):
+                self.stdout.write(line)
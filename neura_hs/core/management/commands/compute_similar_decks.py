@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.services.similarity_matrix import compute_similar_decks
+
+
+class Command(BaseCommand):
+    help = 'Precomputes similar decks for nameless decks added since the last run (schedule after loaddecks/update_db)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-f', '--full', action='store_true', help='Recompute similar decks for all decks')
+
+    def handle(self, *args, **options):
+        report = compute_similar_decks(full=options['full'])
+        self.stdout.write(f'Partitions processed: {report["partitions"]}')
+        self.stdout.write(f'Decks processed: {report["decks"]}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from decks.models import DailyDeckCount
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the daily deck/card counters used for trends'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            DailyDeckCount.objects.rebuild()
+        self.stdout.write(f'Days with decks: {DailyDeckCount.objects.values("day").distinct().count()}')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.services.card_search import create_search_index, rebuild_search_index, is_available
+
+
+class Command(BaseCommand):
+    help = 'Creates (if necessary) and rebuilds the full-text card search index'
+
+    def handle(self, *args, **options):
+        create_search_index()
+        if not is_available():
+            self.stdout.write('Full-text search is not supported by the database: falling back to icontains')
+            return
+        with transaction.atomic():
+            indexed = rebuild_search_index()
+        self.stdout.write(f'Cards indexed: {indexed}')
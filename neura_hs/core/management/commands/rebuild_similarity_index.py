@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from decks.models import SimilarityPosting
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the card -> deck index used to find similar decks'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            num_decks = SimilarityPosting.objects.rebuild()
+        self.stdout.write(f'Indexed decks: {num_decks}')
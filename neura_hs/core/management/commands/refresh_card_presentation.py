@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gallery.models import RealCard
+
+
+class Command(BaseCommand):
+    help = 'Recomputes stored presentation fields of Hearthstone cards (class style, page and image URLs)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            refreshed = RealCard.objects.refresh_presentation()
+        self.stdout.write(f'Cards refreshed: {refreshed}')
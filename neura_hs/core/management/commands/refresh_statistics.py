@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.services.statistics import refresh_statistics
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the statistics snapshot, including the most popular cards (run on a schedule)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            snapshot = refresh_statistics()
+        self.stdout.write(f'Nameless decks: {snapshot.num_decks}')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core.services.deck_catalog import save_decoded
+
+
+class Command(BaseCommand):
+    help = 'Saves decoded decks that are waiting in the queue (run periodically)'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Decks processed: {save_decoded()}')
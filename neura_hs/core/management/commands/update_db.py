@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 import time
 
 from core.services.update import Updater
+from api.services.export import write_catalog_snapshots
 
 
 class Command(BaseCommand):
@@ -14,6 +15,8 @@ class Command(BaseCommand):
         start = time.perf_counter()
         upd = Updater(self.stdout.write, rewrite=options['rewrite'])
         upd.update()
+        self.stdout.write('Writing catalog snapshots...')
+        write_catalog_snapshots()
         end = time.perf_counter()
         self.stdout.write(f'Database update took {end - start:.2f}s')
         self.stdout.write('Renders need to be updated:')
@@ -2,7 +2,9 @@ from django import forms
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 from slugify import slugify as translit_slugify
-from gallery.models import RealCard, FanCard, CardClass, Tribe
+from gallery.models import RealCard, FanCard
+from core.services.reference import get_reference_data
+from core.services.pagination import KeysetPaginator
 from django.conf import settings
 import time
 
@@ -21,6 +23,15 @@ class DataMixin:
         return context
 
 
+class KeysetPaginationMixin:
+    """ Постраничный вывод по ключу сортировки (core.services.pagination); курсор - из параметра cursor """
+    paginator_class = KeysetPaginator
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return self.paginator_class(queryset, per_page, orphans, allow_empty_first_page,
+                                    cursor=self.request.GET.get('cursor'), **kwargs)
+
+
 # (!) Заморожено
 class EditCardMixin:
     """ Объединяет пользовательские валидаторы для форм создания и редактирования карт """
@@ -38,7 +49,7 @@ class EditCardMixin:
         """ Валидатор, контролирующий количество выбираемых классов """
 
         card_classes = self.cleaned_data['card_class']
-        neutral = CardClass.objects.get(service_name='Neutral')
+        neutral = get_reference_data().card_class('Neutral')
         if neutral in card_classes:
             return [neutral]    # нейтральный класс устанавливается независимо от прочих выбранных классов
         if (num := len(card_classes)) > 3:
@@ -49,7 +60,7 @@ class EditCardMixin:
     def clean_tribe(self: forms.ModelForm):
         """ Валидатор, запрещающий выбор расы не для существа и контролирующий кол-во рас """
         tribes = self.cleaned_data['tribe']
-        alltribe = Tribe.objects.get(service_name='All')
+        alltribe = get_reference_data().tribe('All')
         if alltribe in tribes:
             return [alltribe]   # раса "Всё" устанавливается независимо от прочих выбранных рас
         if tribes and self.cleaned_data['card_type'] != FanCard.CardTypes.MINION:
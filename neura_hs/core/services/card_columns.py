@@ -0,0 +1,191 @@
+"""
+Поколоночный снимок карт Hearthstone в памяти процесса для фильтрации и подсчета фасетов без запросов к БД:
+массивы NumPy (стоимость, атака, здоровье, редкость, тип, набор...) и битовые маски (классы, расы, механики).
+Фильтр - побитовые операции над масками, результат - id карт в порядке каталога и число карт
+по редкостям, классам и наборам. Снимок перестраивается при смене версии каталога (update_db)
+и при изменении карт в этом процессе
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from django.db.models import Case, When, QuerySet
+
+from gallery.models import RealCard, CardClass, CardSet, HearthstoneState
+from core.services.reference import get_reference_data
+
+NUMERIC_COLUMNS = ('cost', 'attack', 'health', 'durability', 'armor')
+HERO_SKINS = 'Hero Skins'
+
+
+@dataclass
+class Selection:
+    """ Результат фильтрации: маска по строкам снимка """
+    catalog: 'CardColumns'
+    mask: np.ndarray
+
+    @property
+    def ids(self) -> np.ndarray:
+        """ pk отобранных карт в порядке каталога (по убыванию стоимости) """
+        return self.catalog.pk[self.mask]
+
+    def ordered(self, pks: Iterable[int]) -> list[int]:
+        """ Отобранные карты из pks в порядке pks (напр., по релевантности полнотекстового поиска) """
+        position = self.catalog.position
+        return [pk for pk in pks if (row := position.get(pk)) is not None and self.mask[row]]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.mask))
+
+    def facets(self) -> dict[str, dict]:
+        """ Число отобранных карт по редкостям, классам и наборам """
+        catalog, mask = self.catalog, self.mask
+        rarities, counts = np.unique(catalog.rarity[mask], return_counts=True)
+        sets, set_counts = np.unique(catalog.card_set[mask], return_counts=True)
+        classes = {pk: int(np.count_nonzero(bitmap & mask)) for pk, bitmap in catalog.card_class.items()}
+        return {
+            'rarity': dict(zip(rarities.tolist(), counts.tolist())),
+            'card_class': {pk: count for pk, count in classes.items() if count},
+            'card_set': {pk: count for pk, count in zip(sets.tolist(), set_counts.tolist()) if pk >= 0},
+        }
+
+
+def label_facets(facets: dict[str, dict]) -> dict[str, list[tuple[str, int]]]:
+    """ Фасеты для отображения: (название, число карт) по убыванию числа карт """
+    reference = get_reference_data()
+    labels = {
+        'rarity': dict(RealCard.Rarities.choices),
+        'card_class': {pk: str(obj) for pk, obj in reference.in_bulk(CardClass).items()},
+        'card_set': {pk: str(obj) for pk, obj in reference.in_bulk(CardSet).items()},
+    }
+    return {facet: sorted(((str(labels[facet].get(key, key)), count) for key, count in counts.items()),
+                          key=lambda item: -item[1])
+            for facet, counts in facets.items()}
+
+
+class CardColumns:
+    """ Столбцы снимка упорядочены как список карт галереи: по убыванию стоимости, затем по pk """
+
+    def __init__(self, version: int):
+        self.version = version
+        rows = list(RealCard.objects.order_by('-cost', 'pk').values_list(
+            'pk', 'rarity', 'card_type', 'collectible', 'card_set', *NUMERIC_COLUMNS,
+        ))
+        self.size = len(rows)
+        columns = list(zip(*rows)) or [()] * (5 + len(NUMERIC_COLUMNS))
+        self.pk = np.array(columns[0], dtype=np.int64)
+        self.rarity = np.array(columns[1], dtype='<U2')
+        self.card_type = np.array(columns[2], dtype='<U2')
+        self.collectible = np.array(columns[3], dtype=bool)
+        self.card_set = np.array([pk if pk is not None else -1 for pk in columns[4]], dtype=np.int64)
+        self.numeric = {name: np.array([value or 0 for value in column], dtype=np.int16)
+                        for name, column in zip(NUMERIC_COLUMNS, columns[5:])}
+        self.position = {pk: i for i, pk in enumerate(columns[0])}
+
+        self.card_class = self._bitmaps(RealCard.card_class.through, 'cardclass_id')
+        self.tribe = self._bitmaps(RealCard.tribe.through, 'tribe_id')
+        self.mechanic = self._bitmaps(RealCard.mechanic.through, 'mechanic_id')
+        reference = get_reference_data()
+        self.supertribe = getattr(reference.tribe('All'), 'pk', None)
+        self.hero_skins = getattr(reference.card_set(HERO_SKINS), 'pk', None)
+
+    def _bitmaps(self, through, field: str) -> dict[int, np.ndarray]:
+        """ Маска карт для каждого значения ManyToMany-поля """
+        bitmaps = {}
+        for card_pk, value in through.objects.values_list('realcard_id', field).iterator():
+            if (row := self.position.get(card_pk)) is not None:
+                bitmaps.setdefault(value, np.zeros(self.size, dtype=bool))[row] = True
+        return bitmaps
+
+    def _bitmap(self, bitmaps: dict[int, np.ndarray], pk) -> np.ndarray:
+        return bitmaps.get(int(pk), np.zeros(self.size, dtype=bool))
+
+    def select(self, *, rarity: Optional[str] = None, collectible: Optional[bool] = None,
+               card_type: Optional[str] = None, tribe=None, card_class: Optional[Sequence] = None,
+               card_set=None, mechanic=None, ranges: Optional[dict] = None,
+               within: Optional[Iterable[int]] = None) -> Selection:
+        """
+        Отбор карт (условия объединяются по И, как в RealCardListView.get_queryset)
+        :param tribe: pk расы (подходят и карты с расой "Все")
+        :param card_class: pk класса или список pk (подходит любой из классов; пустой список - ни одна карта)
+        :param ranges: столбец из NUMERIC_COLUMNS -> (min, max), границы включаются, None - без ограничения
+        :param within: pk карт, отобранных иначе (напр., полнотекстовым поиском)
+        """
+        mask = np.ones(self.size, dtype=bool)
+        if rarity:
+            mask &= self.rarity == rarity
+        if collectible is not None:
+            mask &= self.collectible == collectible
+        if card_type:
+            mask &= self.card_type == card_type
+            if card_type == RealCard.CardTypes.HERO and collectible and self.hero_skins is not None:
+                mask &= self.card_set != self.hero_skins
+        if tribe is not None:
+            tribe_mask = self._bitmap(self.tribe, tribe)
+            if self.supertribe is not None:
+                tribe_mask = tribe_mask | self._bitmap(self.tribe, self.supertribe)
+            mask &= tribe_mask
+        if card_class is not None:
+            classes = card_class if isinstance(card_class, (list, tuple, set)) else [card_class]
+            class_mask = np.zeros(self.size, dtype=bool)
+            for pk in classes:
+                class_mask |= self._bitmap(self.card_class, pk)
+            mask &= class_mask
+        if card_set is not None:
+            mask &= self.card_set == int(card_set)
+        if mechanic is not None:
+            mask &= self._bitmap(self.mechanic, mechanic)
+        for name, (low, high) in (ranges or {}).items():
+            if low is not None:
+                mask &= self.numeric[name] >= low
+            if high is not None:
+                mask &= self.numeric[name] <= high
+        if within is not None:
+            mask &= np.isin(self.pk, np.fromiter(within, dtype=np.int64))
+        return Selection(self, mask)
+
+
+class CardPages:
+    """
+    Отобранные карты как последовательность для Paginator: срез загружает из БД только карты страницы
+    (в заданном порядке, со связями)
+    """
+
+    def __init__(self, ids: Sequence[int], queryset: QuerySet):
+        self.ids = ids
+        self.queryset = queryset
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        ids = [int(pk) for pk in self.ids[item]]
+        order = Case(*[When(pk=pk, then=i) for i, pk in enumerate(ids)])
+        return self.queryset.filter(pk__in=ids).order_by(order) if ids else self.queryset.none()
+
+
+_columns: Optional[CardColumns] = None
+_lock = threading.Lock()
+
+
+def get_card_columns() -> CardColumns:
+    """ Снимок текущей версии каталога (строится при первом обращении в процессе и после каждого обновления БД) """
+    global _columns
+    version, last_updated = HearthstoneState.get_catalog_version()
+    columns = _columns
+    if columns is None or columns.version != version:
+        with _lock:
+            if _columns is None or _columns.version != version:
+                _columns = CardColumns(version)
+            columns = _columns
+    return columns
+
+
+def reset_card_columns() -> None:
+    """ Сбрасывает снимок процесса (перестроится при следующем обращении) """
+    global _columns
+    _columns = None
@@ -0,0 +1,169 @@
+"""
+Полнотекстовый поиск карт Hearthstone: индекс FTS5 (SQLite) по названию, тексту и описанию карт на всех языках.
+Индекс хранит нормализованный текст (нижний регистр, ё -> е, без разметки), поиск - по префиксам слов
+с ранжированием bm25 (совпадение в названии весит больше). Если СУБД - не SQLite или FTS5 недоступен,
+поиск выполняется по тем же полям и тем же нормализованным словам (iregex, без ранжирования)
+"""
+
+import re
+import threading
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.db import connection, OperationalError
+from django.db.models import Q, QuerySet
+
+from gallery.models import RealCard
+
+FTS_TABLE = 'gallery_realcard_fts'
+# столбец индекса -> поля модели (для каждого языка сайта)
+COLUMNS = {
+    'name': ('name',),
+    'body': ('text', 'flavor'),
+}
+RANK = 'bm25(10.0, 1.0)'
+
+_TAG = re.compile(r'<[^>]*>')
+_WORD = re.compile(r'\w+')
+
+_available: Optional[bool] = None
+_deferred = threading.local()
+
+
+def normalize(text: str) -> str:
+    """ Нормализованный текст для индекса и запросов: слова в нижнем регистре, ё -> е """
+    text = _TAG.sub(' ', text or '').lower().replace('ё', 'е')
+    return ' '.join(_WORD.findall(text))
+
+
+def _model_fields(column: Optional[str] = None) -> list[str]:
+    """ Поля модели (с учетом языков) для столбца индекса (None - для всех столбцов) """
+    columns = [column] if column else COLUMNS
+    return [f'{field}_{language}' for col in columns for field in COLUMNS[col] for language, _ in settings.LANGUAGES]
+
+
+def is_available() -> bool:
+    """ Есть ли индекс в БД (проверяется один раз за процесс) """
+    global _available
+    if _available is None:
+        _available = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _available
+
+
+def create_search_index(**kwargs) -> None:
+    """ Создает индекс, если его нет (после migrate); заполняется при обновлении БД или rebuild_search_index """
+    global _available
+    if connection.vendor != 'sqlite':
+        _available = False
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                           f'USING fts5({", ".join(COLUMNS)}, tokenize="unicode61 remove_diacritics 2")')
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', %s)", [RANK])
+    except OperationalError:
+        _available = False      # SQLite собран без FTS5
+    else:
+        _available = True
+
+
+def _documents(queryset: QuerySet) -> Iterable[tuple]:
+    """ Строки индекса (rowid - pk карты) """
+    fields = {column: _model_fields(column) for column in COLUMNS}
+    for row in queryset.values('pk', *_model_fields()).iterator():
+        yield (row['pk'], *(normalize(' '.join(row[f] or '' for f in fields[column])) for column in COLUMNS))
+
+
+def _write(cursor, queryset: QuerySet) -> None:
+    placeholders = ', '.join(['%s'] * (len(COLUMNS) + 1))
+    cursor.executemany(f'INSERT INTO {FTS_TABLE}(rowid, {", ".join(COLUMNS)}) VALUES ({placeholders})',
+                       list(_documents(queryset)))
+
+
+def rebuild_search_index() -> int:
+    """ Полная перестройка индекса; возвращает число проиндексированных карт """
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        _write(cursor, RealCard.objects.order_by())
+    return RealCard.objects.count()
+
+
+def is_sync_deferred() -> bool:
+    """ Идет ли массовая запись карт (блок deferred_index_sync) """
+    return getattr(_deferred, 'active', False)
+
+
+def sync_cards(pks: list[int], *, deleted: bool = False) -> None:
+    """ Обновление записей индекса для отдельных карт (изменения через админ-панель и т.п.) """
+    if not is_available() or is_sync_deferred():
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})', pks)
+        if not deleted:
+            _write(cursor, RealCard.objects.filter(pk__in=pks).order_by())
+
+
+@contextmanager
+def deferred_index_sync():
+    """
+    Массовая запись карт (обновление БД): сигналы не трогают индекс по каждой карте,
+    а по завершении блока без ошибок индекс перестраивается целиком
+    """
+    _deferred.active = True
+    try:
+        yield
+    finally:
+        _deferred.active = False
+    rebuild_search_index()
+
+
+def match_expression(query: str, column: Optional[str] = None) -> Optional[str]:
+    """
+    Запрос FTS5: все слова запроса как префиксы (None - в запросе нет слов)
+    :param column: искать только в столбце индекса ('name' / 'body')
+    """
+    words = normalize(query).split()
+    if not words:
+        return None
+    expression = ' '.join(f'"{word}"*' for word in words)
+    return f'{column} : ({expression})' if column else expression
+
+
+def fallback_condition(query: str, column: Optional[str] = None) -> Q:
+    """
+    Условие поиска без индекса: каждое слово запроса (нормализованное, как для FTS5) - в одном из полей
+    столбца; регистр и ё / е не учитываются
+    """
+    condition = Q()
+    for word in normalize(query).split():
+        pattern = word.replace('е', '[её]')
+        any_field = Q()
+        for field in _model_fields(column):
+            any_field |= Q(**{f'{field}__iregex': pattern})
+        condition &= any_field
+    return condition
+
+
+def search_cards(queryset: QuerySet, query: str, column: Optional[str] = None) -> QuerySet:
+    """
+    Карты, содержащие все слова запроса (по префиксу), от наиболее релевантных
+    :param column: 'name' - поиск только по названию, 'body' - по тексту и описанию, None - везде
+    """
+    expression = match_expression(query, column)
+    if expression is None:
+        return queryset
+    if not is_available():
+        return queryset.filter(fallback_condition(query, column))
+
+    table = queryset.model._meta.db_table
+    return queryset.extra(
+        tables=[FTS_TABLE],
+        where=[f'{FTS_TABLE}.rowid = {table}.id', f'{FTS_TABLE} MATCH %s'],
+        params=[expression],
+        select={'search_rank': f'{FTS_TABLE}.rank'},
+        order_by=['search_rank'],
+    )
@@ -0,0 +1,80 @@
+"""
+Выполнение блокирующей работы из асинхронных представлений (ASGI):
+запросы к БД - в пуле потоков, CPU-задачи (рендеры колод) - в ограниченном пуле процессов
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+# семафор ожидающих задач - свой для каждого цикла событий (создается внутри работающего цикла)
+_cpu_slots: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _with_connection_cleanup(func: Callable) -> Callable:
+    """ Закрывает соединения с БД потока после вызова (как в конце обычного запроса) """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return wrapper
+
+
+def db_async(func: Callable) -> Callable:
+    """
+    Асинхронная обертка для функции, обращающейся к БД. В отличие от синхронных представлений под ASGI
+    (все - в одном потоке, thread_sensitive=True), вызовы выполняются параллельно в пуле потоков
+    """
+    return sync_to_async(_with_connection_cleanup(func), thread_sensitive=False)
+
+
+def async_view(view: Callable) -> Callable:
+    """ Асинхронный вариант синхронного представления (напр., представления DRF) для ASGI """
+
+    async def wrapper(request, *args, **kwargs):
+        return await db_async(view)(request, *args, **kwargs)
+
+    wrapper.csrf_exempt = getattr(view, 'csrf_exempt', False)
+    return functools.wraps(view)(wrapper)
+
+
+def _init_worker():
+    """ Процесс пула запускается через spawn и настраивает Django заново """
+    import django
+    django.setup()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.CPU_WORKERS, initializer=_init_worker,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+async def run_cpu(func: Callable, *args):
+    """
+    Выполняет func(*args) в пуле процессов (func и аргументы должны сериализоваться pickle).
+    func не должна обращаться к БД: данные загружаются и сохраняются вызывающим кодом через db_async.
+    Одновременно ожидают не более 2 * CPU_WORKERS задач - остальные запросы ждут очереди, не перегружая пул;
+    при CPU_WORKERS = 0 задача выполняется в пуле потоков
+    """
+    if not settings.CPU_WORKERS:
+        return await db_async(func)(*args)
+    loop = asyncio.get_running_loop()
+    if (slots := _cpu_slots.get(loop)) is None:
+        slots = _cpu_slots[loop] = asyncio.Semaphore(2 * settings.CPU_WORKERS)
+    async with slots:
+        return await loop.run_in_executor(get_process_pool(), func, *args)
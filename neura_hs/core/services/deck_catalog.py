@@ -0,0 +1,161 @@
+"""
+Каталог карт в памяти процесса для расшифровки колод без записи в БД.
+Перестраивается при смене версии каталога (update_db) и при изменении карт, классов и форматов в этом процессе
+"""
+
+import copy
+import random
+import threading
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from core.exceptions import DecodeError, UnsupportedCards
+from core.services.deck_codes import parse_deckstring, get_deck_identity
+from gallery.models import RealCard, HearthstoneState
+from decks.models import Deck, Format
+
+
+class DeckCatalog:
+    """ Карты, которые можно включить в колоду, классы героев и форматы """
+
+    def __init__(self, version: int):
+        self.version = version
+        self.cards = {card.dbf_id: card for card in RealCard.includibles.select_related('card_set').prefetch_related(
+            'card_class', 'tribe', 'mechanic',
+        )}
+        # класс колоды - первый (по pk) класс карты героя, как в Deck.create_from_deckstring
+        self.hero_classes = {}
+        for hero in RealCard.objects.filter(card_type=RealCard.CardTypes.HERO).prefetch_related('card_class'):
+            classes = list(hero.card_class.all())
+            self.hero_classes[hero.dbf_id] = min(classes, key=lambda c: c.pk) if classes else None
+        self.formats = {f.numerical_designation: f for f in Format.objects.all()}
+
+    def hero_class(self, dbf_id: int):
+        """ Класс колоды по карте героя (герои другого типа дочитываются из БД и запоминаются) """
+        if dbf_id not in self.hero_classes:
+            hero = RealCard.objects.filter(dbf_id=dbf_id).first()
+            self.hero_classes[dbf_id] = hero.card_class.order_by('pk').first() if hero else None
+        return self.hero_classes[dbf_id]
+
+    def decode(self, deckstring: str, *, lookup: bool = True) -> Deck:
+        """
+        Колода по коду без записи в БД: карты, класс и формат - из каталога
+        :param lookup: вернуть сохраненную безымянную колоду того же состава, если она есть (один запрос на чтение)
+        """
+        cards, heroes, format_ = parse_deckstring(deckstring)
+        identity = get_deck_identity(cards, heroes, format_)
+
+        decoded = []
+        for dbf_id, number in cards:
+            if (card := self.cards.get(dbf_id)) is None:
+                msg = _('No card data (id %(id)s)') % {'id': dbf_id}
+                raise UnsupportedCards(msg)
+            card = copy.copy(card)      # объекты каталога разделяются потоками: number - только у копии
+            card.number = number
+            decoded.append(card)
+
+        if (deck_class := self.hero_class(heroes[0])) is None:
+            raise UnsupportedCards(_('No card data (id %(id)s)') % {'id': heroes[0]})
+        if format_ not in self.formats:
+            raise DecodeError(_('Invalid deck code'))
+
+        deck = None
+        if lookup:
+            deck = Deck.objects.filter(identity=identity, name='', author=None).first()
+        if deck is None:
+            deck = Deck(string=deckstring, identity=identity)
+        deck.deck_class = deck_class
+        deck.deck_format = self.formats[format_]
+        deck.set_decoded_cards(decoded)
+        return deck
+
+
+_catalog: Optional[DeckCatalog] = None
+_lock = threading.Lock()
+
+
+def get_deck_catalog() -> DeckCatalog:
+    """ Каталог текущей версии (строится при первом обращении в процессе и после каждого обновления БД) """
+    global _catalog
+    version, last_updated = HearthstoneState.get_catalog_version()
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _lock:
+            if _catalog is None or _catalog.version != version:
+                _catalog = DeckCatalog(version)
+            catalog = _catalog
+    return catalog
+
+
+def reset_deck_catalog() -> None:
+    """ Сбрасывает каталог процесса (перестроится при следующем обращении) """
+    global _catalog
+    _catalog = None
+
+
+def decode_deck(deckstring: str, *, lookup: bool = True) -> Deck:
+    """ Расшифровка колоды по каталогу в памяти (см. DeckCatalog.decode) """
+    return get_deck_catalog().decode(deckstring, lookup=lookup)
+
+
+# очередь расшифрованных колод в кэше: счетчик слотов, слоты (identity, код) и метки поставленных в очередь колод
+DECODED_DECKS_SLOT_KEY = 'decoded_decks:slot'
+DECODED_DECKS_FLUSHED_KEY = 'decoded_decks:flushed'
+
+
+def _slot_key(slot: int) -> str:
+    return f'decoded_decks:slot:{slot}'
+
+
+def _queued_key(identity: str) -> str:
+    return f'decoded_decks:queued:{identity}'
+
+
+def record_decoded(deck: Deck) -> None:
+    """
+    Откладывает сохранение расшифрованной колоды, которой еще нет в БД (выборка - DECODED_DECKS_SAMPLE_RATE).
+    Очередь общая для процессов и не перезаписывается целиком: колода получает собственный слот (cache.incr),
+    повторная постановка той же колоды отсекается cache.add. Запись в БД - только save_decoded
+    (команда save_decoded_decks, запускается периодически), не в запросе пользователя
+    """
+    if deck.pk is not None or random.random() >= settings.DECODED_DECKS_SAMPLE_RATE:
+        return
+    # метка с ограниченным сроком: колода, слот которой не был прочитан, со временем снова попадает в выборку
+    if not cache.add(_queued_key(deck.identity), True, timeout=60 * 60 * 24):
+        return      # уже в очереди
+    cache.add(DECODED_DECKS_SLOT_KEY, 0, timeout=None)
+    try:
+        slot = cache.incr(DECODED_DECKS_SLOT_KEY)
+    except ValueError:      # счетчик вытеснен из кэша
+        cache.add(DECODED_DECKS_SLOT_KEY, 0, timeout=None)
+        slot = cache.incr(DECODED_DECKS_SLOT_KEY)
+    cache.set(_slot_key(slot), (deck.identity, deck.string), timeout=None)
+
+
+def save_decoded() -> int:
+    """
+    Сохраняет колоды из очереди транзакциями по DECODED_DECKS_BATCH_SIZE; возвращает число обработанных колод.
+    Рассчитано на один процесс записи (команда save_decoded_decks)
+    """
+    flushed = cache.get(DECODED_DECKS_FLUSHED_KEY, 0)
+    top = cache.get(DECODED_DECKS_SLOT_KEY, 0)
+    if top < flushed:       # счетчик слотов начат заново (напр., после очистки кэша)
+        flushed = 0
+    processed = 0
+    for start in range(flushed + 1, top + 1, settings.DECODED_DECKS_BATCH_SIZE):
+        keys = [_slot_key(slot) for slot in range(start, min(start + settings.DECODED_DECKS_BATCH_SIZE, top + 1))]
+        pending = list(cache.get_many(keys).values())
+        with transaction.atomic():
+            for identity, deckstring in pending:
+                try:
+                    Deck.create_from_deckstring(deckstring)
+                except (DecodeError, UnsupportedCards):
+                    continue    # карты удалены из каталога после расшифровки
+        cache.delete_many(keys + [_queued_key(identity) for identity, deckstring in pending])
+        processed += len(pending)
+    cache.set(DECODED_DECKS_FLUSHED_KEY, top, timeout=None)
+    return processed
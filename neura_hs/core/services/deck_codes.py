@@ -1,6 +1,6 @@
 import base64
-from io import BytesIO
-from typing import IO
+import hashlib
+from typing import Iterable, Optional, Union
 from django.utils.translation import gettext_lazy as _
 
 from core.exceptions import DecodeError
@@ -9,6 +9,8 @@ DECKSTRING_VERSION = 1
 
 CardList = list[int]
 CardIncludeList = list[tuple[int, int]]
+DeckData = tuple[CardIncludeList, CardList, int]
+Buffer = Union[bytes, bytearray, memoryview]
 
 
 def get_clean_deckstring(deckstring: str) -> str:
@@ -22,24 +24,74 @@ def get_clean_deckstring(deckstring: str) -> str:
     return deckstring.split('#')[-3].strip()
 
 
-def _read_varint(stream: IO) -> int:
-    shift = 0
-    result = 0
-    while True:
-        c = stream.read(1)      # считываем по 1 байту в строку (1 символ)
-        if c == "":
-            raise EOFError("Unexpected EOF")
-        i = ord(c)
-
+def _read_varints(data: Buffer) -> list[int]:
+    """ Считывает из буфера все varint за один проход (без потока и побайтовых вызовов read/ord) """
+    values = []
+    result = shift = 0
+    for i in data:                      # итерация по bytes/memoryview сразу дает int
         result |= (i & 0x7f) << shift   # 0x7f = 0b01111111
-        shift += 7
-        if not (i & 0x80):              # если 0 < i < 128
-            break
+        if i & 0x80:                    # старший бит: varint продолжается в следующем байте
+            shift += 7
+        else:
+            values.append(result)
+            result = shift = 0
+    if shift:
+        raise DecodeError(_('Invalid deck code'))   # оборванный varint
+    return values
 
-    return result
+
+def _write_varint(buffer: bytearray, value: int) -> None:
+    """ Дописывает value в буфер в формате varint """
+    while value > 0x7f:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
 
 
-def parse_deckstring(deckstring) -> tuple[CardIncludeList, CardList, int]:
+def _decode(data: Buffer) -> DeckData:
+    """ Разбор байтов кода колоды (без base64) """
+
+    # первый байт: должен быть \0
+    if not data or data[0] != 0:
+        raise DecodeError(_('Invalid deck code'))
+
+    values = _read_varints(memoryview(data)[1:])
+    try:
+        # второй байт: версия шифрования кодов колод
+        if values[0] != DECKSTRING_VERSION:
+            raise DecodeError(_('Unsupported deckstring version'))
+
+        # третий байт: формат (режим игры)
+        format_ = values[1]
+
+        # 4-й байт: число героев, упомянутых в декстринге
+        num_heroes = values[2]
+        pos = 3 + num_heroes
+        heroes: CardList = values[3:pos]
+
+        # карты в одном и в двух экземплярах
+        num_cards_x1 = values[pos]
+        cards: CardIncludeList = [(card_id, 1) for card_id in values[pos + 1:pos + 1 + num_cards_x1]]
+        pos += 1 + num_cards_x1
+        num_cards_x2 = values[pos]
+        cards += [(card_id, 2) for card_id in values[pos + 1:pos + 1 + num_cards_x2]]
+        pos += 1 + num_cards_x2
+
+        # карты в произвольном количестве экземпляров: пары (dbf_id, count)
+        num_cards_xn = values[pos]
+        xn = values[pos + 1:pos + 1 + 2 * num_cards_xn]
+        cards += zip(xn[::2], xn[1::2])
+        pos += 2 * num_cards_xn
+
+        if len(heroes) != num_heroes or pos >= len(values):
+            raise IndexError
+    except IndexError:
+        raise DecodeError(_('Invalid deck code'))
+
+    return cards, heroes, format_
+
+
+def parse_deckstring(deckstring) -> DeckData:
     """
     Расшифровка кода колоды
     :param deckstring: строка ASCII или байты
@@ -49,42 +101,74 @@ def parse_deckstring(deckstring) -> tuple[CardIncludeList, CardList, int]:
         decoded = base64.b64decode(deckstring)      # декстринг в байты
     except Exception as e:
         raise DecodeError(_('Invalid deck code'))
-    data = BytesIO(decoded)                     # байты в поток байтов в оперативной памяти
 
-    # первый байт: должен быть \0
-    if data.read(1) != b"\0":
-        raise DecodeError(_('Invalid deck code'))
+    return _decode(decoded)
 
-    # второй байт: версия шифрования кодов колод
-    version = _read_varint(data)
-    if version != DECKSTRING_VERSION:
-        raise DecodeError(_('Unsupported deckstring version'))
-
-    # третий байт: формат (режим игры)
-    format_ = _read_varint(data)
-
-    heroes: CardList = []
-    # 4-й байт: число героев, упомянутых в декстринге
-    num_heroes = _read_varint(data)
-    for i in range(num_heroes):
-        heroes.append(_read_varint(data))
-
-    cards: CardIncludeList = []
-    # кол-во карт в одном экземпляре
-    num_cards_x1 = _read_varint(data)
-    for i in range(num_cards_x1):
-        card_id = _read_varint(data)
-        cards.append((card_id, 1))
-
-    num_cards_x2 = _read_varint(data)
-    for i in range(num_cards_x2):
-        card_id = _read_varint(data)
-        cards.append((card_id, 2))
-
-    num_cards_xn = _read_varint(data)
-    for i in range(num_cards_xn):
-        card_id = _read_varint(data)
-        count = _read_varint(data)
-        cards.append((card_id, count))
 
-    return cards, heroes, format_
+def parse_many(deckstrings: Iterable[str], *, strict: bool = True) -> list[Optional[DeckData]]:
+    """
+    Пакетная расшифровка кодов колод (массовый импорт, пересборка колод)
+    :param deckstrings: коды колод
+    :param strict: True - DecodeError при первом невалидном коде; False - None на его месте
+    :return: результаты parse_deckstring в порядке следования кодов
+    """
+    decoded: dict[str, Optional[DeckData]] = {}     # одинаковые коды расшифровываются однократно
+    result = []
+    for deckstring in deckstrings:
+        if deckstring not in decoded:
+            try:
+                decoded[deckstring] = parse_deckstring(deckstring)
+            except DecodeError:
+                if strict:
+                    raise
+                decoded[deckstring] = None
+        result.append(decoded[deckstring])
+
+    return result
+
+
+def build_deckstring(cards: CardIncludeList, heroes: CardList, format_: int) -> str:
+    """
+    Шифрование колоды в код (каноническая форма: героев и карты внутри групп - по возрастанию dbf_id)
+    :param cards: список кортежей[dbf_id, count]
+    :param heroes: список[dbf_id]
+    :param format_: значение енума формата
+    :return: код колоды
+    """
+    x1, x2, xn = [], [], []
+    for dbf_id, count in sorted(cards):
+        if count == 1:
+            x1.append(dbf_id)
+        elif count == 2:
+            x2.append(dbf_id)
+        elif count > 2:
+            xn.append((dbf_id, count))
+
+    buffer = bytearray(b'\0')
+    _write_varint(buffer, DECKSTRING_VERSION)
+    _write_varint(buffer, format_)
+
+    _write_varint(buffer, len(heroes))
+    for hero in sorted(heroes):
+        _write_varint(buffer, hero)
+
+    for group in (x1, x2):
+        _write_varint(buffer, len(group))
+        for dbf_id in group:
+            _write_varint(buffer, dbf_id)
+
+    _write_varint(buffer, len(xn))
+    for dbf_id, count in xn:
+        _write_varint(buffer, dbf_id)
+        _write_varint(buffer, count)
+
+    return base64.b64encode(buffer).decode('ascii')
+
+
+def get_deck_identity(cards: CardIncludeList, heroes: CardList, format_: int) -> str:
+    """
+    Идентификатор состава колоды: хэш канонического кода (герой, формат, отсортированные пары dbf_id-count).
+    Не зависит от порядка карт в исходном коде
+    """
+    canonical = build_deckstring(cards, heroes, format_)
+    return hashlib.blake2b(canonical.encode('ascii'), digest_size=16).hexdigest()
@@ -1,22 +1,51 @@
-from django.db.models import Q, Count
+import os
+from collections import defaultdict, namedtuple
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction, IntegrityError
+from django.db.models import Sum, Case, When, Value, IntegerField, prefetch_related_objects
+from django.db.models.functions import Least
+from django.template.loader import render_to_string
+from django.utils.translation import get_language
 from rest_framework import serializers
 
-from decks.models import Deck, Format, Inclusion, Render
-from gallery.models import RealCard
-from .deck_codes import parse_deckstring
+from decks.models import (
+    Deck, Format, Inclusion, Render, SimilarityPosting, CardFrequency, SimilarDeck, SimilarDecksState, DailyDeckCount,
+)
+from gallery.models import RealCard, HearthstoneState
+from .deck_codes import parse_deckstring, parse_many, get_deck_identity
 from .images import DeckRender
+from .statistics import refresh_statistics
 
+SIMILARITY_THRESHOLD = 20     # минимальное число совпадающих карт у похожих колод
+NUM_SIMILAR_DECKS = 18        # число отображаемых похожих колод
 
-def get_render(deck_id: str, name: str, language: str) -> dict:
-    """ Возвращает словарь с данными рендера колоды """
-    deck = Deck.objects.get(pk=deck_id)
+
+RenderImage = namedtuple('RenderImage', ['filename', 'data', 'width', 'height'])
+
+
+def get_render_deck(deck_id: str) -> Deck:
+    """ Колода для рендера с составом в памяти: рисование рендера не обращается к БД """
+    deck = Deck.objects.select_related('deck_class', 'deck_format').get(pk=deck_id)
+    load_included_cards([deck])
+    return deck
+
+
+def draw_render(deck: Deck, name: str, language: str) -> RenderImage:
+    """ Рисует рендер колоды (CPU-задача без обращения к БД - может выполняться в пуле процессов) """
     dr = DeckRender(name=name, deck=deck, language=language)
     dr.create()
+    return RenderImage(os.path.basename(dr.path), dr.data.getvalue(), dr.width, dr.height)
+
+
+def save_render(deck: Deck, image: RenderImage, name: str, language: str) -> dict:
+    """ Сохраняет рендер колоды, удаляя самый старый при превышении лимита; возвращает словарь с данными рендера """
     render = Render()
     render.deck = deck
-    render.render.save(**dr.for_imagefield)
-    render.name = dr.name
+    render.render.save(image.filename, ContentFile(image.data))
+    render.name = name
     render.language = Render.Languages(language)
     render.save()
 
@@ -27,36 +56,201 @@ def get_render(deck_id: str, name: str, language: str) -> dict:
 
     return {
         'render': render.render.url,
-        'width': dr.width,
-        'height': dr.height,
+        'width': image.width,
+        'height': image.height,
     }
 
 
-def find_similar_decks(target_deck: Deck):
-    """ Возвращает колоды того же формата и класса с большим числом совпадений карт (>= 20) """
+def get_render(deck_id: str, name: str, language: str) -> dict:
+    """ Возвращает словарь с данными рендера колоды """
+    deck = get_render_deck(deck_id)
+    return save_render(deck, draw_render(deck, name, language), name, language)
+
+
+def load_included_cards(decks):
+    """
+    Загружает состав колод сразу: вхождения с картами и наборами - одним запросом, классы карт - еще одним.
+    Состав задается колодам (Deck.set_decoded_cards), поэтому included_cards и стоимость создания
+    не обращаются к БД (рендер колоды - get_render_deck). Страницы списков колод состав не загружают:
+    стоимость создания - load_craft_costs, карты - при раскрытии колоды (get_deck_cards_html)
+    """
+    if not decks:
+        return decks
+    pending = {deck.pk: deck for deck in decks if deck.pk is not None and not deck.is_decoded}
+    if not pending:
+        return decks
+
+    inclusions = list(Inclusion.objects.filter(deck_id__in=pending).select_related('card__card_set'))
+    prefetch_related_objects([inclusion.card for inclusion in inclusions], 'card_class')
+    cards = defaultdict(list)
+    for inclusion in inclusions:
+        card = inclusion.card       # отдельный экземпляр карты для каждого вхождения
+        card.number = inclusion.number
+        cards[inclusion.deck_id].append(card)
+    for pk, deck in pending.items():
+        deck.set_decoded_cards(cards[pk])
+    return decks
+
+
+def load_craft_costs(decks):
+    """
+    Загружает число карт по редкостям для всех колод списка одним запросом: стоимость создания
+    (в заголовке раскрывающегося списка) вычисляется без загрузки состава каждой колоды.
+    Экземпляры колод не копируются - список можно передать как QuerySet страницы
+    """
+    if not decks:
+        return decks
+    pending = {deck.pk: deck for deck in decks if deck.pk is not None and not deck.is_decoded}
+    counts = defaultdict(dict)
+    for deck_id, rarity, number in Inclusion.objects.filter(deck_id__in=pending).values_list(
+            'deck_id', 'card__rarity').annotate(num_cards=Sum('number')).order_by():
+        counts[deck_id][rarity] = number
+    for pk, deck in pending.items():
+        deck.set_rarity_counts(counts[pk])
+    return decks
+
+
+def get_deck_cards_html(deck_id: int) -> str:
+    """
+    Разметка строк карт колоды для раскрывающегося списка (загружается при раскрытии).
+    Состав колоды не меняется - разметка кэшируется для версии каталога и языка
+    """
+    version, last_updated = HearthstoneState.get_catalog_version()
+    key = f'deck_cards:{deck_id}:{get_language()}:{version}'
+    if (html := cache.get(key)) is None:
+        html = render_to_string('decks/tags/deck-cards.html', {'deck': Deck.objects.get(pk=deck_id)})
+        cache.set(key, html, timeout=settings.DECK_CARDS_CACHE_TIMEOUT)
+    return html
+
+
+def find_similar_decks(target_deck: Deck, limit: int = NUM_SIMILAR_DECKS) -> list[Deck]:
+    """
+    Возвращает колоды того же формата и класса с большим числом совпадений карт (>= 20),
+    по убыванию числа совпадений (num_matches - сумма min(кол-во в колоде, кол-во в целевой колоде) по общим картам)
+    """
 
     if not target_deck:
-        return
-
-    return Deck.nameless.filter(
-        deck_format=target_deck.deck_format,
-        deck_class=target_deck.deck_class,
-    ).exclude(
-        string=target_deck.string
-    ).annotate(
-        num_matches=2 * Count(
-            'cards',
-            filter=Q(inclusions__number=2) & Q(cards__in=target_deck.cards.filter(inclusions__number=2))
-        ) + Count(
-            'cards',
-            filter=Q(inclusions__number=2) & Q(cards__in=target_deck.cards.filter(inclusions__number=1))
-        ) + Count(
-            'cards',
-            filter=Q(inclusions__number=1) & Q(cards__in=target_deck.cards.all())
-        ),
+        return []
+
+    composition = target_deck.get_composition()
+    num_copies = sum(composition.values())
+    if num_copies < SIMILARITY_THRESHOLD:
+        return []
+    partition = {'deck_class': target_deck.deck_class_id, 'deck_format': target_deck.deck_format_id}
+
+    # Префиксная фильтрация: у колоды с >= 20 совпадениями из num_copies карт целевой колоды
+    # не совпадает не более num_copies - 20 экземпляров. Значит, она обязательно содержит
+    # хотя бы одну карту из любого набора, покрывающего num_copies - 19 экземпляров, -
+    # достаточно просмотреть колоды с самыми редкими картами целевой колоды
+    frequencies = dict(CardFrequency.objects.filter(card__in=composition, **partition).values_list(
+        'card_id', 'num_decks',
+    ))
+    prefix, covered = [], 0
+    for card_id in sorted(composition, key=lambda c: frequencies.get(c, 0)):
+        if covered > num_copies - SIMILARITY_THRESHOLD:
+            break
+        prefix.append(card_id)
+        covered += composition[card_id]
+
+    candidates = SimilarityPosting.objects.filter(card__in=prefix, **partition)
+    if target_deck.pk is not None:
+        candidates = candidates.exclude(deck=target_deck)
+    candidates = candidates.values('deck_id')
+
+    # точный подсчет совпадений для кандидатов: сумма min(кол-во в колоде, кол-во в целевой колоде)
+    by_number = defaultdict(list)
+    for card_id, number in composition.items():
+        by_number[number].append(card_id)
+    num_matches = Sum(Case(
+        *[When(card__in=card_ids, then=Least('number', Value(number))) for number, card_ids in by_number.items()],
+        output_field=IntegerField(),
+    ))
+    ranking = SimilarityPosting.objects.filter(
+        deck__in=candidates, card__in=composition,
+    ).values('deck_id').annotate(
+        num_matches=num_matches,
     ).filter(
-        num_matches__gt=19
-    ).order_by('-num_matches')
+        num_matches__gte=SIMILARITY_THRESHOLD,
+    ).order_by('-num_matches', '-deck_id').values_list('deck_id', 'num_matches')[:limit + 1]
+    ranking = list(ranking)
+
+    decks = Deck.nameless.in_bulk([deck_id for deck_id, num in ranking])
+    similar = []
+    for deck_id, num in ranking:
+        deck = decks.get(deck_id)
+        if deck is None or deck.identity == target_deck.identity:   # та же колода (напр., для именованной копии)
+            continue
+        deck.num_matches = num
+        similar.append(deck)
+
+    return similar[:limit]
+
+
+def get_similar_decks(target_deck: Deck, limit: int = NUM_SIMILAR_DECKS) -> list[Deck]:
+    """
+    Похожие колоды из предрасчитанных соседей (compute_similar_decks);
+    для колод, добавленных после последнего расчета, и именованных колод - поиск по индексу
+    """
+
+    if not target_deck:
+        return []
+
+    if (target_deck.pk is None or target_deck.name or target_deck.author_id is not None
+            or not SimilarDecksState.is_processed(target_deck)):
+        return find_similar_decks(target_deck, limit)
+
+    neighbours = SimilarDeck.objects.filter(deck=target_deck).select_related(
+        'similar__deck_class', 'similar__deck_format',
+    )[:limit]
+    similar = []
+    for neighbour in neighbours:
+        neighbour.similar.num_matches = neighbour.num_matches
+        similar.append(neighbour.similar)
+
+    return similar
+
+
+def backfill_deck_identity(recalculate: bool = False) -> dict:
+    """
+    Вычисляет идентификаторы колод и объединяет дубликаты безымянных колод:
+    остается самая старая колода, рендеры дубликатов переносятся на нее
+    :param recalculate: пересчитать идентификаторы всех колод (иначе - только незаполненные)
+    """
+    decks = Deck.objects.all() if recalculate else Deck.objects.filter(identity=None)
+    decks = list(decks.order_by('created', 'pk').only('id', 'string', 'name', 'author', 'identity', 'created'))
+    decoded = parse_many((deck.string for deck in decks), strict=False)
+
+    # identity -> pk сохраняемой безымянной колоды
+    keepers: dict[str, int] = {}
+    if not recalculate:
+        keepers = dict(Deck.objects.filter(name='', author=None).exclude(identity=None).values_list('identity', 'pk'))
+
+    to_update, duplicates, invalid = [], {}, []
+    for deck, data in zip(decks, decoded):
+        if data is None:
+            invalid.append(deck.pk)
+            continue
+        deck.identity = get_deck_identity(*data)
+        if not deck.name and deck.author_id is None:
+            if deck.identity in keepers:
+                duplicates[deck.pk] = keepers[deck.identity]
+                continue
+            keepers[deck.identity] = deck.pk
+        to_update.append(deck)
+
+    for duplicate_pk, keeper_pk in duplicates.items():
+        Render.objects.filter(deck_id=duplicate_pk).update(deck_id=keeper_pk)
+    Deck.objects.filter(pk__in=duplicates).delete()
+
+    if recalculate:
+        Deck.objects.update(identity=None)  # во избежание временных нарушений уникальности при пересчете
+    Deck.objects.bulk_update(to_update, ['identity'], batch_size=500)
+    if duplicates:
+        SimilarityPosting.objects.rebuild()
+        DailyDeckCount.objects.rebuild()
+        refresh_statistics()
+
+    return {'updated': len(to_update), 'merged': len(duplicates), 'invalid': invalid}
 
 
 class DumpDeckListSerializer(serializers.ModelSerializer):
@@ -78,12 +272,24 @@ class DumpDeckListSerializer(serializers.ModelSerializer):
         deck.created = created
 
         cards, heroes, format_ = parse_deckstring(deck.string)
+        deck.identity = get_deck_identity(cards, heroes, format_)
+        if not deck.name and author is None and Deck.find_nameless(deck.identity):
+            return
         deck.deck_class = RealCard.objects.get(dbf_id=heroes[0]).card_class.all().first()
         deck.deck_format = Format.objects.get(numerical_designation=format_)
-        deck.save()
+        try:
+            with transaction.atomic():
+                deck.save()
+                composition = {}
+                for dbf_id, number in cards:
+                    card = RealCard.includibles.get(dbf_id=dbf_id)
+                    ci = Inclusion(deck=deck, card=card, number=number)
+                    ci.save()
+                    composition[card.pk] = number
 
-        for dbf_id, number in cards:
-            card = RealCard.includibles.get(dbf_id=dbf_id)
-            ci = Inclusion(deck=deck, card=card, number=number)
-            ci.save()
-            deck.cards.add(card)
+                if not deck.name and author is None:
+                    deck.register_nameless(composition)
+        except IntegrityError:
+            # колоду того же состава параллельно записал другой процесс
+            if deck.name or author is not None or not Deck.find_nameless(deck.identity):
+                raise
@@ -163,7 +163,7 @@ class DeckRender(Picture):
     def __pre_format_render(self):
         """ Устанавливает разрешение и координаты плейсхолдеров в зависимости от кол-ва карт """
         cards = self.deck.included_cards
-        amount = cards.count()
+        amount = len(cards)
         vertical_num = 3
         horizontal_num = (amount + vertical_num - 1) // vertical_num    # деление с округлением вверх
         if horizontal_num < 6:
@@ -0,0 +1,166 @@
+"""
+Постраничный вывод больших списков без COUNT(*) и OFFSET на каждый запрос.
+Число записей кэшируется для комбинации фильтров (SQL запроса), версии каталога и состояния таблицы
+(последний pk - меняется при добавлении записей, метка в кэше - при удалении);
+страница выбирается по ключу сортировки (seek) от соседней страницы, ссылки на которую несут курсор -
+ключ ее крайней записи. Без курсора (переход по номеру) страница отсчитывается от ближайшего края списка,
+а в середине списка - от ключа ближайшей опорной страницы (каждой anchor_pages-й; ключи кэшируются
+так же, как число записей). Стоимость любой страницы - не более anchor_pages страниц по индексу
+"""
+
+import base64
+import hashlib
+import json
+import time
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, Page
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+from gallery.models import HearthstoneState
+
+LIST_VERSION_KEY = 'list_version'
+
+
+def bump_list_version() -> None:
+    """ Отмечает удаление записей списков: число записей пересчитывается """
+    transaction.on_commit(lambda: cache.set(LIST_VERSION_KEY, time.time_ns(), timeout=None))
+
+
+class KeysetPage(Page):
+    """ Страница с ключами первой и последней записи (для курсоров ссылок на соседние страницы) """
+
+    def __init__(self, object_list, number, paginator):
+        super().__init__(list(object_list), number, paginator)
+        self.first_key = paginator.get_key(self.object_list[0]) if self.object_list else None
+        self.last_key = paginator.get_key(self.object_list[-1]) if self.object_list else None
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator для QuerySet с сортировкой по полям модели (Meta.ordering или order_by), дополненной pk.
+    Стоимость страницы не зависит от ее номера: от страницы курсора - по ключу, без курсора - смещение
+    от ближайшего края списка (последние страницы - обратной сортировкой) или от ключа опорной страницы
+    """
+
+    anchor_pages = 10   # шаг опорных страниц: наибольшее смещение по индексу - anchor_pages страниц
+
+    def __init__(self, object_list: QuerySet, per_page, orphans=0, allow_empty_first_page=True,
+                 *, cursor: Optional[str] = None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        ordering = list(object_list.query.order_by or object_list.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', 'id') for field in ordering):
+            ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+        self.ordering = ordering
+        self.fields = [field.lstrip('-') for field in ordering]
+        self.cursor = self.decode_cursor(cursor)
+
+    @cached_property
+    def _state_key(self) -> Optional[str]:
+        """ Ключ кэша для SQL запроса и состояния таблицы (последний pk - по индексу); None - пустой запрос """
+        try:
+            sql = str(self.object_list.query)
+        except EmptyResultSet:
+            return None
+        catalog_version, last_updated = HearthstoneState.get_catalog_version()
+        last_pk = self.object_list.model._base_manager.order_by('-pk').values_list('pk', flat=True).first()
+        digest = hashlib.md5(sql.encode()).hexdigest()
+        return f'{digest}:{catalog_version}:{last_pk}:{cache.get(LIST_VERSION_KEY)}'
+
+    @cached_property
+    def count(self) -> int:
+        """ Число записей из кэша """
+        if self._state_key is None:
+            return 0
+        key = f'list_count:{self._state_key}'
+        if (count := cache.get(key)) is None:
+            count = self.object_list.count()
+            cache.set(key, count, timeout=settings.LIST_COUNT_CACHE_TIMEOUT)
+        return count
+
+    @cached_property
+    def anchors(self) -> list[list]:
+        """ Ключи последних записей каждой anchor_pages-й страницы (один проход по ключам сортировки) """
+        if self._state_key is None:
+            return []
+        key = f'list_anchors:{self.per_page}:{self.anchor_pages}:{self._state_key}'
+        if (anchors := cache.get(key)) is None:
+            step = self.anchor_pages * self.per_page
+            rows = self.object_list.order_by(*self.ordering).values_list(*self.fields).iterator()
+            anchors = [list(row) for i, row in enumerate(rows, 1) if i % step == 0]
+            cache.set(key, anchors, timeout=settings.LIST_COUNT_CACHE_TIMEOUT)
+        return anchors
+
+    def get_key(self, obj) -> list:
+        return [obj.pk if field in ('pk', 'id') else getattr(obj, field) for field in self.fields]
+
+    def encode_cursor(self, page: KeysetPage, number: int) -> Optional[str]:
+        """ Курсор для ссылки со страницы page на страницу number: номер страницы и ключ ее крайней записи """
+        key = page.last_key if number > page.number else page.first_key
+        if key is None or number == page.number or abs(number - page.number) > self.anchor_pages:
+            return None
+        data = json.dumps([page.number, key], default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor: Optional[str]) -> Optional[tuple[int, list]]:
+        """ (номер страницы, ключ) из курсора; некорректный курсор не учитывается """
+        if not cursor:
+            return None
+        try:
+            number, key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            model = self.object_list.model
+            key = [model._meta.pk.to_python(value) if field in ('pk', 'id')
+                   else model._meta.get_field(field).to_python(value) for field, value in zip(self.fields, key)]
+            return int(number), key
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def _seek(self, key: list, forward: bool) -> Q:
+        """ Условие "запись после (forward) / до ключа" в порядке сортировки """
+        condition = Q()
+        for i, (field, ordering) in enumerate(zip(self.fields, self.ordering)):
+            descending = ordering.startswith('-') == forward
+            step = Q(**{f'{field}__{"lt" if descending else "gt"}': key[i]})
+            for previous, value in zip(self.fields[:i], key[:i]):
+                step &= Q(**{previous: value})
+            condition |= step
+        # нестрогое условие по первому полю - диапазон по индексу
+        descending = self.ordering[0].startswith('-') == forward
+        return Q(**{f'{self.fields[0]}__{"lte" if descending else "gte"}': key[0]}) & condition
+
+    @property
+    def _reversed_ordering(self) -> list[str]:
+        return [field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering]
+
+    def page(self, number) -> KeysetPage:
+        number = self.validate_number(number)
+        queryset = self.object_list
+        if self.cursor and self.cursor[0] != number and abs(number - self.cursor[0]) <= self.anchor_pages:
+            anchor, key = self.cursor
+            forward = number > anchor
+            skip = (abs(number - anchor) - 1) * self.per_page
+            queryset = queryset.filter(self._seek(key, forward))
+            if forward:
+                return KeysetPage(queryset.order_by(*self.ordering)[skip:skip + self.per_page], number, self)
+            items = list(queryset.order_by(*self._reversed_ordering)[skip:skip + self.per_page])
+            return KeysetPage(reversed(items), number, self)
+
+        bottom = (number - 1) * self.per_page
+        top = min(bottom + self.per_page, self.count)
+        window = self.anchor_pages * self.per_page
+        if self.count - top < min(bottom, window):
+            # последние страницы - смещением от конца
+            items = list(queryset.order_by(*self._reversed_ordering)[self.count - top:self.count - bottom])
+            return KeysetPage(reversed(items), number, self)
+        anchor = (number - 1) // self.anchor_pages
+        if anchor == 0 or anchor > len(self.anchors):
+            return KeysetPage(queryset.order_by(*self.ordering)[bottom:bottom + self.per_page], number, self)
+        # середина списка - от ключа последней записи опорной страницы
+        skip = bottom - anchor * window
+        queryset = queryset.filter(self._seek(self.anchors[anchor - 1], True)).order_by(*self.ordering)
+        return KeysetPage(queryset[skip:skip + self.per_page], number, self)
@@ -0,0 +1,138 @@
+"""
+Справочные данные (классы, расы, наборы, механики, форматы) в памяти процесса и отрисованные
+списки выбора форм поиска. Версия справочника - версия каталога (меняется при update_db)
+и метка в кэше, которая обновляется при изменении справочных записей (напр., через админ-панель)
+"""
+
+import threading
+import time
+from typing import Optional
+
+from django import forms
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
+
+from gallery.models import CardClass, Tribe, CardSet, Mechanic, HearthstoneState
+from decks.models import Format
+
+REFERENCE_VERSION_KEY = 'reference_version'
+VERSION_CHECK_INTERVAL = 1.0
+EMPTY_LABEL = '---------'
+
+
+class ReferenceData:
+    """ Все записи справочных таблиц (в порядке Meta.ordering моделей) """
+
+    def __init__(self, version: tuple):
+        self.version = version
+        self.card_classes = list(CardClass.objects.all())
+        self.tribes = list(Tribe.objects.all())
+        self.card_sets = list(CardSet.objects.all())
+        self.mechanics = list(Mechanic.objects.all())
+        self.formats = list(Format.objects.all())
+        self._by_pk = {objects[0].__class__: {obj.pk: obj for obj in objects}
+                       for objects in (self.card_classes, self.tribes, self.card_sets, self.mechanics, self.formats)
+                       if objects}
+        self.widgets: dict[tuple, str] = {}
+
+    def in_bulk(self, model) -> dict:
+        """ pk -> запись справочной модели (как QuerySet.in_bulk) """
+        return self._by_pk.get(model, {})
+
+    @staticmethod
+    def _by_service_name(objects: list, service_name: str):
+        return next((obj for obj in objects if obj.service_name == service_name), None)
+
+    def card_class(self, service_name: str) -> Optional[CardClass]:
+        return self._by_service_name(self.card_classes, service_name)
+
+    def tribe(self, service_name: str) -> Optional[Tribe]:
+        return self._by_service_name(self.tribes, service_name)
+
+    def card_set(self, service_name: str) -> Optional[CardSet]:
+        return self._by_service_name(self.card_sets, service_name)
+
+    def format(self, numerical_designation: int) -> Optional[Format]:
+        return next((f for f in self.formats if f.numerical_designation == numerical_designation), None)
+
+    def choices(self, reference: str) -> list[tuple]:
+        """ Варианты выбора (pk, название на текущем языке) для списка из CHOICES """
+        return [(obj.pk, str(obj)) for obj in CHOICES[reference](self)]
+
+
+# списки выбора форм поиска
+CHOICES = {
+    'card_classes': lambda data: data.card_classes,
+    'collectible_classes': lambda data: [c for c in data.card_classes if c.collectible],
+    'tribes': lambda data: data.tribes,
+    'card_sets': lambda data: data.card_sets,
+    'mechanics': lambda data: [m for m in data.mechanics if not m.hidden],
+    'formats': lambda data: [f for f in data.formats if f.numerical_designation != 0],
+}
+
+_data: Optional[ReferenceData] = None
+_checked = 0.0
+_lock = threading.Lock()
+
+
+def get_reference_data() -> ReferenceData:
+    """
+    Справочник текущей версии (загружается при первом обращении в процессе и после изменений).
+    Версия в кэше проверяется не чаще раза в VERSION_CHECK_INTERVAL с - справочник запрашивается
+    несколько раз за запрос (каждым списком выбора)
+    """
+    global _data, _checked
+    data = _data
+    if data is not None and time.monotonic() - _checked < VERSION_CHECK_INTERVAL:
+        return data
+    catalog_version, last_updated = HearthstoneState.get_catalog_version()
+    version = (catalog_version, cache.get(REFERENCE_VERSION_KEY))
+    if data is None or data.version != version:
+        with _lock:
+            if _data is None or _data.version != version:
+                _data = ReferenceData(version)
+            data = _data
+    _checked = time.monotonic()
+    return data
+
+
+def bump_reference_version() -> None:
+    """ Отмечает изменение справочных записей: справочник перезагрузится во всех процессах """
+    global _data
+    _data = None
+    transaction.on_commit(lambda: cache.set(REFERENCE_VERSION_KEY, time.time_ns(), timeout=None))
+
+
+class ReferenceSelect(forms.Select):
+    """
+    Список выбора из справочника: разметка списка отрисовывается один раз для версии справочника и языка,
+    при отрисовке отмечается лишь выбранный вариант
+    """
+
+    def __init__(self, reference: str, attrs=None):
+        super().__init__(attrs)
+        self.reference = reference
+
+    def render(self, name, value, attrs=None, renderer=None):
+        data = get_reference_data()
+        key = (self.reference, name, get_language(), tuple(sorted((attrs or {}).items())))
+        if (html := data.widgets.get(key)) is None:
+            self.choices = [('', EMPTY_LABEL)] + data.choices(self.reference)
+            html = data.widgets[key] = super().render(name, None, attrs, renderer)
+        if value not in (None, ''):
+            option = f'<option value="{escape(value)}"'
+            if option + '>' in html:
+                html = html.replace('<option value="" selected>', '<option value="">', 1)
+                html = html.replace(option + '>', option + ' selected>', 1)
+        return mark_safe(html)
+
+
+class ReferenceChoiceField(forms.ChoiceField):
+    """ Поле выбора записи справочника (значение - pk) """
+
+    def __init__(self, reference: str, **kwargs):
+        super().__init__(choices=lambda: [('', EMPTY_LABEL)] + get_reference_data().choices(reference),
+                         widget=ReferenceSelect(reference), **kwargs)
@@ -0,0 +1,121 @@
+""" Пакетный предрасчет похожих колод по разреженной матрице колода x карта """
+
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import Max
+
+from decks.models import Deck, Inclusion, SimilarDeck, SimilarDecksState
+from .deck_utils import SIMILARITY_THRESHOLD, NUM_SIMILAR_DECKS
+
+BATCH_SIZE = 256    # строк матрицы на одно умножение (память: BATCH_SIZE x число колод раздела)
+
+
+def compute_similar_decks(full: bool = False, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Рассчитывает и сохраняет соседей безымянных колод (не более NUM_SIMILAR_DECKS с >= 20 совпадениями).
+    По умолчанию обрабатываются только колоды, добавленные после предыдущего запуска;
+    их появление обновляет и списки соседей ранее обработанных колод
+    :param full: пересчитать соседей всех колод
+    :return: число обработанных разделов (класс, формат) и новых колод
+    """
+    state = SimilarDecksState.load()
+    watermark = 0 if full else state.last_deck_id
+    nameless = Deck.objects.filter(name='', author=None)
+    last_deck_id = nameless.aggregate(last=Max('pk'))['last'] or 0     # колоды, созданные во время расчета, - в след. раз
+
+    new_decks = nameless.filter(pk__gt=watermark, pk__lte=last_deck_id)
+    partitions = list(new_decks.order_by().values_list('deck_class_id', 'deck_format_id').distinct())
+    if full:
+        SimilarDeck.objects.all().delete()
+    for class_id, format_id in partitions:
+        with transaction.atomic():
+            _process_partition(class_id, format_id, watermark, last_deck_id, batch_size)
+
+    state.last_deck_id = last_deck_id
+    state.save()
+    return {'partitions': len(partitions), 'decks': new_decks.count()}
+
+
+def _load_matrix(class_id: int, format_id: int, last_deck_id: int):
+    """
+    Матрица колода x (карта, уровень) для раздела: элемент [d, (c, k)] = 1, если карта c входит в колоду d
+    в количестве >= k. Тогда (M @ M.T)[a, b] = сумма по общим картам min(кол-во в a, кол-во в b) = num_matches
+    :return: csr-матрица; pk колод, соответствующие строкам (по возрастанию)
+    """
+    rows = Inclusion.objects.filter(
+        deck__name='', deck__author=None, deck__deck_class_id=class_id, deck__deck_format_id=format_id,
+        deck_id__lte=last_deck_id,
+    ).values_list('deck_id', 'card_id', 'number')
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+
+    deck_ids, deck_index = np.unique(data[:, 0], return_inverse=True)
+    card_ids, card_index = np.unique(data[:, 1], return_inverse=True)
+    numbers = data[:, 2]
+    shape = (len(deck_ids), len(card_ids))
+    levels = [
+        sparse.csr_matrix(((numbers >= level).astype(np.float32), (deck_index, card_index)), shape=shape)
+        for level in range(1, int(numbers.max(initial=1)) + 1)
+    ]
+    matrix = sparse.hstack(levels, format='csr')
+    matrix.eliminate_zeros()
+    return matrix, deck_ids
+
+
+def _top(scores: np.ndarray, deck_ids: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Лучшие соседи по строке совпадений: [(num_matches, pk колоды)] по убыванию, как в find_similar_decks
+    (при равенстве совпадений - более новые колоды)
+    """
+    candidates = np.flatnonzero(scores >= SIMILARITY_THRESHOLD)
+    if len(candidates) > NUM_SIMILAR_DECKS:
+        # все кандидаты с числом совпадений на границе отбора - порядок среди них задает pk
+        cutoff = np.partition(scores[candidates], -NUM_SIMILAR_DECKS)[-NUM_SIMILAR_DECKS]
+        candidates = candidates[scores[candidates] >= cutoff]
+    top = [(int(scores[j]), int(deck_ids[j])) for j in candidates]
+    return sorted(top, reverse=True)[:NUM_SIMILAR_DECKS]
+
+
+def _process_partition(class_id: int, format_id: int, watermark: int, last_deck_id: int, batch_size: int):
+    """ Расчет соседей новых колод раздела и обновление соседей старых колод """
+    matrix, deck_ids = _load_matrix(class_id, format_id, last_deck_id)
+    transposed = matrix.T.tocsr()
+    new_rows = np.flatnonzero(deck_ids > watermark)
+    old_columns = np.flatnonzero(deck_ids <= watermark)
+
+    neighbours: dict[int, list[tuple[int, int]]] = {}
+    old_updates = defaultdict(list)         # старая колода -> новые кандидаты в соседи
+    for start in range(0, len(new_rows), batch_size):
+        batch = new_rows[start:start + batch_size]
+        overlap = (matrix[batch] @ transposed).toarray()
+        overlap[np.arange(len(batch)), batch] = 0   # колода не похожа сама на себя
+
+        for i, row in enumerate(batch):
+            neighbours[int(deck_ids[row])] = _top(overlap[i], deck_ids)
+
+        if len(old_columns):
+            old_overlap = overlap[:, old_columns]
+            for i, j in zip(*np.nonzero(old_overlap >= SIMILARITY_THRESHOLD)):
+                old_updates[int(deck_ids[old_columns[j]])].append(
+                    (int(old_overlap[i, j]), int(deck_ids[batch[i]]))
+                )
+
+    # новые соседи старых колод сливаются с сохраненными; перезаписываются лишь изменившиеся списки
+    stored = defaultdict(list)
+    for deck_id, num_matches, similar_id in SimilarDeck.objects.filter(deck__in=list(old_updates)).values_list(
+            'deck_id', 'num_matches', 'similar_id'):
+        stored[deck_id].append((num_matches, similar_id))
+    for deck_id, candidates in old_updates.items():
+        current = sorted(stored[deck_id], reverse=True)
+        top = sorted(set(candidates + current), reverse=True)[:NUM_SIMILAR_DECKS]
+        if top != current:
+            neighbours[deck_id] = top
+
+    SimilarDeck.objects.filter(deck__in=list(neighbours)).delete()
+    SimilarDeck.objects.bulk_create([
+        SimilarDeck(deck_id=deck_id, similar_id=similar_id, num_matches=num_matches)
+        for deck_id, top in neighbours.items()
+        for num_matches, similar_id in top
+    ], batch_size=1000)
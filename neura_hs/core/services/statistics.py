@@ -1,20 +1,63 @@
 from collections import namedtuple
+from datetime import timedelta
 
+from django.conf import settings
+from django.core.cache import cache
 from django.db.models import Count, Q
-from django.utils.translation import gettext_lazy as _
+from django.utils.timezone import localtime
+from django.utils.translation import gettext_lazy as _, get_language
 from django.urls import reverse_lazy
 
 from gallery.models import RealCard, Mechanic
-from decks.models import Deck, Format
+from decks.models import Deck, Inclusion, StatisticsSnapshot
+from .trends import get_trends, TREND_PERIODS
+from .reference import get_reference_data
 
 StatSection = namedtuple('StatSection', ['header', 'cells'])
 StatCell = namedtuple('StatCell', ['header', 'items_'])
 StatItem = namedtuple('StatItem', ['label', 'value', 'link', 'css'])
 
 
-def get_card_num_stat() -> StatCell:
-    num_cards_all = RealCard.objects.count()
-    num_collectibles = RealCard.objects.search_collectible(True).count()
+def refresh_statistics() -> StatisticsSnapshot:
+    """ Пересчитывает снимок статистики условной агрегацией (по запросу на группу показателей) """
+    collectible = Q(collectible=True)
+    cards = RealCard.objects.aggregate(
+        num_cards=Count('pk'),
+        num_collectible=Count('pk', filter=collectible),
+        num_legendary=Count('pk', filter=collectible & Q(rarity=RealCard.Rarities.LEGENDARY)),
+        num_epic=Count('pk', filter=collectible & Q(rarity=RealCard.Rarities.EPIC)),
+        num_rare=Count('pk', filter=collectible & Q(rarity=RealCard.Rarities.RARE)),
+        num_common=Count('pk', filter=collectible & Q(rarity=RealCard.Rarities.COMMON)),
+    )
+    mechanics = Mechanic.objects.annotate(
+        num_cards=Count('realcard', filter=Q(realcard__collectible=True)),
+    ).order_by('-num_cards').values_list('pk', 'num_cards')[:5]
+
+    nameless = Deck.nameless.all()
+    decks = nameless.aggregate(
+        num_decks=Count('pk'),
+        **{field: Count('pk', filter=Q(deck_format__numerical_designation=designation))
+           for designation, field in StatisticsSnapshot.FORMAT_FIELDS.items()},
+    )
+    num_highlander = Inclusion.objects.filter(deck__in=nameless).values('deck').annotate(
+        num_unique_cards=Count('pk'),
+    ).filter(num_unique_cards=30).count()
+
+    snapshot = StatisticsSnapshot(
+        popular_mechanics=[list(item) for item in mechanics],
+        num_highlander=num_highlander,
+        popular_cards=StatisticsSnapshot.objects.popular_cards(),
+        **cards,
+        **decks,
+    )
+    snapshot.save()
+    StatisticsSnapshot.objects.invalidate_cache()
+    return snapshot
+
+
+def get_card_num_stat(snapshot: StatisticsSnapshot) -> StatCell:
+    num_cards_all = snapshot.num_cards
+    num_collectibles = snapshot.num_collectible
 
     return StatCell(
         header=_('Amount'),
@@ -35,12 +78,11 @@ def get_card_num_stat() -> StatCell:
     )
 
 
-def get_card_rar_stat() -> StatCell:
-    collectibles = RealCard.objects.search_collectible(True)
-    num_leg = collectibles.search_by_rarity(RealCard.Rarities.LEGENDARY).count()
-    num_epic = collectibles.search_by_rarity(RealCard.Rarities.EPIC).count()
-    num_rare = collectibles.search_by_rarity(RealCard.Rarities.RARE).count()
-    num_common = collectibles.search_by_rarity(RealCard.Rarities.COMMON).count()
+def get_card_rar_stat(snapshot: StatisticsSnapshot) -> StatCell:
+    num_leg = snapshot.num_legendary
+    num_epic = snapshot.num_epic
+    num_rare = snapshot.num_rare
+    num_common = snapshot.num_common
 
     return StatCell(
         header=_('Rarities'),
@@ -73,14 +115,16 @@ def get_card_rar_stat() -> StatCell:
     )
 
 
-def get_most_popular_mechanics_stat(top: int) -> StatCell:
-    mechanics = Mechanic.objects.annotate(num_cards=Count('realcard', filter=Q(realcard__collectible=True)))
-    most_popular = mechanics.order_by('-num_cards')[:top]
+def get_most_popular_mechanics_stat(snapshot: StatisticsSnapshot, top: int) -> StatCell:
+    most_popular = snapshot.popular_mechanics[:top]
+    mechanics = get_reference_data().in_bulk(Mechanic)
     items = []
-    for mech in most_popular:
+    for pk, num_cards in most_popular:
+        if (mech := mechanics.get(pk)) is None:
+            continue
         item = StatItem(
             label=mech.name,
-            value=mech.num_cards,
+            value=num_cards,
             link=f"{reverse_lazy('gallery:realcards')}?collectible=true&mechanic={mech.pk}",
             css=''
         )
@@ -91,15 +135,17 @@ def get_most_popular_mechanics_stat(top: int) -> StatCell:
     )
 
 
-def get_most_popular_cards_stat(top: int) -> StatCell:
+def get_most_popular_cards_stat(snapshot: StatisticsSnapshot, top: int) -> StatCell:
     """ Самые популярные карты в колодах БД сайта """
-    cards = RealCard.includibles.annotate(num_decks=Count('deck', filter=Q(deck__name='', deck__author=None)))
-    most_popular = cards.order_by('-num_decks')[:top]
+    most_popular = snapshot.popular_cards[:top]
+    cards = RealCard.objects.in_bulk([pk for pk, num_decks in most_popular])
     items = []
-    for card in most_popular:
+    for pk, num_decks in most_popular:
+        if (card := cards.get(pk)) is None:
+            continue
         item = StatItem(
             label=card.name,
-            value=card.num_decks,
+            value=num_decks,
             link=card.get_absolute_url(),
             css=''
         )
@@ -110,10 +156,9 @@ def get_most_popular_cards_stat(top: int) -> StatCell:
     )
 
 
-def get_deck_num_stat() -> StatCell:
-    decks = Deck.nameless.annotate(num_unique_cards=Count('cards'))
-    num_all = decks.count()
-    num_highlander = decks.filter(num_unique_cards=30).count()
+def get_deck_num_stat(snapshot: StatisticsSnapshot) -> StatCell:
+    num_all = snapshot.num_decks
+    num_highlander = snapshot.num_highlander
     return StatCell(
         header=_('Amount'),
         items_=(
@@ -133,64 +178,115 @@ def get_deck_num_stat() -> StatCell:
     )
 
 
-def get_deck_format_stat() -> StatCell:
-    decks = Deck.nameless.all()
-    standard = Format.objects.get(numerical_designation=2)
-    wild = Format.objects.get(numerical_designation=1)
-    classic = Format.objects.get(numerical_designation=3)
-    num_standard = decks.filter(deck_format=standard).count()
-    num_wild = decks.filter(deck_format=wild).count()
-    num_classic = decks.filter(deck_format=classic).count()
+def get_deck_format_stat(snapshot: StatisticsSnapshot) -> StatCell:
+    reference = get_reference_data()
+    standard, wild, classic = (getattr(reference.format(designation), 'pk', '') for designation in (2, 1, 3))
+    num_standard = snapshot.num_standard
+    num_wild = snapshot.num_wild
+    num_classic = snapshot.num_classic
     return StatCell(
         header=_('Formats'),
         items_=(
             StatItem(
                 label=_('Standard'),
                 value=num_standard,
-                link=f"{reverse_lazy('decks:all_decks')}?deck_format={standard.pk}",
+                link=f"{reverse_lazy('decks:all_decks')}?deck_format={standard}",
                 css=''
             ),
             StatItem(
                 label=_('Wild'),
                 value=num_wild,
-                link=f"{reverse_lazy('decks:all_decks')}?deck_format={wild.pk}",
+                link=f"{reverse_lazy('decks:all_decks')}?deck_format={wild}",
                 css=''
             ),
             StatItem(
                 label=_('Classic'),
                 value=num_classic,
-                link=f"{reverse_lazy('decks:all_decks')}?deck_format={classic.pk}",
+                link=f"{reverse_lazy('decks:all_decks')}?deck_format={classic}",
                 css=''
             ),
         )
     )
 
 
-def get_cards_statistics() -> StatSection:
+def get_cards_statistics(snapshot: StatisticsSnapshot) -> StatSection:
     return StatSection(
         header=_('Cards'),
         cells=(
-            get_card_num_stat(),
-            get_card_rar_stat(),
-            get_most_popular_mechanics_stat(top=5),
+            get_card_num_stat(snapshot),
+            get_card_rar_stat(snapshot),
+            get_most_popular_mechanics_stat(snapshot, top=5),
         )
     )
 
 
-def get_decks_statistics() -> StatSection:
+def get_decks_statistics(snapshot: StatisticsSnapshot) -> StatSection:
     return StatSection(
         header=_('Decks'),
         cells=(
-            get_deck_num_stat(),
-            get_deck_format_stat(),
-            get_most_popular_cards_stat(top=5),
+            get_deck_num_stat(snapshot),
+            get_deck_format_stat(snapshot),
+            get_most_popular_cards_stat(snapshot, top=5),
         )
     )
 
 
+def get_trend_stat(days: int) -> tuple[StatCell, StatCell]:
+    """ Самые популярные классы и карты безымянных колод за последние days дней """
+    trends = get_trends(days, top=5)
+    classes = StatCell(
+        header=_('Classes in %(days)s days') % {'days': days},
+        items_=tuple(
+            StatItem(
+                label=row['class'].name,
+                value=f"{row['num_decks']} ({row['share']:.0%})",
+                link=f"{reverse_lazy('decks:all_decks')}?deck_class={row['class'].pk}",
+                css=''
+            )
+            for row in trends['classes']
+        )
+    )
+    cards = StatCell(
+        header=_('Cards in %(days)s days') % {'days': days},
+        items_=tuple(
+            StatItem(
+                label=row['card'].name,
+                value=f"{row['num_decks']} ({row['num_decks'] - row['previous']:+d})",
+                link=row['card'].get_absolute_url(),
+                css=''
+            )
+            for row in trends['cards']
+        )
+    )
+    return classes, cards
+
+
+def get_trends_statistics() -> StatSection:
+    cells = []
+    for days in TREND_PERIODS:
+        cells.extend(get_trend_stat(days))
+    return StatSection(
+        header=_('Trends'),
+        cells=tuple(cells)
+    )
+
+
 def get_statistics_context() -> dict:
-    context = {
-        'cards': get_cards_statistics(),
-        'decks': get_decks_statistics(),
-    }
+    """ Статистика из кэша; при промахе - из снимка и дневных сводок (без подсчетов по таблицам карт и колод) """
+    key = StatisticsSnapshot.objects.cache_key(get_language())
+    if (context := cache.get(key)) is None:
+        snapshot = StatisticsSnapshot.objects.filter(pk=1).first() or refresh_statistics()
+        context = {
+            'cards': get_cards_statistics(snapshot),
+            'decks': get_decks_statistics(snapshot),
+            'trends': get_trends_statistics(),
+        }
+        # счетчики новых колод отображаются с задержкой до STATISTICS_CACHE_TIMEOUT; периоды трендов сдвигаются ежедневно
+        cache.set(key, context, timeout=min(settings.STATISTICS_CACHE_TIMEOUT, _seconds_until_midnight()))
     return context
+
+
+def _seconds_until_midnight() -> int:
+    current = localtime()
+    midnight = (current + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((midnight - current).total_seconds()) + 1
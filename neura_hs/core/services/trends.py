@@ -0,0 +1,56 @@
+""" Популярность классов и карт за последние дни (по дневным сводкам DailyDeckCount/DailyCardCount) """
+
+from datetime import timedelta
+from typing import Optional
+
+from django.db.models import Sum, Q
+from django.utils.timezone import localdate
+
+from gallery.models import RealCard, CardClass
+from decks.models import Format, DailyDeckCount, DailyCardCount
+from .reference import get_reference_data
+
+TREND_PERIODS = (7, 30)     # периоды (дни), доступные на странице статистики и в API
+
+
+def get_trends(days: int, deck_format: Optional[Format] = None, top: int = 10) -> dict:
+    """
+    Популярность классов и карт в безымянных колодах, созданных за последние days дней (включая сегодня),
+    в сравнении с предыдущим периодом той же длины
+    :param deck_format: только колоды данного формата
+    :param top: число карт в списке
+    """
+    start = localdate() - timedelta(days=days - 1)
+    previous_start = start - timedelta(days=days)
+    current, previous = Q(day__gte=start), Q(day__lt=start)
+    partition = {'deck_format': deck_format} if deck_format else {}
+
+    classes = DailyDeckCount.objects.filter(day__gte=previous_start, **partition).values('deck_class').annotate(
+        current=Sum('num_decks', filter=current),
+        previous=Sum('num_decks', filter=previous),
+    ).order_by('-current', 'deck_class')
+    classes = [row for row in classes if row['current']]
+    num_decks = sum(row['current'] for row in classes)
+
+    cards = DailyCardCount.objects.filter(day__gte=previous_start, **partition).values('card').annotate(
+        current=Sum('num_decks', filter=current),
+        previous=Sum('num_decks', filter=previous),
+    ).filter(current__gt=0).order_by('-current', 'card')[:top]
+    cards = list(cards)
+
+    class_objects = get_reference_data().in_bulk(CardClass)
+    card_objects = RealCard.objects.in_bulk([row['card'] for row in cards])
+    return {
+        'days': days,
+        'num_decks': num_decks,
+        'classes': [
+            {'class': class_objects[row['deck_class']], 'num_decks': row['current'],
+             'previous': row['previous'] or 0, 'share': round(row['current'] / num_decks, 4)}
+            for row in classes
+        ],
+        'cards': [
+            {'card': card_objects[row['card']], 'num_decks': row['current'],
+             'previous': row['previous'] or 0, 'share': round(row['current'] / num_decks, 4)}
+            for row in cards
+        ],
+    }
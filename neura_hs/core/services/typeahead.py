@@ -0,0 +1,143 @@
+"""
+Подсказки названий карт при вводе (автодополнение с допуском опечаток).
+Индекс названий коллекционных карт на всех языках сайта хранится в памяти процесса: триграммы слов
+(сходство - доля общих триграмм) и отсортированный список слов для поиска по префиксу.
+Строится при первом обращении и перестраивается при смене версии каталога (update_db) или изменении карт
+"""
+
+import bisect
+import threading
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+from django.urls import reverse
+from django.utils.translation import get_language
+
+from core.services.card_search import normalize
+from gallery.models import RealCard, HearthstoneState
+
+SIMILARITY_THRESHOLD = 0.3      # минимальная доля общих триграмм для нечеткого совпадения
+MAX_SUGGESTIONS = 20
+# надбавки к сходству: название начинается с запроса / какое-то слово названия - с последнего слова запроса
+NAME_PREFIX_BONUS = 1.0
+WORD_PREFIX_BONUS = 0.5
+
+
+def trigrams(text: str) -> set[str]:
+    """ Триграммы слов нормализованного текста (слово дополняется пробелами: '  ab ' -> '  a', ' ab', 'ab ') """
+    result = set()
+    for word in text.split():
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class NameIndex:
+    """ Названия коллекционных карт: триграммы и слова (для префиксов) каждого названия на каждом языке """
+
+    def __init__(self, version: int):
+        self.version = version
+        languages = [language for language, _ in settings.LANGUAGES]
+        rows = RealCard.objects.filter(collectible=True).order_by('dbf_id').values(
+            'dbf_id', 'slug', *[f'name_{language}' for language in languages],
+        )
+        self.cards = []         # dbf_id, slug, {язык: название}
+        self.keys = []          # нормализованные названия (индекс карты каждого - в self.owners)
+        owners = []
+        postings = defaultdict(list)
+        words = []
+        for row in rows:
+            names = {language: row[f'name_{language}'] or '' for language in languages}
+            self.cards.append((row['dbf_id'], row['slug'], names))
+            for key in dict.fromkeys(normalize(name) for name in names.values() if name):
+                name_id = len(self.keys)
+                self.keys.append(key)
+                owners.append(len(self.cards) - 1)
+                for trigram in trigrams(key):
+                    postings[trigram].append(name_id)
+                words.extend((word, name_id) for word in key.split())
+
+        self.owners = np.array(owners, dtype=np.int32)
+        self.sizes = np.array([len(trigrams(key)) for key in self.keys], dtype=np.float32)
+        self.postings = {trigram: np.array(ids, dtype=np.int32) for trigram, ids in postings.items()}
+        words.sort()
+        self.words = [word for word, name_id in words]
+        self.word_owners = [name_id for word, name_id in words]
+
+    def _word_prefix_matches(self, prefix: str) -> list[int]:
+        """ Названия, в которых есть слово, начинающееся с prefix """
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\uffff')
+        return self.word_owners[start:end]
+
+    def suggest(self, query: str, limit: int = 10, language: Optional[str] = None) -> list[dict]:
+        """
+        Карты, названия которых лучше всего соответствуют началу или (с опечатками) тексту запроса
+        :param language: язык названий в ответе (по умолчанию - текущий)
+        """
+        query = normalize(query)
+        if not query or not self.keys:
+            return []
+
+        query_trigrams = [trigram for trigram in trigrams(query) if trigram in self.postings]
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+        if query_trigrams:
+            shared = np.bincount(np.concatenate([self.postings[trigram] for trigram in query_trigrams]),
+                                 minlength=len(self.keys)).astype(np.float32)
+            # коэффициент Жаккара по множествам триграмм
+            scores = shared / (len(trigrams(query)) + self.sizes - shared)
+            scores[scores < SIMILARITY_THRESHOLD] = 0
+
+        prefix_matches = np.unique(np.array(self._word_prefix_matches(query.split()[-1]), dtype=np.int32))
+        scores[prefix_matches] += WORD_PREFIX_BONUS
+        for name_id in prefix_matches:
+            if self.keys[name_id].startswith(query):
+                scores[name_id] += NAME_PREFIX_BONUS
+
+        # оценка карты - лучшая из оценок ее названий на разных языках
+        best = np.zeros(len(self.cards), dtype=np.float32)
+        np.maximum.at(best, self.owners, scores)
+        candidates = np.flatnonzero(best)
+        limit = min(limit, MAX_SUGGESTIONS)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(-best[candidates], limit - 1)[:limit]]
+
+        language = language or get_language()
+        result = []
+        for index in candidates:
+            dbf_id, slug, names = self.cards[index]
+            name = names.get(language) or names[settings.LANGUAGE_CODE]
+            result.append({'dbf_id': dbf_id, 'name': name, 'score': float(best[index]),
+                           'url': reverse('gallery:real_card', kwargs={'card_slug': slug})})
+        result.sort(key=lambda item: (-item['score'], len(item['name']), item['name']))
+        return result
+
+
+_index: Optional[NameIndex] = None
+_lock = threading.Lock()
+
+
+def get_name_index() -> NameIndex:
+    """ Индекс текущей версии каталога (строится при первом обращении в процессе и после каждого обновления БД) """
+    global _index
+    version, last_updated = HearthstoneState.get_catalog_version()
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = NameIndex(version)
+            index = _index
+    return index
+
+
+def reset_name_index() -> None:
+    """ Сбрасывает индекс процесса (перестроится при следующем обращении) """
+    global _index
+    _index = None
+
+
+def suggest_cards(query: str, limit: int = 10) -> list[dict]:
+    """ Подсказки по индексу названий текущей версии каталога (см. NameIndex.suggest) """
+    return get_name_index().suggest(query, limit)
@@ -8,11 +8,14 @@ from time import sleep
 from django.utils.text import slugify
 from django.conf import settings
 
-from core.services.deck_codes import parse_deckstring
+from core.services.deck_codes import parse_many, get_deck_identity
 from core.services.api_workers import HsApiConnection
 from core.services.images import CardRender, Thumbnail
-from gallery.models import RealCard, CardClass, Tribe, CardSet, Mechanic
-from decks.models import Deck, Format, Inclusion
+from core.services.statistics import refresh_statistics
+from core.services.card_search import deferred_index_sync
+from core.services.deck_utils import backfill_deck_identity
+from gallery.models import RealCard, CardClass, Tribe, CardSet, Mechanic, HearthstoneState
+from decks.models import Deck, Format, Inclusion, SimilarityPosting, DailyDeckCount
 
 C_TYPES = {
     'minion': RealCard.CardTypes.MINION,
@@ -307,10 +310,16 @@ class Updater:
         if not self.__rewrite:
             return
 
-        for deck in tqdm(Deck.objects.all(), desc='Rebuilding decks', ncols=100):
-            cards, heroes, format_ = parse_deckstring(deck.string)
+        # дубликаты безымянных колод нарушили бы уникальность identity при сохранении
+        report = backfill_deck_identity(recalculate=True)
+        self.__writer(f'Duplicate nameless decks merged: {report["merged"]}')
+        decks = list(Deck.objects.all())
+        decoded = parse_many(deck.string for deck in decks)
+        for deck, (cards, heroes, format_) in tqdm(zip(decks, decoded), total=len(decks),
+                                                   desc='Rebuilding decks', ncols=100):
             deck.deck_class = RealCard.objects.get(dbf_id=heroes[0]).card_class.all().first()
             deck.deck_format = Format.objects.get(numerical_designation=format_)
+            deck.identity = get_deck_identity(cards, heroes, format_)
             deck.save()
             for dbf_id, number in cards:
                 card = RealCard.includibles.get(dbf_id=dbf_id)
@@ -318,10 +327,15 @@ class Updater:
                 ci.save()
                 deck.cards.add(card)
 
+        self.__writer('Rebuilding similar decks index...')
+        SimilarityPosting.objects.rebuild()
+        self.__writer('Rebuilding daily rollups...')
+        DailyDeckCount.objects.rebuild()
+
     def update(self):
         """ Выполняет обновление БД """
 
-        with transaction.atomic():
+        with transaction.atomic(), deferred_index_sync():
             if self.__rewrite:
                 self.__clear_database()
             self.__write_classes()
@@ -331,7 +345,12 @@ class Updater:
             self.__write_mechanics()
             self.__write_cards()
             self.__update_classes()
+            self.__writer('Refreshing card presentation fields...')
+            RealCard.objects.refresh_presentation()
             self.__rebuild_decks()
+            self.__writer('Refreshing statistics...')
+            refresh_statistics()
+            HearthstoneState.bump_catalog_version()
 
 
 def _clear_unreadable(text: str) -> str:
@@ -4,16 +4,40 @@ document.addEventListener("DOMContentLoaded", function() {
     addAccordionListeners();
     addCopyDeckstringListeners();
     positionCardTooltips();
+    addCardPreviewListeners();
 })
 
+function addCardPreviewListeners() {
+    // рендеры карт в подсказках загружаются при первом наведении (касании), в т.ч. в подгруженных списках карт
+    document.addEventListener("mouseover", loadCardPreview);
+    document.addEventListener("focusin", loadCardPreview);
+    document.addEventListener("touchstart", loadCardPreview, {passive: true});
+}
+
+function loadCardPreview(event) {
+    let cell = event.target.closest && event.target.closest(".deck-card-cell");
+    if (!cell) {
+        return;
+    }
+    let preview = cell.querySelector("img[data-preview]");
+    if (preview) {
+        preview.src = preview.dataset.preview;
+        preview.removeAttribute("data-preview");
+    }
+}
+
 function positionCardTooltips() {
     // позиционирует tooltip карты в соответствии с ее положением в колоде
     let decks = document.getElementsByClassName("deck");
     for (let i = 0; i < decks.length; i++) {
-        let cards = decks[i].getElementsByClassName("deck-card-cell");
-        for (let j = 0; j < cards.length; j++) {
-            cards[j].firstElementChild.lastElementChild.style.top = -100 - 1000 * j / cards.length + '%';
-        }
+        positionDeckTooltips(decks[i]);
+    }
+}
+
+function positionDeckTooltips(deck) {
+    let cards = deck.getElementsByClassName("deck-card-cell");
+    for (let j = 0; j < cards.length; j++) {
+        cards[j].firstElementChild.lastElementChild.style.top = -100 - 1000 * j / cards.length + '%';
     }
 }
 
@@ -27,6 +51,20 @@ function addAccordionListeners() {
 function showCards() {
     this.classList.toggle("deck-accordion-active");
     let cards = this.parentNode.parentNode.parentNode.parentNode.nextElementSibling;
+    if (cards.dataset.cardsUrl && !cards.dataset.loaded) {
+        // карты колоды загружаются при первом раскрытии
+        cards.dataset.loaded = "true";
+        fetch(cards.dataset.cardsUrl, {headers: {"X-Requested-With": "XMLHttpRequest"}})
+            .then(response => response.json())
+            .then(data => {
+                cards.innerHTML = data.html;
+                positionDeckTooltips(cards.parentNode);
+                if (cards.style.maxHeight) {
+                    cards.style.maxHeight = cards.scrollHeight + "px";
+                }
+            })
+            .catch(() => { delete cards.dataset.loaded; });
+    }
     (cards.style.maxHeight) ?
         cards.style.maxHeight = null :
         cards.style.maxHeight = cards.scrollHeight + "px";
@@ -0,0 +1,31 @@
+'use strict';
+
+$(document).ready(function() {
+
+    // Подсказки названий карт при вводе (запрос - после паузы в наборе)
+
+    let suggestions = $('#cardSuggestions');
+    let timer = null;
+    let lastQuery = '';
+
+    $('#id_name').on('input', function() {
+        let query = $(this).val().trim();
+        clearTimeout(timer);
+        if (query.length < 2 || query === lastQuery) {
+            return;
+        }
+        timer = setTimeout(function() {
+            lastQuery = query;
+            $.ajax({
+                data: {q: query},
+                url: suggestions.data('url'),
+                success: function(response) {
+                    suggestions.empty();
+                    $.each(response.suggestions, function(index, card) {
+                        suggestions.append($('<option>').attr('value', card.name));
+                    });
+                }
+            });
+        }, 150);
+    });
+});
@@ -103,12 +103,14 @@ function render() {
 
     let btn = $('#renderForm');
     let deckId = btn.attr('datasrc');
+    let deckstring = btn.attr('data-deckstring');
     let name = $('#renderName').val();
     let lang = $('input[name=renderLang]:checked', btn.find('form')).val();
     $.ajax({
         data: {
             render: true,
             deck_id: deckId,
+            deckstring: deckId ? '' : deckstring,
             name: name,
             language: lang
         },
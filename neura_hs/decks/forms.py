@@ -1,7 +1,6 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
-from gallery.models import CardClass
-from .models import Deck, Format
+from core.services.reference import ReferenceChoiceField
 
 
 class DeckstringForm(forms.Form):
@@ -27,11 +26,10 @@ class DeckSaveForm(forms.Form):
 
 
 class DeckFilterForm(forms.Form):
-    CARD_CLASSES = CardClass.objects.filter(collectible=True)
-    deck_class = forms.ModelChoiceField(queryset=CARD_CLASSES, required=False, label=_('Class'))
+    # варианты и их разметка - из справочника в памяти (core.services.reference)
+    deck_class = ReferenceChoiceField('collectible_classes', required=False, label=_('Class'))
 
-    FORMATS = Format.objects.exclude(numerical_designation=0)
-    deck_format = forms.ModelChoiceField(queryset=FORMATS, required=False, label=_('Format'))
+    deck_format = ReferenceChoiceField('formats', required=False, label=_('Format'))
 
     deck_class.widget.attrs.update({'class': 'form-input'})
     deck_format.widget.attrs.update({'class': 'form-input'})
@@ -1,10 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
-from django.utils.timezone import now
+from django.utils.timezone import now, localdate
 from django.urls.base import reverse_lazy
-from gallery.models import RealCard, Author, CardClass, CardSet
+from gallery.models import RealCard, Author, CardClass, CardSet, SingletonModel
 from core.exceptions import UnsupportedCards
-from core.services.deck_codes import parse_deckstring
+from core.services.deck_codes import parse_deckstring, get_deck_identity
 
 
 class IncluSionManager(models.QuerySet):
@@ -16,6 +21,64 @@ class IncluSionManager(models.QuerySet):
         return self.exclude(deck__name='')
 
 
+class SimilarityIndexManager(models.Manager):
+    """ Поддержка инвертированного индекса карта -> безымянные колоды """
+
+    def add_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Добавляет безымянную колоду в индекс
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        partition = {'deck_class_id': deck.deck_class_id, 'deck_format_id': deck.deck_format_id}
+        self.bulk_create([self.model(deck=deck, card_id=card_id, number=number, **partition)
+                          for card_id, number in composition.items()])
+
+        # частоты нужны лишь для выбора редких карт при поиске: редкие потери инкремента
+        # при конкурентной вставке на результат поиска не влияют
+        frequencies = CardFrequency.objects.filter(card_id__in=composition, **partition)
+        frequencies.update(num_decks=models.F('num_decks') + 1)
+        existing = set(frequencies.values_list('card_id', flat=True))
+        CardFrequency.objects.bulk_create([CardFrequency(card_id=card_id, num_decks=1, **partition)
+                                           for card_id in composition if card_id not in existing],
+                                          ignore_conflicts=True)
+
+    def remove_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Учитывает удаление безымянной колоды в частотах карт (записи индекса удаляются вместе с колодой)
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        CardFrequency.objects.filter(
+            card_id__in=composition, deck_class_id=deck.deck_class_id, deck_format_id=deck.deck_format_id,
+            num_decks__gt=0,
+        ).update(num_decks=models.F('num_decks') - 1)
+
+    def rebuild(self) -> int:
+        """ Полностью перестраивает индекс по таблице Inclusion; возвращает число проиндексированных колод """
+        self.all().delete()
+        CardFrequency.objects.all().delete()
+
+        inclusions = Inclusion.objects.filter(deck__name='', deck__author=None).values_list(
+            'deck_id', 'card_id', 'number', 'deck__deck_class_id', 'deck__deck_format_id',
+        )
+        postings, frequencies, decks = [], {}, set()
+        for deck_id, card_id, number, class_id, format_id in inclusions.iterator():
+            postings.append(self.model(deck_id=deck_id, card_id=card_id, number=number,
+                                       deck_class_id=class_id, deck_format_id=format_id))
+            if len(postings) == 5000:
+                self.bulk_create(postings)
+                postings = []
+            key = (card_id, class_id, format_id)
+            frequencies[key] = frequencies.get(key, 0) + 1
+            decks.add(deck_id)
+        self.bulk_create(postings)
+        CardFrequency.objects.bulk_create(
+            [CardFrequency(card_id=card_id, deck_class_id=class_id, deck_format_id=format_id, num_decks=num)
+             for (card_id, class_id, format_id), num in frequencies.items()],
+            batch_size=1000,
+        )
+        return len(decks)
+
+
 class NamelessDeckManager(models.Manager):
 
     def get_queryset(self):
@@ -63,6 +126,9 @@ class Deck(models.Model):
                                     related_name='decks', verbose_name=_('Formats'),
                                     help_text=_('The format for which the deck is intended.'))
     created = models.DateTimeField(default=now, verbose_name=_('Time of creation.'))
+    identity = models.CharField(max_length=32, null=True, blank=True, editable=False, db_index=True,
+                                verbose_name=_('Identity'),
+                                help_text=_('Hash of the canonical deck composition (hero, format, cards).'))
 
     nameless = NamelessDeckManager()
     objects = models.Manager()
@@ -72,46 +138,124 @@ class Deck(models.Model):
         verbose_name = _('Deck')
         verbose_name_plural = _('Decks')
         ordering = ['-created']
+        indexes = [
+            # постраничный вывод по ключу сортировки (core.services.pagination)
+            models.Index(fields=['created', 'id'], name='deck_created_id_idx'),
+        ]
+        constraints = [
+            # каждая колода без автора и названия существует в БД в единственном экземпляре
+            models.UniqueConstraint(fields=['identity'], condition=models.Q(name='', author=None),
+                                    name='unique_nameless_deck_identity'),
+        ]
+
+    # состав колоды, расшифрованной по каталогу в памяти (core.services.deck_catalog), - вместо запросов к БД
+    _decoded_cards = None
+    # число карт по редкостям, загруженное для всего списка колод (core.services.deck_utils.load_craft_costs)
+    _rarity_counts = None
 
     def __str__(self):
-        kinda_name = self.name if self.name else f'id_{self.pk}'
+        kinda_name = self.name if self.name else (f'id_{self.pk}' if self.pk else _('Decoded deck'))
         return f'{kinda_name} ({self.deck_format}, {self.deck_class})'
 
     @classmethod
-    def create_from_deckstring(cls, deckstring: str, *, named: bool = False):
-        """ Создает экземпляр колоды из кода, сохраняет и возвращает его """
+    def create_from_deckstring(cls, deckstring: str, *, author: Author = None):
+        """
+        Создает экземпляр колоды из кода, сохраняет и возвращает его
+        :param author: автор именованной колоды; без автора - уникальная безымянная колода
+        """
+
+        cards, heroes, format_ = parse_deckstring(deckstring)
+        identity = get_deck_identity(cards, heroes, format_)
 
-        # если точно такая же колода уже есть в БД - она же и возвращается вместо создания нового экземпляра
-        nameless_deck = Deck.nameless.filter(string=deckstring)
-        if not named and nameless_deck.exists():
-            return nameless_deck.first()
+        # если колода такого же состава уже есть в БД - она же и возвращается вместо создания нового экземпляра
+        if author is None and (nameless_deck := cls.find_nameless(identity)):
+            return nameless_deck
 
         instance = cls()
-        cards, heroes, format_ = parse_deckstring(deckstring)
         instance.deck_class = RealCard.objects.get(dbf_id=heroes[0]).card_class.all().first()
         instance.deck_format = Format.objects.get(numerical_designation=format_)
         instance.string = deckstring
-        instance.save()
+        instance.identity = identity
+        instance.author = author
+        composition = {}
+        included = RealCard.includibles.in_bulk([dbf_id for dbf_id, number in cards], field_name='dbf_id')
         for dbf_id, number in cards:
-            try:
-                card = RealCard.includibles.get(dbf_id=dbf_id)
-            except RealCard.DoesNotExist:
+            if dbf_id not in included:
                 msg = _('No card data (id %(id)s)') % {'id': dbf_id}
                 raise UnsupportedCards(msg)
-            ci = Inclusion(deck=instance, card=card, number=number)
-            ci.save()
-            instance.cards.add(card)
+            composition[included[dbf_id].pk] = number
+        try:
+            with transaction.atomic():
+                instance.save()
+                Inclusion.objects.bulk_create([Inclusion(deck=instance, card_id=card_id, number=number)
+                                               for card_id, number in composition.items()])
+                if author is None:
+                    instance.register_nameless(composition)
+        except IntegrityError:
+            # ту же колоду параллельно создал другой запрос
+            if author is not None or not (nameless_deck := cls.find_nameless(identity)):
+                raise
+            return nameless_deck
 
         return instance
 
+    def register_nameless(self, composition: dict[int, int]) -> None:
+        """
+        Учитывает новую безымянную колоду в индексе похожих колод, статистике и дневных сводках
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        SimilarityPosting.objects.add_deck(self, composition)
+        StatisticsSnapshot.objects.add_deck(self, composition)
+        DailyDeckCount.objects.add_deck(self, composition)
+
+    def unregister_nameless(self, composition: dict[int, int]) -> None:
+        """
+        Учитывает удаление безымянной колоды в частотах карт, статистике и дневных сводках
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        SimilarityPosting.objects.remove_deck(self, composition)
+        StatisticsSnapshot.objects.remove_deck(self, composition)
+        DailyDeckCount.objects.remove_deck(self, composition)
+
+    @classmethod
+    def find_nameless(cls, identity: str):
+        """ Возвращает безымянную колоду с данным составом (или None) """
+        return cls.nameless.filter(identity=identity, author=None).first()
+
     @property
     def is_named(self):
         """ Возвращает True, если колода была сохранена пользователем """
         return self.name != '' and self.author is not None
 
+    def set_decoded_cards(self, cards: list[RealCard]) -> None:
+        """
+        Задает состав колоды без обращения к БД: included_cards, статистика и стоимость создания
+        вычисляются по этим картам
+        :param cards: карты с атрибутом number (кол-во экземпляров в колоде)
+        """
+        self._decoded_cards = sorted(cards, key=lambda card: (card.cost, card.name))
+
+    @property
+    def is_decoded(self):
+        """ Возвращает True, если состав колоды задан каталогом в памяти """
+        return self._decoded_cards is not None
+
+    @property
+    def decoded_inclusions(self) -> list:
+        """ Несохраняемые вхождения карт для сериализации расшифрованной колоды """
+        return [Inclusion(card=card, number=card.number) for card in self._decoded_cards]
+
+    def get_composition(self) -> dict[int, int]:
+        """ Состав колоды: {pk карты: кол-во экземпляров} """
+        if self.is_decoded:
+            return {card.pk: card.number for card in self._decoded_cards}
+        return dict(self.inclusions.values_list('card_id', 'number'))
+
     @property
     def included_cards(self):
         """ Queryset 'cards', дополненный данными о количестве экземпляров в колоде """
+        if self.is_decoded:
+            return self._decoded_cards
 
         decklist = self.cards.all().prefetch_related(
             'card_class',
@@ -128,12 +272,15 @@ class Deck(models.Model):
         from .forms import DeckStringCopyForm  # импорт здесь во избежание перекрестного импорта
         return DeckStringCopyForm(initial={'deckstring': self.string})
 
+    def set_rarity_counts(self, counts: dict[str, int]) -> None:
+        """ Задает число карт колоды по редкостям: стоимость создания вычисляется без загрузки состава """
+        self._rarity_counts = counts
+
     def get_craft_cost(self):
         """
         Возвращает суммарную стоимость (во внутриигровой валюте)
         создания карт из колоды (в обычном и золотом варианте)
         """
-        craft_cost, craft_cost_gold = 0, 0
         rarities = RealCard.Rarities
         prices = {rarities.UNKNOWN: (0, 0),
                   rarities.NO_RARITY: (0, 0),
@@ -141,9 +288,13 @@ class Deck(models.Model):
                   rarities.RARE: (100, 800),
                   rarities.EPIC: (100, 1600),
                   rarities.LEGENDARY: (1600, 3200)}
-        for card in self.included_cards:
-            craft_cost += prices[card.rarity][0] * card.number
-            craft_cost_gold += prices[card.rarity][1] * card.number
+        counts = self._rarity_counts
+        if counts is None:
+            counts = {}
+            for card in self.included_cards:
+                counts[card.rarity] = counts.get(card.rarity, 0) + card.number
+        craft_cost = sum(prices[rarity][0] * number for rarity, number in counts.items())
+        craft_cost_gold = sum(prices[rarity][1] * number for rarity, number in counts.items())
         return {'basic': craft_cost, 'gold': craft_cost_gold}
 
     def __get_statistics(self, field: str) -> list[dict]:
@@ -227,6 +378,211 @@ class Inclusion(models.Model):
     objects = IncluSionManager.as_manager()
 
 
+class SimilarityPosting(models.Model):
+    """ Элемент инвертированного индекса для поиска похожих колод (только безымянные колоды) """
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='postings')
+    card = models.ForeignKey(RealCard, on_delete=models.CASCADE, related_name='+')
+    deck_class = models.ForeignKey(CardClass, on_delete=models.CASCADE, related_name='+')
+    deck_format = models.ForeignKey(Format, on_delete=models.CASCADE, related_name='+')
+    number = models.PositiveSmallIntegerField()
+
+    objects = SimilarityIndexManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['deck_class', 'deck_format', 'card'])]
+
+
+class CardFrequency(models.Model):
+    """ Число безымянных колод класса и формата, содержащих карту """
+    card = models.ForeignKey(RealCard, on_delete=models.CASCADE, related_name='+')
+    deck_class = models.ForeignKey(CardClass, on_delete=models.CASCADE, related_name='+')
+    deck_format = models.ForeignKey(Format, on_delete=models.CASCADE, related_name='+')
+    num_decks = models.PositiveIntegerField(default=0)
+
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['deck_class', 'deck_format', 'card'], name='unique_card_frequency'),
+        ]
+
+
+class SimilarDeck(models.Model):
+    """ Предрассчитанный сосед безымянной колоды (см. core.services.similarity_matrix) """
+    deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='neighbours')
+    similar = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name='+')
+    num_matches = models.PositiveSmallIntegerField(verbose_name=_('Number of matching cards'))
+
+    objects = models.Manager()
+
+    class Meta:
+        ordering = ['-num_matches', '-similar_id']
+
+
+class SimilarDecksState(SingletonModel):
+    """ Состояние предрасчета похожих колод """
+    last_deck_id = models.BigIntegerField(default=0, help_text='Decks with pk <= last_deck_id are processed')
+    last_updated = models.DateTimeField(auto_now=True, verbose_name=_('Last update time'))
+
+    @classmethod
+    def is_processed(cls, deck) -> bool:
+        """ Рассчитаны ли соседи колоды """
+        return cls.objects.filter(pk=1, last_deck_id__gte=deck.pk).exists()
+
+
+class StatisticsManager(models.Manager):
+    """ Поддержка снимка статистики в актуальном состоянии без пересчета по таблице колод """
+
+    def add_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Учитывает новую безымянную колоду - только счетчики; популярные карты пересчитываются
+        в refresh_statistics (update_db, команда refresh_statistics), отрисованная статистика
+        обновляется по истечении STATISTICS_CACHE_TIMEOUT
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        counters = {'num_decks': models.F('num_decks') + 1}
+        if field := self.model.FORMAT_FIELDS.get(deck.deck_format.numerical_designation):
+            counters[field] = models.F(field) + 1
+        if len(composition) == 30:
+            counters['num_highlander'] = models.F('num_highlander') + 1
+        self.filter(pk=1).update(last_updated=now(), **counters)
+
+    def remove_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Учитывает удаление безымянной колоды (счетчики, как и в add_deck)
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        fields = ['num_decks']
+        if field := self.model.FORMAT_FIELDS.get(deck.deck_format.numerical_designation):
+            fields.append(field)
+        if len(composition) == 30:
+            fields.append('num_highlander')
+        # счетчики уменьшаются по отдельности: не уходят ниже нуля, даже если снимок устарел
+        for field in fields:
+            self.filter(pk=1, **{f'{field}__gt': 0}).update(**{field: models.F(field) - 1})
+
+    def popular_cards(self, top: int = 5) -> list[list[int]]:
+        """ Самые популярные карты безымянных колод по частотам индекса похожих колод: [[pk карты, число колод]] """
+        frequencies = CardFrequency.objects.values('card').annotate(
+            num_decks=models.Sum('num_decks'),
+        ).order_by('-num_decks', 'card').values_list('card', 'num_decks')[:top]
+        return [list(item) for item in frequencies]
+
+    @staticmethod
+    def cache_key(language: str) -> str:
+        return f'statistics:{language}'
+
+    def invalidate_cache(self) -> None:
+        """ Удаляет отрисованную статистику из кэша (для всех языков) """
+        cache.delete_many([self.cache_key(language) for language, name in settings.LANGUAGES])
+
+
+class StatisticsSnapshot(SingletonModel):
+    """ Материализованная статистика сайта (страница /statistics) """
+
+    # значение енума формата -> поле счетчика колод
+    FORMAT_FIELDS = {2: 'num_standard', 1: 'num_wild', 3: 'num_classic'}
+
+    num_cards = models.PositiveIntegerField(default=0)
+    num_collectible = models.PositiveIntegerField(default=0)
+    num_legendary = models.PositiveIntegerField(default=0)
+    num_epic = models.PositiveIntegerField(default=0)
+    num_rare = models.PositiveIntegerField(default=0)
+    num_common = models.PositiveIntegerField(default=0)
+    popular_mechanics = models.JSONField(default=list, help_text='[[mechanic pk, number of collectible cards]]')
+    num_decks = models.PositiveIntegerField(default=0)
+    num_highlander = models.PositiveIntegerField(default=0)
+    num_standard = models.PositiveIntegerField(default=0)
+    num_wild = models.PositiveIntegerField(default=0)
+    num_classic = models.PositiveIntegerField(default=0)
+    popular_cards = models.JSONField(default=list, help_text='[[card pk, number of nameless decks]]')
+    last_updated = models.DateTimeField(auto_now=True, verbose_name=_('Last update time'))
+
+    objects = StatisticsManager()
+
+
+class DailyRollupManager(models.Manager):
+    """ Поддержка дневных сводок по безымянным колодам (DailyDeckCount и DailyCardCount) """
+
+    def add_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Учитывает новую безымянную колоду в сводках за день ее создания
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        day = localdate(deck.created)
+        partition = {'day': day, 'deck_class_id': deck.deck_class_id, 'deck_format_id': deck.deck_format_id}
+        if not self.filter(**partition).update(num_decks=models.F('num_decks') + 1):
+            self.bulk_create([self.model(num_decks=1, **partition)], ignore_conflicts=True)
+
+        cards = DailyCardCount.objects.filter(day=day, deck_format_id=deck.deck_format_id, card_id__in=composition)
+        cards.update(num_decks=models.F('num_decks') + 1)
+        existing = set(cards.values_list('card_id', flat=True))
+        DailyCardCount.objects.bulk_create([
+            DailyCardCount(day=day, deck_format_id=deck.deck_format_id, card_id=card_id, num_decks=1)
+            for card_id in composition if card_id not in existing
+        ], ignore_conflicts=True)
+
+    def remove_deck(self, deck, composition: dict[int, int]) -> None:
+        """
+        Учитывает удаление безымянной колоды в сводках за день ее создания
+        :param composition: {pk карты: кол-во экземпляров}
+        """
+        day = localdate(deck.created)
+        self.filter(day=day, deck_class_id=deck.deck_class_id, deck_format_id=deck.deck_format_id,
+                    num_decks__gt=0).update(num_decks=models.F('num_decks') - 1)
+        DailyCardCount.objects.filter(day=day, deck_format_id=deck.deck_format_id, card_id__in=composition,
+                                      num_decks__gt=0).update(num_decks=models.F('num_decks') - 1)
+
+    def rebuild(self) -> None:
+        """ Полностью перестраивает сводки по таблицам Deck и Inclusion """
+        self.all().delete()
+        DailyCardCount.objects.all().delete()
+
+        decks = Deck.objects.filter(name='', author=None).annotate(
+            day=TruncDate('created'),
+        ).values('day', 'deck_class_id', 'deck_format_id').annotate(num=models.Count('pk')).order_by()
+        self.bulk_create([self.model(day=row['day'], deck_class_id=row['deck_class_id'],
+                                     deck_format_id=row['deck_format_id'], num_decks=row['num'])
+                          for row in decks], batch_size=1000)
+
+        cards = Inclusion.objects.filter(deck__name='', deck__author=None).annotate(
+            day=TruncDate('deck__created'),
+        ).values('day', 'deck__deck_format_id', 'card_id').annotate(num=models.Count('pk')).order_by()
+        DailyCardCount.objects.bulk_create([DailyCardCount(day=row['day'], deck_format_id=row['deck__deck_format_id'],
+                                                           card_id=row['card_id'], num_decks=row['num'])
+                                            for row in cards.iterator()], batch_size=1000)
+
+
+class DailyDeckCount(models.Model):
+    """ Число безымянных колод класса и формата, созданных за день """
+    day = models.DateField()
+    deck_class = models.ForeignKey(CardClass, on_delete=models.CASCADE, related_name='+')
+    deck_format = models.ForeignKey(Format, on_delete=models.CASCADE, related_name='+')
+    num_decks = models.PositiveIntegerField(default=0)
+
+    objects = DailyRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'deck_class', 'deck_format'], name='unique_daily_deck_count'),
+        ]
+
+
+class DailyCardCount(models.Model):
+    """ Число безымянных колод формата, созданных за день и содержащих карту """
+    day = models.DateField()
+    card = models.ForeignKey(RealCard, on_delete=models.CASCADE, related_name='+')
+    deck_format = models.ForeignKey(Format, on_delete=models.CASCADE, related_name='+')
+    num_decks = models.PositiveIntegerField(default=0)
+
+    objects = models.Manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'deck_format', 'card'], name='unique_daily_card_count'),
+        ]
+
+
 class Render(models.Model):
     """ Детализированное изображение колоды """
 
@@ -241,3 +597,47 @@ class Render(models.Model):
     language = models.CharField(max_length=2, choices=Languages.choices, default=Languages.ENGLISH)
 
     objects = models.Manager()
+
+
+@receiver([post_save, post_delete], sender=Format)
+def bump_reference_version_signal(sender, **kwargs):
+    """ Изменение форматов обновляет справочник во всех процессах """
+    from core.services.reference import bump_reference_version  # импорт здесь во избежание перекрестного импорта
+    bump_reference_version()
+
+
+@receiver([post_save, post_delete], sender=RealCard)
+@receiver([post_save, post_delete], sender=CardClass)
+@receiver([post_save, post_delete], sender=Format)
+@receiver(m2m_changed, sender=RealCard.card_class.through)
+@receiver(m2m_changed, sender=RealCard.mechanic.through)
+@receiver(m2m_changed, sender=RealCard.tribe.through)
+def reset_deck_catalog_signal(sender, **kwargs):
+    """ Изменения карт, классов и форматов сбрасывают каталог расшифровки колод этого процесса """
+    from core.services.deck_catalog import reset_deck_catalog  # импорт здесь во избежание перекрестного импорта
+    reset_deck_catalog()
+
+
+@receiver(pre_delete, sender=Deck)
+def capture_nameless_composition_signal(sender, instance, **kwargs):
+    """
+    Состав удаляемой безымянной колоды (связанные записи удаляются раньше, чем отправляется post_delete колоды) -
+    по записям индекса похожих колод: они есть только у колод, учтенных в register_nameless
+    """
+    if not instance.name and instance.author_id is None:
+        if composition := dict(instance.postings.values_list('card_id', 'number')):
+            instance._deleted_composition = composition
+
+
+@receiver(post_delete, sender=Deck)
+def unregister_nameless_signal(sender, instance, **kwargs):
+    """ Удаление безымянной колоды уменьшает частоты карт, счетчики статистики и дневные сводки """
+    if (composition := getattr(instance, '_deleted_composition', None)) is not None:
+        instance.unregister_nameless(composition)
+
+
+@receiver(post_delete, sender=Deck)
+def bump_list_version_signal(sender, **kwargs):
+    """ Удаление колод обновляет число записей списков колод """
+    from core.services.pagination import bump_list_version  # импорт здесь во избежание перекрестного импорта
+    bump_list_version()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
@@ -10,6 +11,8 @@ urlpatterns = [
     path('my/', views.UserDecksListView.as_view(), name='user_decks'),
     path('<int:deck_id>', views.deck_view, name='deck-detail'),
     path('<int:deck_id>/delete', views.DeckDelete.as_view(), name='deck-delete'),
-    path('get_render/', views.get_deck_render, name='deck-render'),
+    path('<int:deck_id>/cards/', views.get_deck_cards, name='deck-cards'),
+    path('get_render/', views.get_deck_render_async if settings.ASYNC_VIEWS else views.get_deck_render,
+         name='deck-render'),
     path('random_deckstring/', views.get_random_deckstring, name='get_random_deckstring'),
 ]
@@ -1,5 +1,5 @@
 from django.http import HttpRequest, JsonResponse
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy
 from django.views import generic
 from django.core.exceptions import PermissionDenied
@@ -7,13 +7,16 @@ from django.contrib.messages.views import SuccessMessageMixin
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
-from django.db import transaction
-from core.mixins import DataMixin
+from core.mixins import DataMixin, KeysetPaginationMixin
 from random import choice
 from .models import Deck
 from .forms import DeckstringForm, DeckSaveForm, DeckFilterForm
 from core.services.deck_codes import get_clean_deckstring
-from core.services.deck_utils import find_similar_decks, get_render
+from core.services.deck_utils import (
+    get_similar_decks, get_render, get_render_deck, draw_render, save_render, load_craft_costs, get_deck_cards_html,
+)
+from core.services.deck_catalog import decode_deck, record_decoded
+from core.services.concurrency import db_async, run_cpu
 from core.exceptions import DecodeError, UnsupportedCards
 
 
@@ -30,12 +33,12 @@ def create_deck(request: HttpRequest):
                 try:
                     deckstring = deckstring_form.cleaned_data['deckstring']
                     deckstring = get_clean_deckstring(deckstring)
-                    with transaction.atomic():
-                        deck = Deck.create_from_deckstring(deckstring)
-                        deck_name_init = f'{deck.deck_class}-{deck.pk}'
-                        deck_save_form = DeckSaveForm(initial={'string_to_save': deckstring,
-                                                               'deck_name': deck_name_init})
-                        title = deck
+                    deck = decode_deck(deckstring)      # без записи в БД
+                    record_decoded(deck)
+                    deck_name_init = f'{deck.deck_class}-{deck.pk}' if deck.pk else str(deck.deck_class)
+                    deck_save_form = DeckSaveForm(initial={'string_to_save': deckstring,
+                                                           'deck_name': deck_name_init})
+                    title = deck
                 except DecodeError as de:
                     msg = _('Error: %(error)s') % {'error': de}
                     deckstring_form.add_error(None, msg)
@@ -43,8 +46,7 @@ def create_deck(request: HttpRequest):
                     msg = _('%(error)s. The database will be updated shortly.') % {'error': u}
                     deckstring_form.add_error(None, msg)
         if 'deck_name' in request.POST:         # название колоды отправлено с формы DeckSaveForm
-            deck = Deck.create_from_deckstring(request.POST['string_to_save'], named=True)
-            deck.author = request.user.author
+            deck = Deck.create_from_deckstring(request.POST['string_to_save'], author=request.user.author)
             deck.name = request.POST['deck_name']
             deck.save()
             return redirect(deck)
@@ -55,7 +57,7 @@ def create_deck(request: HttpRequest):
                'deckstring_form': deckstring_form,
                'deck_save_form': deck_save_form,
                'deck': deck,
-               'similar': find_similar_decks(deck)}
+               'similar': load_craft_costs(get_similar_decks(deck))}
 
     return render(request, template_name='decks/deck_detail.html', context=context)
 
@@ -70,20 +72,67 @@ def get_random_deckstring(request: HttpRequest):
     return redirect(reverse_lazy('decks:index'))
 
 
-def get_deck_render(request: HttpRequest):
-    """ AJAX-view для получения наглядного изображения колоды """
-    if all([
+def get_deck_cards(request: HttpRequest, deck_id: int):
+    """ AJAX-view для получения карт колоды (содержимое раскрывающегося списка) """
+    if not request.is_ajax():
+        return redirect('decks:deck-detail', deck_id=deck_id)
+
+    deck = get_object_or_404(Deck.objects.only('name', 'author'), pk=deck_id)
+    if deck.is_named:
+        if not request.user.is_authenticated or deck.author != request.user.author:
+            raise PermissionDenied()
+
+    return JsonResponse({'html': get_deck_cards_html(deck.pk)})
+
+
+def _is_render_request(request: HttpRequest) -> bool:
+    return all([
         request.GET.get('render'),
-        deck_id := request.GET.get('deck_id'),
+        request.GET.get('deck_id') or request.GET.get('deckstring'),
         request.is_ajax(),
-    ]):
+    ])
+
+
+def _get_render_deck_id(request: HttpRequest) -> int:
+    """ id колоды для рендера: рендер хранится вместе с колодой - расшифрованная колода сохраняется явно """
+    if deck_id := request.GET.get('deck_id'):
+        return deck_id
+    return Deck.create_from_deckstring(get_clean_deckstring(request.GET['deckstring'])).pk
+
+
+def get_deck_render(request: HttpRequest):
+    """ AJAX-view для получения наглядного изображения колоды """
+    if _is_render_request(request):
+        try:
+            deck_id = _get_render_deck_id(request)
+        except (DecodeError, UnsupportedCards) as e:
+            return JsonResponse({'error': str(e)}, status=400)
         response = get_render(deck_id, name=request.GET.get('name'), language=request.GET.get('language'))
         return JsonResponse(response)
 
     return redirect(reverse_lazy('decks:index'))
 
 
-class NamelessDecksListView(DataMixin, generic.ListView):
+async def get_deck_render_async(request: HttpRequest):
+    """
+    Асинхронный вариант get_deck_render (ASGI): загрузка колоды и сохранение рендера - в пуле потоков,
+    рисование - в пуле процессов, не блокируя поток
+    """
+    if _is_render_request(request):
+        try:
+            deck_id = await db_async(_get_render_deck_id)(request)
+        except (DecodeError, UnsupportedCards) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        name, language = request.GET.get('name'), request.GET.get('language')
+        deck = await db_async(get_render_deck)(deck_id)
+        image = await run_cpu(draw_render, deck, name, language)
+        response = await db_async(save_render)(deck, image, name, language)
+        return JsonResponse(response)
+
+    return redirect(reverse_lazy('decks:index'))
+
+
+class NamelessDecksListView(KeysetPaginationMixin, DataMixin, generic.ListView):
     """ Вывод списка всех имеющихся в базе уникальных колод """
     model = Deck
     context_object_name = 'decks'
@@ -99,6 +148,7 @@ class NamelessDecksListView(DataMixin, generic.ListView):
         default_context = self.get_custom_context(title=_('Decks'),
                                                   form=DeckFilterForm(initial=search_initial_values))
         context |= default_context
+        load_craft_costs(context['decks'])    # стоимость создания всех колод страницы - одним запросом
         return context
 
     def get_queryset(self):
@@ -114,7 +164,7 @@ class NamelessDecksListView(DataMixin, generic.ListView):
         return object_list
 
 
-class UserDecksListView(LoginRequiredMixin, DataMixin, generic.ListView):
+class UserDecksListView(LoginRequiredMixin, KeysetPaginationMixin, DataMixin, generic.ListView):
     """ Вывод списка сохраненных текущим пользователем колод """
 
     model = Deck
@@ -132,6 +182,7 @@ class UserDecksListView(LoginRequiredMixin, DataMixin, generic.ListView):
         default_context = self.get_custom_context(title=_('Decks'),
                                                   form=DeckFilterForm(initial=search_initial_values))
         context |= default_context
+        load_craft_costs(context['decks'])    # стоимость создания всех колод страницы - одним запросом
         return context
 
     def get_queryset(self):
@@ -168,8 +219,7 @@ def deck_view(request, deck_id):
                 deck.save()
         else:
             # доступно сохранение колоды (т.е. создание именованного экземпляра той же колоды)
-            deck_to_save = Deck.create_from_deckstring(request.POST['string_to_save'], named=True)
-            deck_to_save.author = request.user.author
+            deck_to_save = Deck.create_from_deckstring(request.POST['string_to_save'], author=request.user.author)
             deck_to_save.name = request.POST['deck_name']
             deck_to_save.save()
             return redirect(deck_to_save)
@@ -177,7 +227,7 @@ def deck_view(request, deck_id):
     context = {'title': deck,
                'deck': deck,
                'deck_save_form': deck_save_form,
-               'similar': find_similar_decks(deck)}
+               'similar': load_craft_costs(get_similar_decks(deck))}
 
     return render(request, template_name='decks/deck_detail.html', context=context)
 
@@ -1,4 +1,5 @@
 from django.contrib import admin
+from django.db.models import Q
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from modeltranslation.admin import TranslationAdmin
@@ -71,6 +72,14 @@ class RealCardAdmin(TranslationAdmin):
     search_fields = ('name', 'card_set__name', 'text')
     save_on_top = True
 
+    def get_search_results(self, request, queryset, search_term):
+        """ Поиск по названию и тексту - через полнотекстовый индекс, по названию набора - как обычно """
+        if not search_term:
+            return queryset, False
+        by_set = queryset.filter(card_set__name__icontains=search_term).values('pk')
+        by_text = queryset.search(search_term).values('pk')
+        return queryset.filter(Q(pk__in=by_set) | Q(pk__in=by_text)), False
+
 
 @admin.register(CardClass)
 class CardClassAdmin(TranslationAdmin):
@@ -1,7 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class GalleryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'gallery'
     verbose_name = 'Card gallery'
+
+    def ready(self):
+        # поисковый индекс карт - не модель: создается после миграций (и при создании тестовой БД)
+        from core.services.card_search import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
@@ -1,7 +1,8 @@
 from django import forms
 from django.utils.translation import gettext_lazy as _
-from .models import RealCard, FanCard, CardClass, Tribe, CardSet, Mechanic
+from .models import RealCard, FanCard
 from core.mixins import EditCardMixin
+from core.services.reference import ReferenceChoiceField
 
 
 # (!) Заморожено
@@ -27,29 +28,29 @@ class UpdateCardForm(EditCardMixin, forms.ModelForm):
 class RealCardFilterForm(forms.Form):
     """ Форма фильтрации и поиска карт Hearthstone """
     name = forms.CharField(required=False, label=_('Name'))
+    text = forms.CharField(required=False, label=_('Text'))
 
     RARITIES = RealCard.Rarities.choices
     rarity = forms.ChoiceField(choices=RARITIES, required=False, label=_('Rarity'))
 
     collectible = forms.NullBooleanField(required=False, label=_('Collectible'))
 
-    MECHANICS = Mechanic.objects.filter(hidden=False)
-    mechanic = forms.ModelChoiceField(queryset=MECHANICS, required=False, label=_('Mechanics'))
+    # варианты справочных полей и их разметка - из справочника в памяти (core.services.reference)
+    mechanic = ReferenceChoiceField('mechanics', required=False, label=_('Mechanics'))
 
     CARD_TYPES = RealCard.CardTypes.choices
     card_type = forms.ChoiceField(choices=CARD_TYPES, required=False, label=_('Type'))
 
-    TRIBES = Tribe.objects.all()
-    tribe = forms.ModelChoiceField(queryset=TRIBES, required=False, label=_('Tribe'))
+    tribe = ReferenceChoiceField('tribes', required=False, label=_('Tribe'))
 
-    CARD_CLASSES = CardClass.objects.all()
-    card_class = forms.ModelChoiceField(queryset=CARD_CLASSES, required=False, label=_('Class'))
+    card_class = ReferenceChoiceField('card_classes', required=False, label=_('Class'))
 
-    CARD_SETS = CardSet.objects.all()
-    card_set = forms.ModelChoiceField(queryset=CARD_SETS, required=False, label=_('Set'))
+    card_set = ReferenceChoiceField('card_sets', required=False, label=_('Set'))
 
     # update() в данном случае лаконичнее, чем |
-    name.widget.attrs.update({'class': 'form-input', 'placeholder': _('Enter card name')})
+    name.widget.attrs.update({'class': 'form-input', 'placeholder': _('Enter card name'),
+                              'list': 'cardSuggestions', 'autocomplete': 'off'})
+    text.widget.attrs.update({'class': 'form-input', 'placeholder': _('Enter card text')})
     rarity.widget.attrs.update({'class': 'form-input'})
     collectible.widget.attrs.update({'class': 'form-input'})
     card_type.widget.attrs.update({'class': 'form-input'})
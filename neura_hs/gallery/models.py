@@ -1,9 +1,14 @@
-from django.db import models
-from django.db.models import Model, Manager, QuerySet, Q, Count
-from django.db.models.signals import post_save
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Model, Manager, QuerySet, Q, Count, F
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.urls import reverse
-from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _, override
 from django.core.validators import MinValueValidator
 from django.contrib.auth.models import User
 
@@ -23,11 +28,10 @@ class CardQuerySet(QuerySet):
         return self.filter(card_type=type_)
 
     def search_by_tribe(self, tribe):
-        try:
-            supertribe = Tribe.objects.get(service_name='All')
+        from core.services.reference import get_reference_data  # импорт здесь во избежание перекрестного импорта
+        if supertribe := get_reference_data().tribe('All'):
             return self.filter(Q(tribe=tribe) | Q(tribe=supertribe))
-        except Tribe.DoesNotExist:
-            return self.filter(tribe=tribe)
+        return self.filter(tribe=tribe)
 
     def search_by_class(self, class_):
         return self.filter(card_class=class_)
@@ -42,6 +46,40 @@ class CardQuerySet(QuerySet):
         return self.filter(state=True)
 
 
+class RealCardQuerySet(CardQuerySet):
+    """ Поиск по названию и тексту существующих карт - через полнотекстовый индекс (core.services.card_search) """
+
+    def search_by_name(self, name):
+        from core.services.card_search import search_cards  # импорт здесь во избежание перекрестного импорта
+        return search_cards(self, name, column='name')
+
+    def search_by_text(self, text):
+        from core.services.card_search import search_cards
+        return search_cards(self, text, column='body')
+
+    def search(self, query):
+        from core.services.card_search import search_cards
+        return search_cards(self, query)
+
+    def refresh_presentation(self) -> int:
+        """ Пересчитывает сохраненные поля отображения карт набора; возвращает число карт """
+        cards = list(self.order_by().prefetch_related('card_class'))
+        for card in cards:
+            card.set_presentation_fields()
+        self.model.objects.bulk_update(cards, RealCard.presentation_fields(), batch_size=500)
+        return len(cards)
+
+
+def card_class_style(service_names: list[str]) -> str:
+    """ CSS-классы оформления области карты по служебным названиям ее Hearthstone-классов """
+    names = [''.join(name.lower().split()) for name in service_names]
+    if not names:
+        return 'neutral'
+    if len(names) == 1:
+        return names[0]
+    return 'multiclass ' + '-'.join(names)
+
+
 class IncludibleCardManager(Manager):
     """ Доступ к картам, которые можно включить в колоду """
 
@@ -249,7 +287,13 @@ class RealCard(Card):
     thumbnail = models.ImageField(verbose_name=_('Thumbnail'), help_text=_('Card thumbnail to display in the deck'),
                                   upload_to='cards/thumbnails/', default='cards/defaults/default_thumbnail.png')
 
-    objects = CardQuerySet.as_manager()
+    # Поля отображения: вычисляются при сохранении карты и изменении ее классов (шаблоны не обращаются к связям)
+    css_class = models.CharField(max_length=255, blank=True, default='', editable=False)
+    page_url = models.CharField(max_length=255, blank=True, default='', editable=False)
+    render_url = models.CharField(max_length=255, blank=True, default='', editable=False)
+    thumbnail_url = models.CharField(max_length=255, blank=True, default='', editable=False)
+
+    objects = RealCardQuerySet.as_manager()
     includibles = IncludibleCardManager()
 
     class Meta(Card.Meta):
@@ -263,7 +307,100 @@ class RealCard(Card):
 
     def get_absolute_url(self):
         """ Возвращает URL для доступа к подробной странице карты """
-        return reverse('gallery:real_card', kwargs={'card_slug': self.slug})
+        return self.page_url or reverse('gallery:real_card', kwargs={'card_slug': self.slug})
+
+    def save(self, *args, **kwargs):
+        self.set_presentation_urls()
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def presentation_fields() -> list[str]:
+        """ Столбцы полей отображения (URL страницы и рендера - для каждого языка сайта) """
+        languages = [code for code, name in settings.LANGUAGES]
+        return ['css_class', 'thumbnail_url',
+                *[f'{field}_{language}' for field in ('page_url', 'render_url') for language in languages]]
+
+    def set_presentation_urls(self) -> None:
+        """
+        URL подробной страницы и рендера карты на каждом языке, URL миниатюры.
+        Новая карта при обновлении БД сохраняется до заполнения slug: URL страницы - при следующем сохранении
+        """
+        for language in [code for code, name in settings.LANGUAGES]:
+            with override(language):
+                page_url = reverse('gallery:real_card', kwargs={'card_slug': self.slug}) if self.slug else ''
+                setattr(self, f'page_url_{language}', page_url)
+            setattr(self, f'render_url_{language}', getattr(self, f'image_{language}', self.image_en).url)
+        self.thumbnail_url = self.thumbnail.url
+
+    def set_presentation_fields(self) -> None:
+        """ Все поля отображения, включая стиль класса (нужны классы карты - лучше с prefetch_related) """
+        self.css_class = card_class_style([cls.service_name for cls in self.card_class.all()])
+        self.set_presentation_urls()
+
+
+@receiver([post_save, post_delete], sender=CardClass)
+@receiver([post_save, post_delete], sender=Tribe)
+@receiver([post_save, post_delete], sender=CardSet)
+@receiver([post_save, post_delete], sender=Mechanic)
+def bump_reference_version_signal(sender, **kwargs):
+    """ Изменение справочных записей (напр., через админ-панель) обновляет справочник во всех процессах """
+    from core.services.reference import bump_reference_version  # импорт здесь во избежание перекрестного импорта
+    bump_reference_version()
+
+
+@receiver(post_save, sender=RealCard)
+@receiver(post_delete, sender=RealCard)
+def sync_search_index_signal(sender, instance, **kwargs):
+    """ Изменение карты обновляет ее запись в поисковом индексе и сбрасывает индексы карт этого процесса """
+    from core.services.card_search import sync_cards  # импорт здесь во избежание перекрестного импорта
+    sync_cards([instance.pk], deleted=kwargs['signal'] is post_delete)
+    reset_card_indexes_signal(sender)
+
+
+@receiver([post_save, post_delete], sender=RealCard)
+@receiver(m2m_changed, sender=RealCard.card_class.through)
+@receiver(m2m_changed, sender=RealCard.tribe.through)
+@receiver(m2m_changed, sender=RealCard.mechanic.through)
+def touch_catalog_signal(sender, action: Optional[str] = None, **kwargs):
+    """ Изменение карты меняет версию каталога; при обновлении БД версия меняется один раз, по его завершении """
+    from core.services.card_search import is_sync_deferred  # импорт здесь во избежание перекрестного импорта
+    if action in (None, 'post_add', 'post_remove', 'post_clear') and not is_sync_deferred():
+        HearthstoneState.touch_catalog()
+
+
+@receiver(m2m_changed, sender=RealCard.card_class.through)
+def refresh_card_style_signal(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Изменение классов карты (напр., в админ-панели) пересчитывает ее поля отображения;
+    обновление БД пересчитывает их один раз, для всех карт
+    """
+    from core.services.card_search import is_sync_deferred  # импорт здесь во избежание перекрестного импорта
+    if is_sync_deferred():
+        return
+    if action == 'pre_clear' and reverse:
+        # очистка со стороны класса: после нее связанные карты уже не найти
+        instance._cleared_card_pks = list(instance.realcard_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        cards = RealCard.objects.filter(pk=instance.pk)
+    elif pk_set is not None:
+        cards = RealCard.objects.filter(pk__in=pk_set)
+    else:
+        cards = RealCard.objects.filter(pk__in=instance.__dict__.pop('_cleared_card_pks', []))
+    cards.refresh_presentation()
+
+
+@receiver(m2m_changed, sender=RealCard.card_class.through)
+@receiver(m2m_changed, sender=RealCard.tribe.through)
+@receiver(m2m_changed, sender=RealCard.mechanic.through)
+def reset_card_indexes_signal(sender, **kwargs):
+    """ Сбрасывает индекс подсказок и поколоночный снимок карт этого процесса """
+    from core.services.typeahead import reset_name_index
+    from core.services.card_columns import reset_card_columns
+    reset_name_index()
+    reset_card_columns()
 
 
 # (!) Заморожено
@@ -316,3 +453,40 @@ class HearthstoneState(SingletonModel):
     last_updated = models.DateTimeField(auto_now=True, verbose_name=_('Last update time'))
     success = models.BooleanField(default=True, verbose_name=_('Updated successfully'),
                                   help_text=_('Whether the last update was successful'))
+    catalog_version = models.PositiveIntegerField(default=0, verbose_name=_('Catalog version'),
+                                                  help_text=_('Incremented after every successful card database update'))
+
+    CATALOG_VERSION_KEY = 'catalog_version'
+
+    @classmethod
+    def get_catalog_version(cls) -> tuple:
+        """ Версия каталога карт и время ее установки (из кэша; из БД - только при промахе) """
+        if (version := cache.get(cls.CATALOG_VERSION_KEY)) is None:
+            state = cls.load()
+            version = (state.catalog_version, state.last_updated)
+            cache.set(cls.CATALOG_VERSION_KEY, version, timeout=None)
+        return version
+
+    @classmethod
+    def bump_catalog_version(cls):
+        """ Отмечает успешное обновление каталога; кэш обновляется после фиксации транзакции """
+        state = cls.load()
+        state.catalog_version += 1
+        state.success = True
+        state.save()
+        version = (state.catalog_version, state.last_updated)
+        transaction.on_commit(lambda: cache.set(cls.CATALOG_VERSION_KEY, version, timeout=None))
+        return state
+
+    @classmethod
+    def touch_catalog(cls):
+        """
+        Отмечает изменение карт вне обновления БД (напр., через админ-панель): новая версия каталога
+        меняет ETag ответов API и сбрасывает кэши, зависящие от версии, во всех процессах
+        """
+        cls.load()
+        cls.objects.filter(pk=1).update(catalog_version=F('catalog_version') + 1, last_updated=timezone.now())
+        state = cls.objects.get(pk=1)
+        version = (state.catalog_version, state.last_updated)
+        transaction.on_commit(lambda: cache.set(cls.CATALOG_VERSION_KEY, version, timeout=None))
+        return state
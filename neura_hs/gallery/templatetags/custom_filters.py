@@ -1,10 +1,13 @@
 from django import template
+from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _, to_locale, get_language
 from collections import namedtuple
-from ..models import Card, FanCard, RealCard
+from ..models import Card, FanCard, RealCard, card_class_style
 
 register = template.Library()
 Parameter = namedtuple('Parameter', ['name', 'icon', 'value'])
+# заглушка рендера карты (256x388, как у рендеров) до загрузки подсказки
+PREVIEW_PLACEHOLDER = "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='256' height='388'/%3E"
 
 
 @register.filter
@@ -38,13 +41,9 @@ def get_display_type(fieldname):
 @register.filter(name='cclass')
 def get_cardclass_style(card):
     """ Возвращает стили оформления области соответствующего Hearthstone-класса """
-    if card.card_class.count() == 0:
-        return 'neutral'
-    if card.card_class.count() == 1:
-        return ''.join(card.card_class.all()[0].service_name.lower().split())
-    else:
-        lst = [''.join(cls.service_name.lower().split()) for cls in card.card_class.all()]
-        return 'multiclass ' + '-'.join(lst)
+    if isinstance(card, RealCard) and card.css_class:
+        return card.css_class
+    return card_class_style([cls.service_name for cls in card.card_class.all()])
 
 
 @register.filter(name='dclass')
@@ -131,7 +130,22 @@ def get_short_class_name(deck):
 
 @register.filter(name='locrender')
 def get_localized_render(card: RealCard):
+    """ URL рендера карты на текущем языке (сохраненный в карте) """
+    if card.render_url:
+        return card.render_url
     lang = to_locale(get_language())
     matches = {'en': card.image_en.url,
                'ru': card.image_ru.url}
     return matches.get(lang, card.image_en.url)
+
+
+@register.filter(name='thumb')
+def get_thumbnail(card: RealCard):
+    """ URL миниатюры карты (сохраненный в карте) """
+    return card.thumbnail_url or card.thumbnail.url
+
+
+@register.simple_tag(name='card_preview')
+def get_card_preview_attrs(card: RealCard):
+    """ Атрибуты <img> подсказки с рендером карты: заглушка, рендер загружается скриптом при наведении """
+    return format_html('src="{}" data-preview="{}" alt="{}"', PREVIEW_PLACEHOLDER, get_localized_render(card), card.name)
@@ -1,6 +1,7 @@
 # Для качественной пагинации при большом числе страниц
 
 from django import template
+from django.utils.http import urlencode
 
 register = template.Library()
 
@@ -25,8 +26,17 @@ def page_formatter(context, adjacent_pages: int = 3):
         last_adj_page = paginator.num_pages + 1
     adjacent_pages = [n for n in range(first_adj_page, last_adj_page) if n <= paginator.num_pages]
 
+    # Ссылки на страницы сохраняют предыдущий GET-запрос; при постраничном выводе по ключу - с курсором
+    params = [(key, value) for key, value in context['request'].GET.items()
+              if key not in ('page', 'cursor') and value != '']
+    page_urls = {}
+    for number in {1, paginator.num_pages, *adjacent_pages, page.number - 1, page.number + 1}:
+        cursor = paginator.encode_cursor(page, number) if hasattr(paginator, 'encode_cursor') else None
+        page_urls[number] = '?' + urlencode(params + [('page', number)] + ([('cursor', cursor)] if cursor else []))
+
     context.update({'adjacent_pages': adjacent_pages,
                     'show_first': 1 not in adjacent_pages,  # флаг: показывать ли первую страницу отдельно
-                    'show_last': paginator.num_pages not in adjacent_pages})
+                    'show_last': paginator.num_pages not in adjacent_pages,
+                    'page_urls': page_urls})
 
     return context
@@ -4,7 +4,7 @@ from .models import RealCard, FanCard, CardClass, Tribe, CardSet, Mechanic
 
 @register(RealCard)
 class RealCardTranslationOptions(TranslationOptions):
-    fields = ('name', 'text', 'flavor')
+    fields = ('name', 'text', 'flavor', 'page_url', 'render_url')
 
 
 @register(CardClass)
@@ -5,6 +5,7 @@ app_name = 'gallery'    # пространство имен urlpatterns
 
 urlpatterns = [
     path('cards/', views.RealCardListView.as_view(), name='realcards'),
+    path('cards/suggest/', views.get_card_suggestions, name='card_suggestions'),
     path('card/<slug:card_slug>', views.RealCardDetailView.as_view(), name='real_card'),
 ]
 
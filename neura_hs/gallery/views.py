@@ -1,4 +1,5 @@
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import HttpRequest, JsonResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy
 from django.views import generic
@@ -7,6 +8,8 @@ from .models import RealCard, FanCard, Author
 from .forms import CreateCardForm, RealCardFilterForm, UpdateCardForm, \
     FanCardFilterForm
 from core.mixins import DataMixin
+from core.services.typeahead import suggest_cards
+from core.services.card_columns import get_card_columns, label_facets, CardPages
 import logging
 
 logger = logging.getLogger('django')
@@ -115,6 +118,7 @@ class RealCardListView(DataMixin, generic.ListView):
         context = super().get_context_data(**kwargs)
 
         prev_values = {'name': self.request.GET.get('name', ''),
+                       'text': self.request.GET.get('text', ''),
                        'rarity': self.request.GET.get('rarity', ''),
                        'collectible': self.request.GET.get('collectible', ''),
                        'card_type': self.request.GET.get('card_type', ''),
@@ -123,46 +127,59 @@ class RealCardListView(DataMixin, generic.ListView):
                        'card_set': self.request.GET.get('card_set', ''),
                        'mechanic': self.request.GET.get('mechanic')}
         default_context = self.get_custom_context(title=_('Hearthstone cards'),
-                                                  form=RealCardFilterForm(initial=prev_values))
+                                                  form=RealCardFilterForm(initial=prev_values),
+                                                  facets=label_facets(self.facets))
         context |= default_context
         return context
 
     def get_queryset(self):
-        """ Реализация динамического поиска по картам """
+        """
+        Реализация динамического поиска по картам: отбор - по снимку каталога в памяти (core.services.card_columns),
+        из БД загружаются только карты текущей страницы
+        """
         name = self.request.GET.get('name')
-        rarity = self.request.GET.get('rarity')
+        text = self.request.GET.get('text')
         collectible_raw = self.request.GET.get('collectible', 'unknown')
         collectible = {'unknown': None,
                        'true': True,
                        'false': False}.get(collectible_raw)
-        card_type = self.request.GET.get('card_type')
-        tribe = self.request.GET.get('tribe')
-        card_class = self.request.GET.get('card_class')
-        card_set = self.request.GET.get('card_set')
-        mechanic = self.request.GET.get('mechanic')
 
-        # Оптимизация: вместо множества SQL-запросов - один сложный
-        object_list = self.model.objects.prefetch_related('card_set', 'tribe', 'card_class', 'mechanic')
-
-        if name:
-            object_list = object_list.search_by_name(name)
-        if rarity:
-            object_list = object_list.search_by_rarity(rarity)
-        if collectible is not None:
-            object_list = object_list.search_collectible(collectible)
-        if card_type:
-            object_list = object_list.search_by_type(card_type)
-            if card_type == 'H' and collectible:
-                object_list = object_list.exclude(card_set__service_name='Hero Skins')
-        if tribe:
-            object_list = object_list.search_by_tribe(tribe)
-        if card_class:
-            object_list = object_list.search_by_class(card_class)
-        if card_set:
-            object_list = object_list.search_by_set(card_set)
-        if mechanic:
-            object_list = object_list.search_by_mechanic(mechanic)
-        return object_list
+        # полнотекстовый поиск - в индексе БД, его результат (в порядке релевантности) сужает отбор
+        found = None
+        if name or text:
+            matches = self.model.objects.all()
+            if name:
+                matches = matches.search_by_name(name)
+            if text:
+                matches = matches.search_by_text(text)
+            found = list(matches.values_list('pk', flat=True))
+
+        selection = get_card_columns().select(
+            rarity=self.request.GET.get('rarity'),
+            collectible=collectible,
+            card_type=self.request.GET.get('card_type'),
+            tribe=_get_pk(self.request, 'tribe'),
+            card_class=_get_pk(self.request, 'card_class'),
+            card_set=_get_pk(self.request, 'card_set'),
+            mechanic=_get_pk(self.request, 'mechanic'),
+            within=found,
+        )
+        self.facets = selection.facets()
+        ids = selection.ordered(found) if found is not None else selection.ids
+        # Оптимизация: вместо множества SQL-запросов - один сложный (только для карт страницы)
+        return CardPages(ids, self.model.objects.prefetch_related('card_set', 'tribe', 'card_class', 'mechanic'))
+
+
+def _get_pk(request: HttpRequest, param: str):
+    """ pk из параметра запроса (некорректное значение - как отсутствие фильтра) """
+    value = request.GET.get(param, '')
+    return int(value) if value.isdigit() else None
+
+
+def get_card_suggestions(request: HttpRequest):
+    """ AJAX-view подсказок названий карт для поля поиска """
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({'suggestions': suggest_cards(query) if query else []})
 
 
 class RealCardDetailView(DataMixin, generic.DetailView):
@@ -123,6 +123,9 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
 
+# Снимки каталога карт для API (пишутся после update_db)
+CATALOG_EXPORT_ROOT = MEDIA_ROOT / 'catalog'
+
 # Выбор в админ-панели множества записей
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000
 
@@ -218,6 +221,19 @@ LOGGING = {
 # --------------------------------------------- НАСТРОЙКИ ПРОЕКТА --------------------------------------------------- #
 
 DECK_RENDER_MAX_NUMBER = 10     # максимальное число сохраненных рендеров колод
+DECK_CARDS_CACHE_TIMEOUT = 60 * 60 * 24     # время хранения разметки списков карт колод (с)
+LIST_COUNT_CACHE_TIMEOUT = 60               # время хранения числа записей постраничных списков (с)
+STATISTICS_CACHE_TIMEOUT = 60 * 10          # время хранения отрисованной статистики (с)
+
+# Расшифрованные (не сохраненные) колоды: доля, попадающая в БД (для статистики), и размер транзакции записи
+# (очередь сохраняется командой save_decoded_decks)
+DECODED_DECKS_SAMPLE_RATE = 1.0
+DECODED_DECKS_BATCH_SIZE = 20
+
+# Асинхронные варианты представлений (только под ASGI; NHS_ASYNC_VIEWS=1 - по умолчанию выключены:
+# в бенчмарке asgi_views они не быстрее синхронных) и число процессов для рендеров колод
+ASYNC_VIEWS = os.environ.get('NHS_ASYNC_VIEWS') == '1'
+CPU_WORKERS = 2
 
 # API Hearthstone
 HSAPI_BASEURL = 'https://omgvamp-hearthstone-v1.p.rapidapi.com/'
@@ -0,0 +1,10 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture
+def locmem_cache(settings):
+    """ Кэш в памяти процесса вместо файлового кэша сайта; очищается перед тестом """
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+    cache.clear()
+    return cache
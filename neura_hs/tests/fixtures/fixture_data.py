@@ -1,5 +1,6 @@
 import pytest
 from gallery.models import CardClass, CardSet, Tribe, RealCard, FanCard
+from decks.models import Format
 from slugify import slugify
 import time
 
@@ -146,3 +147,27 @@ def deck_data():
         [57761],
         2
     )
+
+
+@pytest.fixture
+def deck_catalog(db, card_class, card_set, deck_data):
+    """ Карты и форматы, необходимые для расшифровки колод deckstring """
+    cards, heroes, format_ = deck_data
+    priest = CardClass.objects.get_or_create(**card_class(name='Priest'))[0]
+    base_set = CardSet.objects.get_or_create(**card_set(name='Core'))[0]
+    for dbf_id in heroes + [dbf_id for dbf_id, _ in cards]:
+        card = RealCard.objects.create(
+            name=f'Card {dbf_id}',
+            slug=f'card-{dbf_id}',
+            card_type=RealCard.CardTypes.HERO if dbf_id in heroes else RealCard.CardTypes.SPELL,
+            cost=dbf_id % 10,
+            rarity=RealCard.Rarities.COMMON,
+            card_set=base_set,
+            card_id=f'TEST_{dbf_id}',
+            dbf_id=dbf_id,
+            collectible=True,
+        )
+        card.card_class.add(priest)
+    for num, name in enumerate(('Unknown', 'Wild', 'Standard', 'Classic')):
+        Format.objects.create(name=name, numerical_designation=num)
+    return deck_data
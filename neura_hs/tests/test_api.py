@@ -1,5 +1,21 @@
+import gzip
+import json
+from datetime import timedelta
 import pytest
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+from django.utils import translation
+from django.utils.timezone import now
 from rest_framework import status
+from api.serializers import RealCardListSerializer, DeckSerializer
+from api.services.export import write_catalog_snapshots, negotiate_encoding
+from api.services.fast_serialization import values_queryset, card_values, serialize_cards
+from api.services.streaming import stream_json_list
+from api.views import ViewDeckAPIView, RealCardViewSet
+from core.services.concurrency import async_view, run_cpu
+from core.services.deck_codes import build_deckstring
+from gallery.models import RealCard, CardClass, HearthstoneState
+from decks.models import Deck, DailyDeckCount, DailyCardCount
 
 
 class TestCardsAPI:
@@ -17,12 +33,312 @@ class TestCardsAPI:
                   'classes': 'Rogue,Mage,Druid,Hunter'}
         response = api_client.get('/api/v1/cards/', data=params)
         assert response.status_code == status.HTTP_200_OK
-        assert len(response.data) == 3
-        assert all(card['card_class'][0] == 'Rogue' for card in response.data)
-        assert any(card['dbf_id'] == 123456 for card in response.data)
+        assert len(response.data['results']) == 3
+        assert all(card['card_class'][0] == 'Rogue' for card in response.data['results'])
+        assert any(card['dbf_id'] == 123456 for card in response.data['results'])
+
+    @pytest.mark.django_db
+    def test_card_list_api_pagination(self, api_client, real_card):
+        for dbf_id in (5, 3, 4, 1, 2):
+            real_card(f'Card {dbf_id}', f'TEST{dbf_id}', dbf_id)
+        RealCard.objects.filter(dbf_id=4).update(collectible=False)
+
+        response = api_client.get('/api/v1/cards/', data={'page_size': 2})
+        assert [card['dbf_id'] for card in response.data['results']] == [1, 2]
+        response = api_client.get(response.data['next'])
+        assert [card['dbf_id'] for card in response.data['results']] == [3, 5]
+        assert response.data['next'] is None
+
+        response = api_client.get('/api/v1/cards/all/', data={'rarity': 'E'})
+        assert response.status_code == status.HTTP_200_OK
+        streamed = json.loads(b''.join(response.streaming_content))
+        assert [card['dbf_id'] for card in streamed] == [1, 2, 3, 5]
+        chunks = list(stream_json_list(RealCard.objects.filter(collectible=True), RealCardListSerializer, chunk_size=3))
+        assert len(chunks) == 4 and json.loads(b''.join(chunks)) == streamed
+        assert api_client.get('/api/v1/cards/4/').status_code == status.HTTP_200_OK
 
     @pytest.mark.django_db
     def test_get_single_card_api(self, api_client, real_card):
         real_card('Yet another card', 'TEST001', 19283746)
         response = api_client.get('/api/v1/cards/19283746/')
         assert response.status_code == status.HTTP_200_OK
+
+
+    @pytest.mark.django_db
+    def test_catalog_export_api(self, api_client, real_card, settings, tmp_path, locmem_cache):
+        settings.CATALOG_EXPORT_ROOT = tmp_path
+        assert api_client.get('/api/v1/cards/export/').status_code == status.HTTP_404_NOT_FOUND
+
+        real_card('Some test card', 'TEST01', 123456)
+        real_card('Another test card', 'TEST02', 135790)
+        write_catalog_snapshots()
+
+        response = api_client.get('/api/v1/cards/export/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in response['Vary']
+        data = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        assert [card['dbf_id'] for card in data['cards']] == [123456, 135790]
+        assert data['cards'][0]['card_class'] == ['Rogue'] and data['language'] == 'en'
+
+        with translation.override('en'):   # LocaleMiddleware оставляет язык запроса активным
+            response = api_client.get('/api/v1/cards/export/', HTTP_ACCEPT_ENCODING='identity',
+                                      HTTP_ACCEPT_LANGUAGE='ru')
+            assert not response.has_header('Content-Encoding')
+            assert json.loads(b''.join(response.streaming_content))['language'] == 'ru'
+            response = api_client.get('/api/v1/cards/export/', HTTP_ACCEPT_ENCODING='identity',
+                                      HTTP_ACCEPT_LANGUAGE='ru', HTTP_IF_NONE_MATCH=response['ETag'])
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        assert negotiate_encoding('gzip;q=0, *;q=0.5') in ('br', None)
+        assert negotiate_encoding('') is None
+
+
+    @pytest.mark.django_db
+    def test_card_batch_api(self, api_client, real_card, django_assert_num_queries):
+        for dbf_id in (1, 2, 3):
+            real_card(f'Card {dbf_id}', f'TEST{dbf_id}', dbf_id)
+
+        api_client.get('/api/v1/cards/batch/', data={'dbf_ids': '1'})      # версия каталога - в кэше
+        with django_assert_num_queries(3):      # карты с набором, классы, расы
+            response = api_client.get('/api/v1/cards/batch/', data={'dbf_ids': '3,99,1,3'})
+        assert response.status_code == status.HTTP_200_OK
+        assert [card and card['dbf_id'] for card in response.data['results']] == [3, None, 1, 3]
+        assert response.data['not_found'] == [99]
+        assert response.data['results'][0]['card_class'] == ['Rogue']
+
+        response = api_client.get('/api/v1/cards/batch/', data={'dbf_ids': '2', 'fields': 'dbf_id,name'})
+        assert response.data['results'] == [{'dbf_id': 2, 'name': 'Card 2'}]
+        with django_assert_num_queries(1):      # dbf_id загружается и без него в ?fields=
+            response = api_client.get('/api/v1/cards/batch/', data={'dbf_ids': '1,2,3', 'fields': 'name'})
+        assert response.data['results'] == [{'name': f'Card {dbf_id}'} for dbf_id in (1, 2, 3)]
+        for invalid in ('', '1,x', ','.join(['1'] * 1001)):
+            response = api_client.get('/api/v1/cards/batch/', data={'dbf_ids': invalid})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestDecksAPI:
+    @pytest.mark.django_db
+    def test_get_trends_api(self, api_client, deck_catalog):
+        cards, heroes, format_ = deck_catalog
+        Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+        old = Deck.create_from_deckstring(build_deckstring(cards[1:], heroes, format_))
+        assert DailyDeckCount.objects.get().num_decks == 2
+        assert DailyCardCount.objects.get(card__dbf_id=cards[1][0]).num_decks == 2
+        Deck.objects.filter(pk=old.pk).update(created=now() - timedelta(days=10))
+        DailyDeckCount.objects.rebuild()
+        assert DailyCardCount.objects.filter(card__dbf_id=cards[0][0]).count() == 1
+
+        response = api_client.get('/api/v1/trends/', data={'days': 7, 'dformat': 'Standard'})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['num_decks'] == 1
+        assert response.data['classes'][0] == {'deck_class': 'Priest', 'num_decks': 1, 'previous': 1, 'share': 1.0}
+        assert {card['dbf_id'] for card in response.data['cards']} <= {dbf_id for dbf_id, count in cards}
+
+        response = api_client.get('/api/v1/trends/', data={'days': 30})
+        assert response.data['num_decks'] == 2
+        assert api_client.get('/api/v1/trends/', data={'days': 5}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+    @pytest.mark.django_db
+    def test_filter_decks_by_cards(self, api_client, deck_catalog):
+        cards, heroes, format_ = deck_catalog
+        full = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+        without_first = Deck.create_from_deckstring(build_deckstring(cards[1:], heroes, format_))
+        single_copy = Deck.create_from_deckstring(build_deckstring(cards[:6] + [(56677, 1)] + cards[7:], heroes,
+                                                                   format_))
+
+        def search(**params):
+            response = api_client.get('/api/v1/decks/', data=params)
+            assert response.status_code == status.HTTP_200_OK
+            return {deck['id'] for deck in response.data}
+
+        assert search(cards='59253') == {full.pk, single_copy.pk}
+        assert search(cards='59253,56677') == {full.pk, single_copy.pk}
+        assert search(cards='59253,56677:2') == {full.pk}
+        assert search(cards='59253,56677:2,99999', cards_match='all') == set()
+        assert search(cards='56677:2,99999', cards_match='any') == {full.pk, without_first.pk}
+        assert search(cards='59253', cards_match='none') == {without_first.pk}
+        assert search(cards='56677:2', cards_match='none', dformat='Standard') == {single_copy.pk}
+        assert search(cards_match='none') == {full.pk, without_first.pk, single_copy.pk}
+        for invalid in ('abc', '59253:0', '59253:x'):
+            response = api_client.get('/api/v1/decks/', data={'cards': invalid})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+    @pytest.mark.django_db(transaction=True)
+    def test_async_views(self, deck_catalog, deckstring, settings, locmem_cache):
+        decode = async_view(ViewDeckAPIView.as_view())
+        response = async_to_sync(decode)(RequestFactory().post('/api/v1/decode_deck/', {'d': deckstring}))
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.render().data['cards']) == len(deck_catalog[0])
+
+        retrieve = async_view(RealCardViewSet.as_view({'get': 'retrieve'}))
+        response = async_to_sync(retrieve)(RequestFactory().get('/api/v1/cards/57761/'), dbf_id=57761)
+        assert json.loads(response.render().content)['dbf_id'] == 57761
+
+        assert async_to_sync(run_cpu)(sum, [1, 2, 3]) == 6      # пул процессов
+        settings.CPU_WORKERS = 0
+        assert async_to_sync(run_cpu)(sum, [1, 2]) == 3         # без пула процессов - в пуле потоков
+
+
+class TestQueryCounts:
+    """ Число запросов не зависит от числа объектов в ответе """
+
+    @pytest.fixture
+    def cards(self, real_card):
+        return [real_card(f'Card {dbf_id}', f'TEST{dbf_id}', dbf_id) for dbf_id in range(1, 6)]
+
+    @pytest.fixture
+    def decks(self, deck_catalog):
+        cards, heroes, format_ = deck_catalog
+        return [Deck.create_from_deckstring(build_deckstring(cards[i:], heroes, format_)) for i in range(3)]
+
+    @pytest.mark.django_db
+    def test_card_list_queries(self, api_client, cards, django_assert_num_queries):
+        with django_assert_num_queries(2):      # карты с набором, классы
+            response = api_client.get('/api/v1/cards/')
+        assert len(response.data['results']) == 5
+
+    @pytest.mark.django_db
+    def test_card_list_sparse_fields(self, api_client, cards, django_assert_num_queries):
+        with django_assert_num_queries(1):
+            response = api_client.get('/api/v1/cards/', data={'fields': 'dbf_id,name,rarity'})
+        assert response.data['results'][0] == {'dbf_id': 1, 'name': 'Card 1', 'rarity': 'Epic'}
+        for url in ('/api/v1/cards/', '/api/v1/cards/1/', '/api/v1/decks/'):
+            response = api_client.get(url, data={'fields': 'bogus'})
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert str(response.data['fields']).startswith('Unknown fields: bogus.')
+
+    @pytest.mark.django_db
+    def test_card_stream_queries(self, api_client, cards, django_assert_num_queries):
+        with django_assert_num_queries(3):      # + пустая последняя часть
+            response = api_client.get('/api/v1/cards/all/')
+            b''.join(response.streaming_content)
+
+    @pytest.mark.django_db
+    def test_card_detail_queries(self, api_client, cards, django_assert_num_queries):
+        with django_assert_num_queries(3):
+            response = api_client.get('/api/v1/cards/3/')
+        assert response.data['tribe'] == ['Beast']
+
+    @pytest.mark.django_db
+    def test_deck_list_queries(self, api_client, decks, django_assert_num_queries):
+        with django_assert_num_queries(4):      # колоды, вхождения с картами, классы и расы карт
+            response = api_client.get('/api/v1/decks/')
+        assert len(response.data) == 3
+        with django_assert_num_queries(1):
+            response = api_client.get('/api/v1/decks/', data={'fields': 'id,deck_class,string'})
+        assert set(response.data[0]) == {'id', 'deck_class', 'string'}
+
+    @pytest.mark.django_db
+    def test_deck_batch_api(self, api_client, decks, django_assert_num_queries):
+        with django_assert_num_queries(6):      # колоды, вхождения, карты, их классы, наборы и расы
+            response = api_client.get('/api/v1/decks/batch/', data={'ids': f'{decks[2].pk},0,{decks[0].pk}'})
+        assert [deck and deck['id'] for deck in response.data['results']] == [decks[2].pk, None, decks[0].pk]
+        assert response.data['not_found'] == [0]
+        assert response.data['results'][2]['cards'][0]['card']['dbf_id']
+
+    @pytest.mark.django_db
+    def test_deck_detail_queries(self, api_client, decks, django_assert_num_queries):
+        with django_assert_num_queries(13):     # колода и карты (6) + поиск похожих колод
+            response = api_client.get(f'/api/v1/decks/{decks[0].pk}/')
+        assert response.data['id'] == decks[0].pk
+
+    @pytest.mark.django_db
+    def test_decode_deck_queries(self, api_client, decks, django_assert_num_queries):
+        api_client.post('/api/v1/decode_deck/', data={'d': decks[1].string})     # построение каталога процесса
+        with django_assert_num_queries(1):      # поиск сохраненной колоды; карты - из каталога в памяти
+            response = api_client.post('/api/v1/decode_deck/', data={'d': decks[1].string})
+        assert response.data['id'] == decks[1].pk
+        assert len(response.data['cards']) == len(decks[1].get_composition())
+
+
+class TestFastSerialization:
+    """ Быстрый путь (.values()) дает тот же JSON, что и сериализаторы """
+
+    @pytest.mark.django_db
+    @pytest.mark.parametrize('language', ['en', 'ru'])
+    def test_fast_card_list(self, real_card, card_class, language):
+        for dbf_id in (3, 1, 2):
+            card = real_card(f'Card {dbf_id}', f'TEST{dbf_id}', dbf_id)
+            card.name_ru = f'Карта {dbf_id}'
+            card.spell_school = ''
+            card.save()
+        RealCard.objects.get(dbf_id=2).card_class.add(CardClass.objects.create(**card_class(name='Mage')))
+
+        fields = RealCardListSerializer.Meta.fields
+        with translation.override(language):
+            queryset = RealCard.objects.order_by('dbf_id')
+            expected = RealCardListSerializer(queryset, many=True).data
+            fast = serialize_cards(list(values_queryset(queryset, *card_values(fields))), fields)
+        assert json.dumps(fast, ensure_ascii=False) == json.dumps(expected, ensure_ascii=False)
+
+    @pytest.mark.django_db
+    def test_fast_deck_list(self, api_client, deck_catalog):
+        cards, heroes, format_ = deck_catalog
+        for i in range(3):
+            Deck.create_from_deckstring(build_deckstring(cards[i:], heroes, format_))
+
+        expected = DeckSerializer(Deck.nameless.all(), many=True).data
+        response = api_client.get('/api/v1/decks/')
+        assert json.loads(response.content) == json.loads(json.dumps(expected))
+        assert [deck['id'] for deck in response.data] == [deck['id'] for deck in expected]
+
+        # компактное представление раскрывается в то же самое
+        compact = json.loads(api_client.get('/api/v1/decks/', data={'repr': 'compact'}).content)
+        assert len(compact['cards']) == len(cards)
+        expanded = [dict(deck, cards=[{'card': compact['cards'][str(dbf_id)], 'number': number}
+                                      for dbf_id, number in deck['cards']]) for deck in compact['decks']]
+        assert expanded == json.loads(response.content)
+
+
+@pytest.mark.usefixtures('locmem_cache')
+class TestConditionalRequests:
+    @pytest.mark.django_db(transaction=True)
+    def test_catalog_etag(self, api_client, real_card, django_assert_num_queries):
+        real_card('Some test card', 'TEST01', 123456)
+        for url in ('/api/v1/cards/', '/api/v1/cards/123456/'):
+            response = api_client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+            assert 'no-cache' in response['Cache-Control'] and response.has_header('Last-Modified')
+            etag = response['ETag']
+
+            with django_assert_num_queries(0):
+                response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+            # у каждого формата ответа - свой ETag
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='text/html')
+            assert response.status_code == status.HTTP_200_OK and response['ETag'] != etag
+            assert 'Accept' in response['Vary'] and 'Accept-Language' in response['Vary']
+
+        HearthstoneState.bump_catalog_version()
+        response = api_client.get('/api/v1/cards/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+        card = RealCard.objects.get(dbf_id=123456)     # изменение карты вне обновления БД (админ-панель)
+        etag = response['ETag']
+        card.name = 'Renamed test card'
+        card.save()
+        response = api_client.get('/api/v1/cards/123456/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK and response.data['name'] == 'Renamed test card'
+        etag = response['ETag']
+        card.card_class.clear()
+        assert api_client.get('/api/v1/cards/123456/', HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+
+    @pytest.mark.django_db
+    def test_nameless_deck_cache_headers(self, api_client, deck_catalog):
+        deck = Deck.create_from_deckstring(build_deckstring(*deck_catalog))
+        response = api_client.get(f'/api/v1/decks/{deck.pk}/')
+        assert 'max-age=300' in response['Cache-Control']
+        etag = response['ETag']
+        response = api_client.get(f'/api/v1/decks/{deck.pk}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+        # новая похожая колода меняет ответ
+        cards, heroes, format_ = deck_catalog
+        Deck.create_from_deckstring(build_deckstring(cards[1:] + [(cards[0][0], 2)], heroes, format_))
+        response = api_client.get(f'/api/v1/decks/{deck.pk}/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK and response.data['similar']
+        assert not api_client.get('/api/v1/decks/999999/').has_header('Cache-Control')
@@ -1,5 +1,13 @@
 import pytest
+from django.template import Context, Template
+from django.urls import reverse_lazy
+from django.utils.translation import override
 from gallery.models import RealCard, FanCard, CardClass, Tribe, CardSet
+from gallery.forms import RealCardFilterForm
+from core.services.card_search import deferred_index_sync, is_available
+from core.services.card_columns import get_card_columns
+from core.services.reference import get_reference_data
+from core.services.typeahead import suggest_cards
 
 
 class TestCardCreation:
@@ -20,3 +28,195 @@ class TestCardCreation:
         assert FanCard.objects.filter(name='New Fan Card',
                                       card_class__name='Mage',
                                       author=user.author).exists()
+
+
+class TestCardSearch:
+    @pytest.mark.django_db
+    def test_full_text_search(self, real_card, client, api_client):
+        assert is_available()
+
+        ragnaros = real_card('Ragnaros the Firelord', 'EX1_298', 374)
+        ragnaros.name_ru = 'Рагнарос Повелитель огня'
+        ragnaros.text = 'Deal 8 damage to a random enemy'
+        ragnaros.save()
+        elemental = real_card('Fire Elemental', 'CS2_042', 189)
+        elemental.text = 'Battlecry: Summon a <b>Firelord</b> ally'
+        elemental.flavor_ru = 'Ещё один огонёк'
+        elemental.save()
+
+        # префиксы слов, нормализация регистра и ё, ранжирование: совпадение в названии - выше
+        assert list(RealCard.objects.search('firel')) == [ragnaros, elemental]
+        assert list(RealCard.objects.search_by_name('РАГНАР повел')) == [ragnaros]
+        assert list(RealCard.objects.search_by_text('еще огонек')) == [elemental]
+        assert not RealCard.objects.search_by_name('damage').exists()
+
+        # индекс следует за изменениями карт
+        ragnaros.name = 'Ragnaros'
+        ragnaros.save()
+        assert not RealCard.objects.search_by_name('firel').exists()
+        assert list(RealCard.objects.search('firel')) == [elemental]
+        elemental.delete()
+        assert not RealCard.objects.search('firel').exists()
+
+        response = client.get(reverse_lazy('gallery:realcards'), {'text': 'random ENEMY'})
+        assert [card.pk for card in response.context['realcards']] == [ragnaros.pk]
+        response = api_client.get('/api/v1/cards/', {'name': 'рагн'})
+        assert [card['dbf_id'] for card in response.data['results']] == [374]
+
+    @pytest.mark.django_db
+    def test_search_without_index(self, real_card, monkeypatch):
+        ragnaros = real_card('Ragnaros the Firelord', 'EX1_298', 374)
+        ragnaros.name_ru = 'Рагнарос Повелитель огня'
+        ragnaros.save()
+        elemental = real_card('Fire Elemental', 'CS2_042', 189)
+        elemental.flavor_ru = 'Ещё один огонёк'
+        elemental.save()
+
+        # без индекса - те же нормализованные слова запроса (регистр, ё, знаки препинания)
+        monkeypatch.setattr('core.services.card_search._available', False)
+        assert set(RealCard.objects.search('"fire"')) == {ragnaros, elemental}
+        assert list(RealCard.objects.search_by_name('РАГНАР, повел!')) == [ragnaros]
+        assert list(RealCard.objects.search_by_text('еще огонек')) == [elemental]
+        assert RealCard.objects.search('!?').count() == 2
+
+    @pytest.mark.django_db
+    def test_card_suggestions(self, real_card, client, api_client, locmem_cache):
+        ragnaros = real_card('Ragnaros the Firelord', 'EX1_298', 374)
+        ragnaros.name_ru = 'Рагнарос Повелитель огня'
+        ragnaros.save()
+        real_card('Fire Elemental', 'CS2_042', 189)
+        real_card('Ragnaros, Lightlord', 'OG_229', 38911)
+
+        assert [card['dbf_id'] for card in suggest_cards('fire')] == [189, 374]
+        assert [card['dbf_id'] for card in suggest_cards('ragnoros firelrd')][0] == 374     # опечатки
+        assert [card['name'] for card in suggest_cards('повелит')] == ['Ragnaros the Firelord']
+        assert suggest_cards('zzzz') == []
+
+        # индекс перестраивается после изменения карты
+        ragnaros.name = 'Ragnaros'
+        ragnaros.save()
+        assert [card['dbf_id'] for card in suggest_cards('fire')] == [189]
+
+        response = api_client.get('/api/v1/cards/suggest/', {'q': 'рагнар', 'limit': 1})
+        assert response.status_code == 200
+        assert [card['dbf_id'] for card in response.data] == [374]
+        assert api_client.get('/api/v1/cards/suggest/').status_code == 400
+
+        response = client.get(reverse_lazy('gallery:card_suggestions'), {'q': 'lightlord'})
+        assert [card['dbf_id'] for card in response.json()['suggestions']] == [38911]
+
+
+class TestCardColumns:
+    @pytest.mark.django_db
+    def test_columnar_filtering(self, real_card, card_class, client, api_client, django_assert_num_queries,
+                                locmem_cache):
+        mage = CardClass.objects.create(**card_class(name='Mage'))
+        cards = [real_card(f'Test Minion {i}', f'TEST_{i}', 100 + i) for i in range(4)]
+        cards[0].cost, cards[0].rarity = 9, RealCard.Rarities.LEGENDARY
+        cards[0].save()
+        cards[1].card_class.set([mage])
+        cards[3].collectible = False
+        cards[3].save()
+
+        columns = get_card_columns()
+        selection = columns.select(collectible=True)
+        assert list(selection.ids) == [cards[0].pk, cards[1].pk, cards[2].pk]     # по убыванию стоимости
+        assert selection.facets() == {
+            'rarity': {RealCard.Rarities.EPIC: 2, RealCard.Rarities.LEGENDARY: 1},
+            'card_class': {cards[0].card_class.get().pk: 2, mage.pk: 1},
+            'card_set': {cards[0].card_set_id: 3},
+        }
+        assert list(columns.select(card_class=mage.pk).ids) == [cards[1].pk]
+        assert list(columns.select(card_class=[], collectible=True).ids) == []
+        assert list(columns.select(ranges={'cost': (8, None)}).ids) == [cards[0].pk]
+        assert columns.select(within=[cards[2].pk, cards[3].pk], collectible=True).ordered([cards[2].pk]) == \
+            [cards[2].pk]
+
+        # снимок перестраивается после изменения карт; из БД - только карты страницы (со связями)
+        cards[2].card_class.add(mage)
+        params = {'card_class': mage.pk, 'collectible': 'true'}
+        client.get(reverse_lazy('gallery:realcards'), params)
+        with django_assert_num_queries(5):
+            response = client.get(reverse_lazy('gallery:realcards'), params)
+        assert [card.pk for card in response.context['realcards']] == [cards[1].pk, cards[2].pk]
+        assert response.context['facets']['card_class'] == [('Mage', 2), ('Rogue', 1)]
+
+        response = api_client.get('/api/v1/cards/', {'classes': 'Mage', 'facets': 'true'})
+        assert [card['dbf_id'] for card in response.data['results']] == [101, 102]
+        assert response.data['facets'] == {'rarity': {'Epic': 2}, 'card_class': {'Mage': 2, 'Rogue': 1},
+                                           'card_set': {'Scholomance Academy': 2}}
+
+
+class TestReferenceData:
+    @pytest.mark.django_db
+    def test_cached_choice_widgets(self, card_class, tribe, django_assert_num_queries, locmem_cache):
+        mage = CardClass.objects.create(**card_class(name='Mage'))
+        CardClass.objects.create(**card_class(name='Neutral'))
+        supertribe = Tribe.objects.create(**tribe(name='All'))
+
+        str(RealCardFilterForm()['card_class'])
+        with django_assert_num_queries(0):
+            assert get_reference_data().tribe('All') == supertribe
+            html = str(RealCardFilterForm(initial={'card_class': str(mage.pk)})['card_class'])
+        assert f'<option value="{mage.pk}" selected>Mage</option>' in html
+        assert '<option value="" selected>' not in html
+        assert '<option value="" selected>' in str(RealCardFilterForm()['card_class'])
+
+        # изменение записи (напр., в админ-панели) обновляет справочник и разметку
+        mage.name = 'Archmage'
+        mage.save()
+        assert '>Archmage</option>' in str(RealCardFilterForm()['card_class'])
+
+
+class TestCardPresentation:
+    @pytest.mark.django_db
+    def test_stored_presentation_fields(self, real_card, card_class, client, django_assert_num_queries):
+        mage = CardClass.objects.create(**card_class(name='Mage'))
+        card = real_card('Test Minion', 'TEST_01', 101)
+        card.refresh_from_db()
+        assert card.css_class == 'rogue'
+        assert card.page_url_en == '/en/gallery/card/test-minion-101'
+        assert card.page_url_ru == '/ru/gallery/card/test-minion-101'
+        assert card.render_url_ru == card.image_ru.url
+        assert card.thumbnail_url == card.thumbnail.url
+
+        # изменение классов (напр., в админ-панели) пересчитывает стиль
+        mage.realcard_set.add(card)
+        card.refresh_from_db()
+        assert card.css_class == 'multiclass mage-rogue'
+
+        # фильтры читают сохраненные поля, не обращаясь к БД
+        template = Template('{% load custom_filters %}{{ card|cclass }} {{ card|locrender }} {{ card|thumb }} '
+                            '{{ card.get_absolute_url }}')
+        with override('ru'), django_assert_num_queries(0):
+            html = template.render(Context({'card': card}))
+        assert html == f'multiclass mage-rogue {card.image_ru.url} {card.thumbnail.url} /ru/gallery/card/test-minion-101'
+
+        RealCard.objects.update(css_class='', page_url_en='')
+        assert RealCard.objects.refresh_presentation() == 1
+        assert RealCard.objects.get().css_class == 'multiclass mage-rogue'
+
+        # очистка со стороны класса пересчитывает только карты этого класса
+        other = real_card('Other Minion', 'TEST_02', 102)
+        RealCard.objects.filter(pk=other.pk).update(css_class='stale')
+        mage.realcard_set.clear()
+        assert RealCard.objects.get(pk=card.pk).css_class == 'rogue'
+        assert RealCard.objects.get(pk=other.pk).css_class == 'stale'
+
+    @pytest.mark.django_db
+    def test_new_card_in_update(self, card_class, django_assert_num_queries):
+        rogue = CardClass.objects.create(**card_class(name='Rogue'))
+        with deferred_index_sync():
+            # как в Updater: карта создается до заполнения slug
+            card, created = RealCard.objects.get_or_create(card_id='NEW_01', dbf_id=201)
+            assert created and card.page_url_en == ''
+            card.name = 'New Minion'
+            card.slug = 'new-minion-201'
+            card.save()
+            # поля отображения пересчитываются после записи всех карт, не по каждой связи
+            with django_assert_num_queries(2):
+                card.card_class.add(rogue)
+            RealCard.objects.refresh_presentation()
+        card.refresh_from_db()
+        assert card.page_url_en == '/en/gallery/card/new-minion-201'
+        assert card.css_class == 'rogue'
@@ -1,7 +1,23 @@
 from django.core.management import call_command
+import base64
+import pickle
+import random
+from datetime import timedelta
 import pytest
-from core.services.deck_codes import parse_deckstring
+from django.db import connection, IntegrityError
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse_lazy
+from django.utils.timezone import now
+from core.services.deck_codes import parse_deckstring, parse_many, build_deckstring, _write_varint
 from core.exceptions import DecodeError
+from gallery.models import RealCard, CardClass
+from decks.models import (Deck, Format, SimilarityPosting, SimilarDeck, StatisticsSnapshot, CardFrequency,
+                          DailyDeckCount, DailyCardCount)
+from core.services.deck_utils import find_similar_decks, get_similar_decks, get_render_deck, DumpDeckListSerializer
+from core.services.deck_catalog import decode_deck, record_decoded, save_decoded
+from core.services.pagination import KeysetPaginator
+from core.services.similarity_matrix import compute_similar_decks
+from core.services.statistics import refresh_statistics, get_statistics_context
 
 
 @pytest.mark.django_db
@@ -21,3 +37,356 @@ def test_parse_deckstring(deckstring, deck_data):
     assert set(cards) == set(deck_data[0]), 'данные о картах не совпадают'
     assert heroes == deck_data[1], 'данные о герое не совпадают'
     assert format_ == deck_data[2], 'данные о формате не совпадают'
+
+
+def _random_deck(rnd: random.Random) -> tuple[list[tuple[int, int]], list[int], int]:
+    """ Случайная колода в формате parse_deckstring (30 карт) """
+    cards, total = [], 0
+    for dbf_id in rnd.sample(range(1, 90000), 30):
+        count = 2 if total < 28 and rnd.random() < 0.5 else 1
+        cards.append((dbf_id, count))
+        total += count
+        if total == 30:
+            break
+    return cards, [rnd.randint(1, 90000)], rnd.choice((1, 2, 3))
+
+
+def test_build_deckstring_roundtrip(deckstring, deckstring2):
+    for code in (deckstring, deckstring2):
+        assert build_deckstring(*parse_deckstring(code)) == code, 'код колоды должен собираться в каноническом виде'
+
+    rnd = random.Random(42)
+    for _ in range(500):
+        cards, heroes, format_ = _random_deck(rnd)
+        cards.append((rnd.randint(1, 2 ** 21), rnd.randint(3, 40)))    # карта в n экземплярах
+        parsed_cards, parsed_heroes, parsed_format = parse_deckstring(build_deckstring(cards, heroes, format_))
+        assert sorted(parsed_cards) == sorted(cards)
+        assert parsed_heroes == heroes
+        assert parsed_format == format_
+
+
+def test_parse_deckstring_truncated(deckstring):
+    raw = base64.b64decode(deckstring)
+    with pytest.raises(DecodeError):
+        parse_deckstring(base64.b64encode(raw[:len(raw) // 2]))
+
+
+def test_parse_many(deckstring, deckstring2):
+    result = parse_many([deckstring, 'some random string', deckstring2, deckstring], strict=False)
+    assert len(result) == 4
+    assert result[0] == result[3] == parse_deckstring(deckstring)
+    assert result[1] is None
+    assert result[2] == parse_deckstring(deckstring2)
+    with pytest.raises(DecodeError):
+        parse_many([deckstring, 'some random string'])
+
+
+def _shuffled_deckstring(cards, heroes, format_) -> str:
+    """ Неканонический код колоды: карты внутри групп в обратном порядке """
+    buffer = bytearray(b'\0')
+    for value in (1, format_, len(heroes), *heroes):
+        _write_varint(buffer, value)
+    for count in (1, 2):
+        group = sorted((dbf_id for dbf_id, n in cards if n == count), reverse=True)
+        for value in (len(group), *group):
+            _write_varint(buffer, value)
+    _write_varint(buffer, 0)
+    return base64.b64encode(buffer).decode()
+
+
+@pytest.mark.django_db
+def test_deck_identity_dedup(deck_catalog, deckstring, user):
+    deck = Deck.create_from_deckstring(deckstring)
+    assert deck.inclusions.count() == len(deck_catalog[0])
+    assert Deck.create_from_deckstring(deckstring).pk == deck.pk, 'безымянная колода должна быть уникальной'
+
+    shuffled = _shuffled_deckstring(*deck_catalog)
+    assert shuffled != deckstring
+    assert Deck.create_from_deckstring(shuffled).pk == deck.pk, 'порядок карт в коде не должен влиять на колоду'
+
+    named = Deck.create_from_deckstring(deckstring, author=user.author)
+    assert named.pk != deck.pk and named.identity == deck.identity
+    assert Deck.objects.count() == 2
+
+
+@pytest.mark.django_db
+def test_backfill_deck_identity(deck_catalog, deckstring):
+    deck = Deck.create_from_deckstring(deckstring)
+    Deck.objects.filter(pk=deck.pk).update(identity=None)
+    duplicate = Deck.objects.create(string=_shuffled_deckstring(*deck_catalog),
+                                    deck_class=deck.deck_class, deck_format=deck.deck_format)
+
+    call_command('backfill_deck_identity')
+
+    assert list(Deck.objects.values_list('pk', flat=True)) == [deck.pk]
+    assert not Deck.objects.filter(pk=duplicate.pk).exists()
+    deck.refresh_from_db()
+    assert deck.identity is not None
+
+
+@pytest.mark.django_db
+def test_load_decks_concurrent_duplicate(deck_catalog, deckstring, monkeypatch):
+    deck = Deck.create_from_deckstring(deckstring)
+    # проверка дубликата прошла до записи той же колоды другим процессом
+    monkeypatch.setattr(Deck, 'find_nameless', classmethod(lambda cls, identity: None))
+    serializer = DumpDeckListSerializer(data=[{'string': _shuffled_deckstring(*deck_catalog), 'name': '',
+                                              'author': None, 'created': '2021-01-01T00:00:00Z'}], many=True)
+    assert serializer.is_valid(), serializer.errors
+    with pytest.raises(IntegrityError):
+        serializer.save()       # сохраненная колода не найдена - ошибка не скрывается
+    monkeypatch.undo()
+    monkeypatch.setattr(Deck, 'find_nameless', classmethod(
+        lambda cls, identity, calls=iter([None, deck]): next(calls)))
+    serializer.save()
+    assert list(Deck.objects.values_list('pk', flat=True)) == [deck.pk]
+
+
+@pytest.mark.django_db
+def test_find_similar_decks(deck_catalog):
+    cards, heroes, format_ = deck_catalog
+    x1 = [card for card in cards if card[1] == 1]
+    x2 = [card for card in cards if card[1] == 2]
+    deck = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    Deck.create_from_deckstring(build_deckstring(x1[4:] + x2, heroes, format_))    # 26 совпадений
+    Deck.create_from_deckstring(build_deckstring(x2[2:], heroes, format_))         # 20 совпадений
+    Deck.create_from_deckstring(build_deckstring(x2[3:], heroes, format_))         # 18 совпадений
+    Deck.create_from_deckstring(build_deckstring(cards, heroes, 1))                # другой формат
+
+    similar = find_similar_decks(deck)
+    assert [d.num_matches for d in similar] == [26, 20]
+    assert deck not in similar
+    assert find_similar_decks(deck, limit=1)[0].num_matches == 26
+    assert find_similar_decks(None) == get_similar_decks(None) == []
+
+    SimilarityPosting.objects.rebuild()
+    assert [d.num_matches for d in find_similar_decks(deck)] == [26, 20]
+
+
+@pytest.mark.django_db
+def test_compute_similar_decks(deck_catalog):
+    cards, heroes, format_ = deck_catalog
+    x1 = [card for card in cards if card[1] == 1]
+    x2 = [card for card in cards if card[1] == 2]
+    deck = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    Deck.create_from_deckstring(build_deckstring(x2[3:], heroes, format_))         # 18 совпадений
+    assert compute_similar_decks() == {'partitions': 1, 'decks': 2}
+    assert get_similar_decks(deck) == []
+
+    # новые колоды становятся соседями уже обработанной колоды при инкрементальном расчете
+    deck26 = Deck.create_from_deckstring(build_deckstring(x1[4:] + x2, heroes, format_))
+    deck20 = Deck.create_from_deckstring(build_deckstring(x2[2:], heroes, format_))
+    assert [d.num_matches for d in get_similar_decks(deck26)] == [26, 20]     # еще не рассчитана - поиск по индексу
+    assert compute_similar_decks() == {'partitions': 1, 'decks': 2}
+
+    similar = get_similar_decks(deck)
+    assert [(d.pk, d.num_matches) for d in similar] == [(deck26.pk, 26), (deck20.pk, 20)]
+    assert [(d.pk, d.num_matches) for d in get_similar_decks(deck20)] == [(deck26.pk, 20), (deck.pk, 20)]
+
+    SimilarDeck.objects.all().delete()
+    compute_similar_decks(full=True)
+    assert [d.num_matches for d in get_similar_decks(deck)] == [26, 20]
+
+
+@pytest.mark.django_db
+def test_compute_similar_decks_ties(deck_catalog, monkeypatch):
+    cards, heroes, format_ = deck_catalog
+    x2 = [card for card in cards if card[1] == 2]
+    deck = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    for i in range(3):      # колоды с одинаковым числом совпадений (20) - на границе отбора
+        Deck.create_from_deckstring(build_deckstring(x2[:i] + x2[i + 2:], heroes, format_))
+    monkeypatch.setattr('core.services.similarity_matrix.NUM_SIMILAR_DECKS', 2)
+    compute_similar_decks(full=True)
+    expected = [(d.num_matches, d.pk) for d in find_similar_decks(deck, limit=2)]
+    assert list(deck.neighbours.values_list('num_matches', 'similar_id')) == expected
+
+
+@pytest.mark.django_db
+def test_statistics_snapshot(deck_catalog, django_assert_num_queries, locmem_cache):
+    cards, heroes, format_ = deck_catalog
+    x2 = [card for card in cards if card[1] == 2]
+    Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    snapshot = refresh_statistics()
+    assert (snapshot.num_decks, snapshot.num_standard, snapshot.num_wild) == (1, 1, 0)
+
+    context = get_statistics_context()
+    assert context['decks'].cells[0].items_[0].value == 1
+    with django_assert_num_queries(0):
+        assert get_statistics_context() == context
+
+    # новая колода учитывается в счетчиках без пересчета; популярные карты и отрисованная статистика - не сразу
+    deck = Deck.objects.select_related('deck_format').first()
+    with django_assert_num_queries(1):
+        StatisticsSnapshot.objects.add_deck(deck, {})
+    StatisticsSnapshot.objects.filter(pk=1).update(num_decks=1, num_standard=1)
+    Deck.create_from_deckstring(build_deckstring(x2, heroes, 1))
+    Deck.create_from_deckstring(build_deckstring(x2, heroes, 1))            # дубликат не учитывается
+    snapshot = StatisticsSnapshot.load()
+    assert (snapshot.num_decks, snapshot.num_standard, snapshot.num_wild) == (2, 1, 1)
+    assert snapshot.popular_cards[0][1] == 1
+    assert get_statistics_context()['decks'].cells[0].items_[0].value == 1
+
+    call_command('refresh_statistics')
+    fresh = StatisticsSnapshot.load()
+    assert (fresh.num_decks, fresh.num_highlander) == (2, 0)
+    assert fresh.popular_cards[0][1] == 2
+    assert get_statistics_context()['decks'].cells[0].items_[0].value == 2
+
+
+@pytest.mark.django_db
+def test_deleted_deck_counters(deck_catalog):
+    def counters():
+        snapshot = StatisticsSnapshot.load()
+        return (sorted(CardFrequency.objects.filter(num_decks__gt=0).values_list('card_id', 'num_decks')),
+                sorted(DailyDeckCount.objects.filter(num_decks__gt=0).values_list('deck_class_id', 'num_decks')),
+                sorted(DailyCardCount.objects.filter(num_decks__gt=0).values_list('card_id', 'num_decks')),
+                (snapshot.num_decks, snapshot.num_standard, snapshot.num_wild, snapshot.num_highlander))
+
+    cards, heroes, format_ = deck_catalog
+    refresh_statistics()
+    decks = [Deck.create_from_deckstring(build_deckstring(cards[n:], heroes, format_)) for n in range(3)]
+    Deck.objects.create(string=decks[0].string, deck_class=decks[0].deck_class,
+                        deck_format=decks[0].deck_format).delete()     # не учтенная колода счетчики не меняет
+    decks[1].delete()
+    Deck.objects.filter(pk=decks[2].pk).delete()
+    remaining = counters()
+
+    # счетчики совпадают с пересчитанными по оставшимся колодам
+    SimilarityPosting.objects.rebuild()
+    DailyDeckCount.objects.rebuild()
+    refresh_statistics()
+    assert remaining == counters()
+    assert remaining[-1][0] == 1
+
+
+@pytest.mark.django_db
+def test_decode_deck_without_writes(deck_catalog, deckstring, settings, django_assert_num_queries, locmem_cache):
+    settings.DECODED_DECKS_BATCH_SIZE = 2
+    cards, heroes, format_ = deck_catalog
+    decode_deck(deckstring)                                 # построение каталога процесса
+
+    with django_assert_num_queries(1):                      # только поиск сохраненной колоды того же состава
+        deck = decode_deck(deckstring)
+        assert deck.pk is None and deck.deck_class.name == 'Priest'
+        assert sum(card.number for card in deck.included_cards) == 30
+        assert deck.get_craft_cost() == {'basic': 1200, 'gold': 12000}
+        assert sum(stat['num_cards'] for stat in deck.types_statistics) == 30
+    assert Deck.objects.count() == 0
+    assert find_similar_decks(deck) == []
+
+    saved = Deck.create_from_deckstring(deckstring)
+    assert [card.pk for card in saved.included_cards] == [card.pk for card in deck.included_cards]
+    assert decode_deck(deckstring).pk == saved.pk
+
+    # расшифрованные колоды ставятся в очередь без записи в БД; сохраняются командой, пакетами
+    for n in (1, 2, 2, 3):
+        with django_assert_num_queries(0):
+            record_decoded(decode_deck(build_deckstring(cards[n:], heroes, format_), lookup=False))
+    assert Deck.objects.count() == 1
+    call_command('save_decoded_decks')
+    assert Deck.objects.count() == 4
+    record_decoded(decode_deck(build_deckstring(cards[4:], heroes, format_)))
+    assert save_decoded() == 1 and save_decoded() == 0 and Deck.objects.count() == 5
+
+
+@pytest.mark.django_db
+def test_render_deck_without_queries(deck_catalog, django_assert_num_queries):
+    cards, heroes, format_ = deck_catalog
+    deck = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    # колода передается в пул процессов: рисование рендера использует только загруженные данные
+    deck = pickle.loads(pickle.dumps(get_render_deck(deck.pk)))
+    with django_assert_num_queries(0):
+        assert len(deck.included_cards) == len(cards)
+        assert deck.get_craft_cost()['basic'] == 40 * sum(n for dbf_id, n in cards)
+        assert deck.types_statistics and deck.rarity_statistics
+        assert deck.deck_class.service_name and deck.deck_format.name_en
+
+
+@pytest.mark.django_db
+def test_deck_list_batch_loading(deck_catalog, client, locmem_cache):
+    cards, heroes, format_ = deck_catalog
+    Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    client.get(reverse_lazy('decks:all_decks'))
+    with CaptureQueriesContext(connection) as one_deck:
+        client.get(reverse_lazy('decks:all_decks'))
+
+    for n in range(1, 6):
+        Deck.create_from_deckstring(build_deckstring(cards[n:], heroes, format_))
+    client.get(reverse_lazy('decks:all_decks'))     # число колод изменилось - пересчитывается
+    with CaptureQueriesContext(connection) as six_decks:
+        response = client.get(reverse_lazy('decks:all_decks'))
+    # стоимость создания всех колод страницы загружается сразу - число запросов не зависит от числа колод
+    assert len(six_decks) == len(one_deck)
+    deck = response.context['decks'][0]
+    assert deck.get_craft_cost()['basic'] == 40 * sum(n for dbf_id, n in cards[5:])
+    assert not deck.is_decoded
+    # карты колод - не в разметке страницы, а загружаются при раскрытии списка
+    assert b'class="deck-card-cell"' not in response.content
+    assert response.content.count(b'data-cards-url=') == 6
+
+
+@pytest.mark.django_db
+def test_lazy_deck_cards(deck_catalog, client, user_client, django_assert_num_queries, locmem_cache):
+    cards, heroes, format_ = deck_catalog
+    deck = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_))
+    url = reverse_lazy('decks:deck-cards', kwargs={'deck_id': deck.pk})
+    ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    assert client.get(url).status_code == 302
+    html = client.get(url, **ajax).json()['html']
+    assert html.count('class="deck-card-cell"') == len(cards)
+    # рендеры в подсказках - только в data-атрибутах (загружаются при наведении)
+    render_url = RealCard.objects.get(dbf_id=cards[0][0]).render_url
+    assert html.count(f'data-preview="{render_url}"') == len(cards) and f'src="{render_url}"' not in html
+    with django_assert_num_queries(1):      # только колода (проверка доступа); разметка - из кэша
+        assert client.get(url, **ajax).json()['html'] == html
+
+    # сохраненные колоды доступны только автору
+    user, auth_client = user_client
+    named = Deck.create_from_deckstring(build_deckstring(cards, heroes, format_), author=user.author)
+    named.name = 'My deck'
+    named.save()
+    url = reverse_lazy('decks:deck-cards', kwargs={'deck_id': named.pk})
+    assert auth_client.get(url, **ajax).json()['html'] == html
+    auth_client.logout()
+    assert auth_client.get(url, **ajax).status_code == 403
+
+
+@pytest.mark.django_db
+def test_keyset_pagination(deck_catalog, client, django_assert_num_queries, monkeypatch, locmem_cache):
+    priest, standard = CardClass.objects.get(name='Priest'), Format.objects.get(numerical_designation=2)
+    Deck.objects.bulk_create([Deck(string=f'deck-{i}', identity=f'deck-{i}', deck_class=priest, deck_format=standard)
+                              for i in range(47)])
+    for i, deck in enumerate(Deck.objects.order_by('pk')):
+        Deck.objects.filter(pk=deck.pk).update(created=now() - timedelta(minutes=i // 2))   # пары с равным временем
+    expected = [deck.pk for deck in Deck.nameless.order_by('-created', '-pk')]
+
+    paginator = KeysetPaginator(Deck.nameless.all(), 10)
+    assert paginator.count == 47 and paginator.num_pages == 5
+    with django_assert_num_queries(1):      # число записей - из кэша (запрос - последний pk таблицы)
+        assert KeysetPaginator(Deck.nameless.all(), 10).count == 47
+    # без курсора - смещение от ближайшего края; по курсору - от ключа крайней записи соседней страницы
+    for number in range(1, 6):
+        page = paginator.page(number)
+        assert [deck.pk for deck in page] == expected[(number - 1) * 10:number * 10]
+        for target in range(1, 6):
+            cursor = paginator.encode_cursor(page, target)
+            assert (cursor is None) == (target == number)
+            seek = KeysetPaginator(Deck.nameless.all(), 10, cursor=cursor).page(target)
+            assert [deck.pk for deck in seek] == expected[(target - 1) * 10:target * 10]
+    assert KeysetPaginator(Deck.nameless.all(), 10, cursor='garbage').page(2).object_list == paginator.page(2).object_list
+
+    # переход по номеру в середину списка - от ключа опорной страницы, курсор - только к близким страницам
+    monkeypatch.setattr(KeysetPaginator, 'anchor_pages', 2)
+    paginator = KeysetPaginator(Deck.nameless.all(), 5)
+    assert len(paginator.anchors) == 4
+    for number in range(1, 11):
+        with django_assert_num_queries(4):    # последний pk таблицы, страница, классы и форматы колод
+            page = KeysetPaginator(Deck.nameless.all(), 5).page(number)
+        assert [deck.pk for deck in page] == expected[(number - 1) * 5:number * 5]
+    assert paginator.encode_cursor(paginator.page(1), 3) is not None
+    assert paginator.encode_cursor(paginator.page(1), 4) is None
+    monkeypatch.undo()
+
+    response = client.get(reverse_lazy('decks:all_decks'), {'page': 2})
+    assert [deck.pk for deck in response.context['decks']] == expected[18:36]
+    assert f'cursor={paginator.encode_cursor(response.context["page_obj"], 3)}' in response.content.decode()
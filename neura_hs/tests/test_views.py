@@ -1,6 +1,9 @@
 import pytest
+from asgiref.sync import async_to_sync
 from django.urls import reverse_lazy
 from rest_framework import status
+from decks.models import Deck
+from decks.views import get_deck_render_async
 
 
 class TestDeckViews:
@@ -9,6 +12,17 @@ class TestDeckViews:
         response = client.get(reverse_lazy('decks:index'))
         assert response.status_code == status.HTTP_200_OK, 'Страница создания колоды недоступна'
 
+    @pytest.mark.django_db
+    def test_decode_deck_view(self, client, deck_catalog, deckstring, locmem_cache):
+        response = client.post(reverse_lazy('decks:index'), data={'deckstring': deckstring})
+        assert response.status_code == status.HTTP_200_OK
+        assert response.context['deck'].pk is None and 'Priest' in response.content.decode()
+        assert not Deck.objects.exists(), 'Расшифровка колоды не должна записывать в БД'
+
+    def test_get_deck_render_async_view(self, rf):
+        response = async_to_sync(get_deck_render_async)(rf.get('/decks/get_render/', {'render': 'true'}))
+        assert response.status_code == status.HTTP_302_FOUND, 'Должно быть доступно только для AJAX-запросов'
+
     @pytest.mark.django_db
     def test_all_decks_view(self, client):
         response = client.get(reverse_lazy('decks:all_decks'))
@@ -130,3 +144,10 @@ class TestRealCardViews:
         card = real_card('New Hearthstone Card', card_id='NEW_TEST01', dbf_id=999999)
         response = client.get(reverse_lazy('gallery:real_card', kwargs={'card_slug': card.slug}))
         assert response.status_code == status.HTTP_200_OK, 'Карта Hearthstone недоступна для просмотра'
+
+
+class TestCoreViews:
+    @pytest.mark.django_db
+    def test_statistics_view(self, client, locmem_cache):
+        response = client.get(reverse_lazy('statistics'))
+        assert response.status_code == status.HTTP_200_OK, 'Страница статистики недоступна'